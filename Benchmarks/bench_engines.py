@@ -0,0 +1,156 @@
+"""
+    Compares the Selenium engine of ScrappingCoupon with the async engine of async_engine.py on the
+    synthetic site: shops per minute, peak memory of the scraper and its browsers, and shops per
+    minute per GB of that memory.
+
+    The memory is the resident set of this process and all its children (chromedriver, Chrome and
+    the Playwright driver), sampled from /proc, so it is only measured on Linux.
+
+    Run from the project root:
+        python -m Benchmarks.bench_engines --shops 40 --coupons 10 --concurrency 4 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from Benchmarks.bench_replay import replay
+from cuponation import ScrappingCoupon
+from replay_server import create_server
+from synthetic_site import SyntheticSite
+
+
+class ProcessTreeMemory:
+    def __init__(self, pid=None, interval_seconds=0.5):
+        """
+            Samples the resident memory of a process and its descendants from a daemon thread and keeps
+            the peak.
+        """
+        self.pid = pid or os.getpid()
+        self.interval_seconds = interval_seconds
+        self.peak_bytes = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def available():
+        return os.path.exists(f'/proc/{os.getpid()}/status')
+
+    def process_tree(self):
+        children = {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{name}/stat') as file:
+                    # The command name can hold spaces, the parent pid is the second field after it
+                    parent = int(file.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(name))
+        tree, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, []))
+        return tree
+
+    def rss_bytes(self):
+        total = 0
+        for pid in self.process_tree():
+            try:
+                with open(f'/proc/{pid}/status') as file:
+                    for line in file:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                continue
+        return total
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.rss_bytes())
+            self.stopped.wait(self.interval_seconds)
+
+    def __enter__(self):
+        if self.available():
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class QuietScrappingCoupon(ScrappingCoupon):
+    # Telegram alerts are not sent during a benchmark and the local server is not rate limited
+    RATE_LIMIT_RPS = 0
+
+    def send_telegram_message(self, bot_token, chat_id, message):
+        pass
+
+
+def run_selenium(site, directory):
+    with ProcessTreeMemory() as memory:
+        report = replay(site, directory, replay_allshop=False)
+    return len(report['shops']), report['coupons'], report['wall_seconds'], memory.peak_bytes
+
+
+def run_async(site, directory, concurrency):
+    # Imported here, it needs the optional Playwright package
+    from async_engine import AsyncShopCrawler
+
+    server = create_server(site, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    local_url = f"http://127.0.0.1:{server.server_address[1]}"
+    QuietScrappingCoupon.BASE_URL = local_url
+    QuietScrappingCoupon.file_path = os.path.join(directory, f'async_{concurrency}_links.txt')
+    QuietScrappingCoupon.db_name = os.path.join(directory, f'async_{concurrency}_coupons.db')
+    site.write_links_file(QuietScrappingCoupon.file_path, local_url)
+
+    scraper = QuietScrappingCoupon()
+    crawler = AsyncShopCrawler(scraper, concurrency)
+    start = time.perf_counter()
+    try:
+        with ProcessTreeMemory() as memory:
+            crawler.crawl(scraper.get_urls_from_file())
+    finally:
+        server.shutdown()
+    coupons = scraper.db.get_stats()['live_coupons']
+    return crawler.shops_done, coupons, time.perf_counter() - start, memory.peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare shops per minute per GB of the scraper engines.')
+    parser.add_argument('--shops', type=int, default=40)
+    parser.add_argument('--coupons', type=int, default=10, help='Coupons in the active widget of a shop')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4], help='Pages at once of the async engine')
+    parser.add_argument('--skip-selenium', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.skip_selenium:
+            site = SyntheticSite(args.shops, args.coupons, similar_per_shop=2)
+            results.append(('selenium', *run_selenium(site, directory)))
+        for concurrency in args.concurrency:
+            site = SyntheticSite(args.shops, args.coupons, similar_per_shop=2)
+            results.append((f'async x{concurrency}', *run_async(site, directory, concurrency)))
+
+    if not ProcessTreeMemory.available():
+        print("Memory is only measured on Linux, the per GB columns are empty.")
+    print(f"\n{'Engine':<14} {'Shops':>6} {'Coupons':>8} {'Seconds':>8} {'Shops/min':>10} {'Peak GB':>8} "
+          f"{'Shops/min/GB':>13}")
+    for engine, shops, coupons, seconds, peak_bytes in results:
+        shops_per_minute = shops / seconds * 60 if seconds else 0.0
+        peak_gb = peak_bytes / 1024 ** 3
+        per_gb = f"{shops_per_minute / peak_gb:13.1f}" if peak_gb else f"{'':>13}"
+        print(f"{engine:<14} {shops:6} {coupons:8} {seconds:8.1f} {shops_per_minute:10.1f} {peak_gb:8.2f} {per_gb}")
+
+
+if __name__ == '__main__':
+    main()
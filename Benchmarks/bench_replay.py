@@ -0,0 +1,297 @@
+"""
+    Benchmarks ScrappingCoupon offline, against a recorded snapshot of cuponation.com.au.
+
+    record:    crawls a few live shops and saves every shop page and voucher popup to a zip archive.
+    replay:    serves the archive with replay_server.py and runs start_webdriver and collect_vouchers
+               against it, reporting the wall time per shop, the time per stage and the coupons per minute.
+    synthetic: the same benchmark against the generated site of synthetic_site.py.
+
+    Run from the project root:
+        python -m Benchmarks.bench_replay record snapshot.zip --shops 20
+        python -m Benchmarks.bench_replay replay snapshot.zip --report after.json --baseline before.json
+        python -m Benchmarks.bench_replay synthetic --shops 50 --coupons 100
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from cuponation import ScrappingCoupon
+from replay_server import ReplaySite, SnapshotArchive, create_server, voucher_key
+from synthetic_site import SyntheticSite
+
+# Stages timed inside collect_vouchers, the rest of it is the click on the card, the popup and the terms
+VOUCHER_STAGES = ('see_more', 'button_name', 'code_and_url', 'close_popup', 'save')
+
+
+class StageTimings:
+    def __init__(self):
+        self.stages = {}
+        self.shops = []
+        self.shop = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def start_shop(self, url):
+        self.end_shop()
+        self.shop = {'url': url, 'started': time.perf_counter(), 'coupons': 0}
+
+    def end_shop(self):
+        if self.shop is None:
+            return
+        self.shop['seconds'] = time.perf_counter() - self.shop.pop('started')
+        self.shops.append(self.shop)
+        self.shop = None
+
+    def report(self):
+        total_seconds = sum(shop['seconds'] for shop in self.shops)
+        coupons = sum(shop['coupons'] for shop in self.shops)
+        stages = dict(self.stages)
+        stages['click_popup_and_terms'] = stages.pop('collect_vouchers', 0.0) - sum(
+            stages.get(name, 0.0) for name in VOUCHER_STAGES)
+        stages['widget_checks_and_sweep'] = stages.pop('scrape_shop', 0.0) - sum(
+            stages.get(name, 0.0) for name in VOUCHER_STAGES + ('click_popup_and_terms',))
+        return {
+            'shops': self.shops,
+            'stages': stages,
+            'total_seconds': total_seconds,
+            'coupons': coupons,
+            'coupons_per_minute': coupons / (total_seconds / 60) if total_seconds else 0.0,
+        }
+
+
+class RecordingScrappingCoupon(ScrappingCoupon):
+    """
+        Scrapes the live site like ScrappingCoupon and saves what it sees in a SnapshotArchive.
+    """
+    archive = None
+
+    def __init__(self):
+        super().__init__()
+        self.recording_url = None
+        self.save_next_page = False
+        self.current_key = None
+
+    def alphabet_section(self):
+        result = super().alphabet_section()
+        self.archive.save_allshop(self.webdriver.page_source)
+        return result
+
+    def record_shop(self, url, name):
+        self.recording_url = url
+        self.setup_logger(url)
+        self.webdriver.get(url)
+        self.webdriver.maximize_window()
+        # Shops without vouchers keep this page, the others are saved again after the see more click
+        self.archive.save_shop_page(url, self.webdriver.page_source, name)
+        self.scrape_all_shop_links()
+
+    def collect_vouchers(self, xpath, dedup=False):
+        self.save_next_page = True
+        return super().collect_vouchers(xpath, dedup)
+
+    def check_for_see_more_btn(self):
+        result = super().check_for_see_more_btn()
+        if self.save_next_page:
+            self.save_next_page = False
+            self.archive.save_shop_page(self.recording_url, self.webdriver.page_source)
+        return result
+
+    def check_button_name(self, xpath, index):
+        self.current_key = voucher_key(xpath, index)
+        return super().check_button_name(xpath, index)
+
+    def get_code_or_url_from_voucher(self, button_text):
+        # The popup tab is the current one here, the tab of the shop behind the voucher is read by the scraper
+        popup_html = self.webdriver.page_source
+        result = super().get_code_or_url_from_voucher(button_text)
+        self.archive.save_voucher(self.recording_url, self.current_key, popup_html, self.coupon.url)
+        return result
+
+
+class ReplayScrappingCoupon(ScrappingCoupon):
+    """
+        ScrappingCoupon with timings around its stages. Telegram alerts are not sent during a benchmark.
+    """
+    timings = None
+    replay_allshop = True
+    # The local replay server is not rate limited, the benchmark measures the scraper
+    RATE_LIMIT_RPS = 0
+
+    def send_telegram_message(self, bot_token, chat_id, message):
+        pass
+
+    def alphabet_section(self):
+        if self.replay_allshop:
+            with self.timings.stage('alphabet_section'):
+                return super().alphabet_section()
+
+    def setup_logger(self, url):
+        # start_webdriver calls it first for every shop
+        self.timings.start_shop(url)
+        return super().setup_logger(url)
+
+    def scrape_all_shop_links(self):
+        self.timings.stages['page_load'] = self.timings.stages.get('page_load', 0.0) + (
+            time.perf_counter() - self.timings.shop['started'])
+        with self.timings.stage('scrape_shop'):
+            return super().scrape_all_shop_links()
+
+    def update_url_status(self, url, status, notify=True):
+        # start_webdriver calls it last for every shop
+        result = super().update_url_status(url, status, notify)
+        self.timings.end_shop()
+        return result
+
+    def collect_vouchers(self, xpath, dedup=False):
+        with self.timings.stage('collect_vouchers'):
+            return super().collect_vouchers(xpath, dedup)
+
+    def check_for_see_more_btn(self):
+        with self.timings.stage('see_more'):
+            return super().check_for_see_more_btn()
+
+    def check_button_name(self, xpath, index):
+        with self.timings.stage('button_name'):
+            return super().check_button_name(xpath, index)
+
+    def get_code_or_url_from_voucher(self, button_text):
+        with self.timings.stage('code_and_url'):
+            return super().get_code_or_url_from_voucher(button_text)
+
+    def close_alert(self):
+        with self.timings.stage('close_popup'):
+            return super().close_alert()
+
+    def flush_coupons(self):
+        if self.timings.shop is not None:
+            self.timings.shop['coupons'] += len(self.pending_coupons)
+        with self.timings.stage('save'):
+            return super().flush_coupons()
+
+
+def record(args, directory):
+    archive = SnapshotArchive(args.archive)
+    archive.open_for_writing(ScrappingCoupon.BASE_URL)
+    RecordingScrappingCoupon.archive = archive
+    RecordingScrappingCoupon.file_path = os.path.join(directory, 'shop_links.txt')
+    RecordingScrappingCoupon.db_name = os.path.join(directory, 'record_coupons.db')
+
+    scrapping_coupon = RecordingScrappingCoupon()
+    try:
+        if args.urls:
+            shops = [(url, None) for url in args.urls]
+        else:
+            scrapping_coupon.alphabet_section()
+            shops = [tuple(link[:2]) for link in scrapping_coupon.read_links()][:args.shops]
+        for url, name in shops:
+            print(f"Recording {url}")
+            scrapping_coupon.record_shop(url, name)
+    finally:
+        scrapping_coupon.close_webdriver()
+        archive.close()
+    print(f"Recorded {len(shops)} shops to {args.archive} ({os.path.getsize(args.archive) / 1024:.0f} KB)")
+
+
+def replay(site, directory, replay_allshop=True):
+    server = create_server(site, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    local_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    timings = StageTimings()
+    ReplayScrappingCoupon.timings = timings
+    ReplayScrappingCoupon.replay_allshop = replay_allshop
+    ReplayScrappingCoupon.BASE_URL = local_url
+    ReplayScrappingCoupon.file_path = os.path.join(directory, 'shop_links.txt')
+    ReplayScrappingCoupon.db_name = os.path.join(directory, 'replay_coupons.db')
+    site.write_links_file(ReplayScrappingCoupon.file_path, local_url)
+
+    scrapping_coupon = ReplayScrappingCoupon()
+    start = time.perf_counter()
+    try:
+        scrapping_coupon.start_webdriver()
+    finally:
+        timings.end_shop()
+        scrapping_coupon.close_webdriver()
+        server.shutdown()
+    report = timings.report()
+    report['wall_seconds'] = time.perf_counter() - start
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'Shop':<60} {'Seconds':>9} {'Coupons':>8}")
+    for shop in report['shops']:
+        print(f"{shop['url']:<60} {shop['seconds']:9.2f} {shop['coupons']:8}")
+
+    print(f"\n{'Stage':<28} {'Seconds':>9}" + (f" {'Baseline':>9} {'Change':>8}" if baseline else ''))
+    for name, seconds in sorted(report['stages'].items(), key=lambda item: -item[1]):
+        line = f"{name:<28} {seconds:9.2f}"
+        if baseline and name in baseline['stages']:
+            before = baseline['stages'][name]
+            line += f" {before:9.2f} {(seconds - before) / before * 100 if before else 0:+7.1f}%"
+        print(line)
+
+    print(f"\nShops: {len(report['shops'])}, coupons: {report['coupons']}, "
+          f"time in shops: {report['total_seconds']:.1f} s, wall time: {report['wall_seconds']:.1f} s")
+    line = f"Coupons per minute: {report['coupons_per_minute']:.1f}"
+    if baseline:
+        line += f" (baseline {baseline['coupons_per_minute']:.1f})"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record cuponation.com.au and benchmark the scraper on the replay.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record live shops to a snapshot archive')
+    record_parser.add_argument('archive')
+    record_parser.add_argument('--shops', type=int, default=20, help='Number of shops of the allshop page')
+    record_parser.add_argument('--urls', nargs='*', help='Record these shop URLs instead')
+
+    replay_parser = subparsers.add_parser('replay', help='Benchmark the scraper against a snapshot archive')
+    replay_parser.add_argument('archive')
+
+    synthetic_parser = subparsers.add_parser('synthetic', help='Benchmark the scraper against a synthetic site')
+    synthetic_parser.add_argument('--shops', type=int, default=50)
+    synthetic_parser.add_argument('--coupons', type=int, default=30, help='Coupons in the active widget of a shop')
+    synthetic_parser.add_argument('--seed', type=int, default=0)
+
+    for subparser in (replay_parser, synthetic_parser):
+        subparser.add_argument('--report', help='Save the report as JSON')
+        subparser.add_argument('--baseline', help='JSON report of an earlier run to compare with')
+        subparser.add_argument('--skip-allshop', action='store_true', help="Don't open the allshop page")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.command == 'record':
+            record(args, directory)
+            return
+        if args.command == 'replay':
+            site = ReplaySite(SnapshotArchive(args.archive).open_for_reading())
+            report = replay(site, directory, bool(site.manifest.get('allshop')) and not args.skip_allshop)
+        else:
+            site = SyntheticSite(args.shops, args.coupons, seed=args.seed)
+            report = replay(site, directory, not args.skip_allshop)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
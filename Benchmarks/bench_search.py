@@ -0,0 +1,106 @@
+"""
+    Benchmarks the full text coupon search against the LIKE scan it replaces.
+
+    Run from the project root:
+        python -m Benchmarks.bench_search --coupons 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from ManageDB import Database
+
+COMMON_WORDS = ['free', 'shipping', 'delivery', 'sitewide', 'sale', 'clearance', 'members', 'students', 'new',
+                'customers', 'orders', 'over', 'shoes', 'dresses', 'furniture', 'electronics', 'beauty', 'travel',
+                'flights', 'hotels', 'bundle', 'gift', 'cards', 'selected', 'items', 'full', 'priced', 'exclusive']
+# Product and brand words follow a Zipf distribution like real catalogue text
+WORDS = COMMON_WORDS + [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(4, 9)))
+                        for _ in range(20000)]
+CUMULATIVE_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+OFFERS = ['10%', '15%', '20%', '25%', '30%', '50%', '$5', '$10', '$20', '$50']
+QUERIES = ['free shipping', '20%', '$10 off', 'stud', 'exclusive members', 'furniture sale', 'gift car']
+
+
+def build_database(db_name, number_of_coupons, number_of_shops):
+    db = Database(db_name)
+    db.create_table()
+    db.connect()
+    batch = []
+    for i in range(number_of_coupons):
+        offer = random.choice(OFFERS)
+        title = f"{offer} off {' '.join(random.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=3))}"
+        description = ' '.join(random.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=12))
+        batch.append((title, f"{description} {i}", offer, ' '.join(random.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=3)),
+                      ' '.join(random.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=3)), f"Shop {i % number_of_shops}",
+                      '2024-01-01 00:00:00'))
+        if len(batch) == 50000:
+            db.cursor.executemany('''
+                INSERT INTO coupons (title, description, offer, limitations_for_users, limitations_on_brands,
+                    company_name, last_scrapped) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        db.cursor.executemany('''
+            INSERT INTO coupons (title, description, offer, limitations_for_users, limitations_on_brands,
+                company_name, last_scrapped) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+    db.conn.commit()
+    db.close()
+    return db
+
+
+def time_function(label, function, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(f"{label:<45} p50 {statistics.median(durations):9.3f} ms   p99 {p99:9.3f} ms")
+
+
+def like_scan(db, text):
+    # Ranked like the search, title matches first, so the scan can't stop at the first 20 rows
+    pattern = f"%{text}%"
+    db.connect()
+    db.cursor.execute('''
+        SELECT id, title FROM coupons
+        WHERE deleted_at IS NULL AND (title LIKE ? OR description LIKE ? OR limitations_for_users LIKE ?
+            OR limitations_on_brands LIKE ? OR company_name LIKE ?)
+        ORDER BY title LIKE ? DESC, id
+        LIMIT 20
+    ''', (pattern,) * 6)
+    rows = db.cursor.fetchall()
+    db.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FTS5 coupon search.')
+    parser.add_argument('--coupons', type=int, default=1000000)
+    parser.add_argument('--shops', type=int, default=5000)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        db = build_database(os.path.join(directory, 'bench_coupons.db'), args.coupons, args.shops)
+        print(f"Generated and indexed {args.coupons} coupons in {time.perf_counter() - start:.1f} s")
+
+        for text in QUERIES:
+            time_function(f"FTS  '{text}'", lambda: db.search_coupons(text), args.repeats)
+        for text in QUERIES:
+            time_function(f"LIKE '{text}'", lambda: like_scan(db, text), max(1, args.repeats // 10))
+
+        start = time.perf_counter()
+        db.rebuild_search_index()
+        print(f"Rebuild of the search indexes: {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
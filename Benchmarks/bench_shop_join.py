@@ -0,0 +1,82 @@
+"""
+    Benchmarks the shops/coupons join queries on a generated database.
+
+    Run from the project root:
+        python -m Benchmarks.bench_shop_join --shops 5000 --coupons 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from ManageDB import Database
+
+
+def build_database(db_name, number_of_shops, number_of_coupons):
+    db = Database(db_name)
+    db.create_table()
+    db.upsert_shops([(f"https://www.cuponation.com.au/shop-{i}", f"Shop {i}") for i in range(number_of_shops)])
+
+    db.connect()
+    batch = []
+    for i in range(number_of_coupons):
+        shop = random.randrange(number_of_shops)
+        batch.append((f"Coupon {i}", f"Description {i}", '20%', f"Shop {shop}", shop + 1,
+                      '2024-01-01 00:00:00'))
+        if len(batch) == 50000:
+            db.cursor.executemany('''
+                INSERT INTO coupons (title, description, offer, company_name, shop_id, last_scrapped)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        db.cursor.executemany('''
+            INSERT INTO coupons (title, description, offer, company_name, shop_id, last_scrapped)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', batch)
+    db.conn.commit()
+    db.close()
+    return db
+
+
+def time_query(label, function, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(f"{label:<40} p50 {statistics.median(durations):8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the shops/coupons join queries.')
+    parser.add_argument('--shops', type=int, default=5000)
+    parser.add_argument('--coupons', type=int, default=1000000)
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, 'bench_coupons.db')
+        start = time.perf_counter()
+        db = build_database(db_name, args.shops, args.coupons)
+        print(f"Generated {args.coupons} coupons for {args.shops} shops in {time.perf_counter() - start:.1f} s")
+
+        db.connect()
+        plan = db.cursor.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT c.*, s.name FROM coupons c JOIN shops s ON s.id = c.shop_id WHERE c.shop_id = ?
+        ''', (1,)).fetchall()
+        db.close()
+        print("Query plan:", '; '.join(row[-1] for row in plan))
+
+        time_query('Coupons of one shop (join)', lambda: db.get_shop_coupons(random.randint(1, args.shops)),
+                   args.repeats)
+        time_query('Shops with coupon count', db.get_shops_with_coupon_count, max(1, args.repeats // 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+    Guards the startup time of cuponation.py for the commands that don't need a browser.
+
+    Every command runs in a fresh interpreter a few times and the median wall time is reported next to
+    an empty interpreter. The benchmark fails when a database command takes longer than the budget over
+    the empty interpreter, or when importing cuponation loads Selenium, undetected_chromedriver or requests.
+
+    Run from the project root:
+        python -m Benchmarks.bench_startup --repeat 10 --budget-ms 150
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that should only be imported when a crawl or an alert needs them
+HEAVY_MODULES = ('selenium', 'undetected_chromedriver', 'requests')
+
+
+def time_command(command, repeat, cwd):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the cuponation.py commands.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=150,
+                        help='Allowed time of a database command over an empty interpreter')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, 'startup_coupons.db')
+        script = os.path.join(root, 'cuponation.py')
+        commands = {
+            'empty interpreter': [sys.executable, '-c', 'pass'],
+            'import cuponation': [sys.executable, '-c', 'import cuponation'],
+            'stats': [sys.executable, script, '--db', db_name, 'stats'],
+            'sweep': [sys.executable, script, '--db', db_name, 'sweep'],
+            'export': [sys.executable, script, '--db', db_name, 'export', '--output', os.devnull],
+        }
+        # The first run creates the database, it is not part of the timings
+        subprocess.run(commands['stats'], cwd=root, check=True, stdout=subprocess.DEVNULL)
+        medians = {name: time_command(command, args.repeat, root) for name, command in commands.items()}
+
+        loaded = subprocess.run(
+            [sys.executable, '-c', f"import sys, cuponation; print(','.join(m for m in {HEAVY_MODULES!r} "
+                                   f"if m in sys.modules))"],
+            cwd=root, check=True, capture_output=True, text=True).stdout.strip()
+
+    baseline = medians['empty interpreter']
+    print(f"{'Command':<20} {'Median ms':>10} {'Over empty':>11}")
+    for name, median in medians.items():
+        print(f"{name:<20} {median:10.1f} {median - baseline:11.1f}")
+
+    failures = []
+    if loaded:
+        failures.append(f"importing cuponation loads {loaded}")
+    for name in ('stats', 'sweep', 'export'):
+        if medians[name] - baseline > args.budget_ms:
+            failures.append(f"{name} takes {medians[name] - baseline:.0f} ms over the budget of {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("Startup is within the budget.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+    Benchmarks CouponSync against a local stand-in for the WordPress endpoint.
+
+    The stand-in server accepts the batches, ignores repeated idempotency keys, answers some
+    requests with 503 to exercise the retries and checks that every coupon arrived in its final state.
+
+    Run from the project root:
+        python -m Benchmarks.bench_wordpress_sync --coupons 20000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ManageDB import Database
+from wordpress_sync import CouponSync
+
+
+class StandInWordPress(BaseHTTPRequestHandler):
+    coupons = {}
+    seen_keys = set()
+    duplicate_requests = 0
+    failure_rate = 0.0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if random.random() < self.failure_rate:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+
+        key = self.headers['Idempotency-Key']
+        with self.lock:
+            if key in self.seen_keys:
+                StandInWordPress.duplicate_requests += 1
+            else:
+                self.seen_keys.add(key)
+                for item in json.loads(body)['items']:
+                    if item['operation'] == 'upsert':
+                        self.coupons[item['id']] = item['coupon']
+                    else:
+                        self.coupons.pop(item['id'], None)
+
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_database(db_name, number_of_coupons):
+    # Expire coupons on the first missed crawl so the delta also contains removals
+    db = Database(db_name, missed_limit=1, grace_hours=0)
+    db.create_table()
+    db.connect()
+    db.cursor.executemany('''
+        INSERT INTO coupons (title, description, offer, company_name, last_scrapped) VALUES (?, ?, ?, ?, ?)
+    ''', [(f"Coupon {i}", f"Description {i}", '10%', f"Shop {i % 500}", '2024-01-01 00:00:00')
+          for i in range(number_of_coupons)])
+    for coupon_id in range(1, number_of_coupons + 1):
+        db.record_change(coupon_id, 'inserted')
+    db.conn.commit()
+    db.close()
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the incremental WordPress sync.')
+    parser.add_argument('--coupons', type=int, default=20000)
+    parser.add_argument('--updates', type=int, default=2000, help='Coupons changed after the first sync')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    args = parser.parse_args()
+
+    StandInWordPress.failure_rate = args.failure_rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInWordPress)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/wp-json/coupons/v1/sync"
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = build_database(os.path.join(directory, 'bench_coupons.db'), args.coupons)
+        coupon_sync = CouponSync('bench', endpoint, db_name=db.db_name, batch_size=args.batch_size,
+                                 max_workers=args.workers, backoff_seconds=0.01)
+
+        print("Initial sync:")
+        initial = coupon_sync.sync()
+
+        # Change some coupons, remove some others, then sync the delta only
+        for coupon_id in random.sample(range(1, args.coupons + 1), args.updates):
+            db.insert_coupon(f"Coupon {coupon_id - 1}", f"Description {coupon_id - 1}", '25%', None, None, None,
+                             None, 'SAVE25', None, f"Shop {(coupon_id - 1) % 500}")
+        db.update_last_scrapped_column('Shop 0', '9999-12-31 00:00:00')
+
+        print("Delta sync:")
+        delta = coupon_sync.sync()
+
+        db.connect()
+        live = dict(db.cursor.execute("SELECT id, offer FROM coupons WHERE deleted_at IS NULL").fetchall())
+        db.close()
+
+    server.shutdown()
+    print(f"Initial: {initial['coupons_per_second']:.0f} coupons/s, delta: {delta['coupons_per_second']:.0f} coupons/s")
+    synced = {coupon_id: coupon['offer'] for coupon_id, coupon in StandInWordPress.coupons.items()}
+    print(f"Coupons on the stand-in: {len(synced)}, live in the database: {len(live)}, "
+          f"in sync: {synced == live}, duplicate batches ignored: {StandInWordPress.duplicate_requests}")
+    if synced != live:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+    Load test of the database side of a crawl at catalogue scale, without a browser.
+
+    The coupons of every shop of synthetic_site.py are saved with Database.insert_coupons and the
+    shop is swept with update_last_scrapped_column, like scrape_all_shop_links does. Each round is
+    a new crawl where part of the coupons changed, so the sweep expires the ones that disappeared.
+    A pool of workers takes the shops from a shared frontier to show how the writes scale.
+
+    Run from the project root:
+        python -m Benchmarks.load_test_crawl --shops 10000 --coupons 100 --rounds 3 --workers 4
+"""
+import argparse
+import contextlib
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from ManageDB import Database
+from synthetic_site import SyntheticSite
+
+
+def crawl_round(site, db_name, workers, counters):
+    frontier = queue.Queue()
+    for shop in site.shops:
+        frontier.put(shop)
+    lock = threading.Lock()
+
+    def worker():
+        # One Database object per worker, it keeps its connection on the instance
+        db = Database(db_name, missed_limit=1, grace_hours=0)
+        while True:
+            try:
+                shop = frontier.get_nowait()
+            except queue.Empty:
+                return
+            crawl_started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            start = time.perf_counter()
+            statuses = db.insert_coupons(site.generate_coupons(shop))
+            saved = time.perf_counter()
+            expired = db.update_last_scrapped_column(shop['name'], crawl_started_at)
+            swept = time.perf_counter()
+            with lock:
+                for status, count in statuses.items():
+                    counters[status] += count
+                counters['expired'] += expired
+                counters['save_seconds'] += saved - start
+                counters['sweep_seconds'] += swept - saved
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the coupon writes and sweeps of a crawl.')
+    parser.add_argument('--shops', type=int, default=10000)
+    parser.add_argument('--coupons', type=int, default=100, help='Coupons in the active widget of every shop')
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--churn', type=float, default=0.1)
+    parser.add_argument('--verbose', action='store_true', help='Keep the per coupon output of Database')
+    args = parser.parse_args()
+
+    site = SyntheticSite(args.shops, args.coupons, churn=args.churn)
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, 'load_coupons.db')
+        Database(db_name).create_table()
+
+        for round_number in range(args.rounds):
+            site.round_number = round_number
+            counters = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'expired': 0, 'save_seconds': 0.0,
+                        'sweep_seconds': 0.0}
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull:
+                with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+                    crawl_round(site, db_name, args.workers, counters)
+            seconds = time.perf_counter() - start
+
+            coupons = counters['inserted'] + counters['updated'] + counters['unchanged']
+            print(f"Round {round_number}: {args.shops} shops in {seconds:.1f} s "
+                  f"({args.shops / seconds * 60:.0f} shops/min, {coupons / seconds * 60:.0f} coupons/min)")
+            print(f"    inserted {counters['inserted']}, updated {counters['updated']}, "
+                  f"unchanged {counters['unchanged']}, expired {counters['expired']}")
+            print(f"    time in workers: save {counters['save_seconds']:.1f} s, sweep {counters['sweep_seconds']:.1f} s")
+
+        print(f"Database size: {os.path.getsize(db_name) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
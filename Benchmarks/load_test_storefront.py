@@ -0,0 +1,126 @@
+"""
+    Load test of the storefront API while a crawler-like writer keeps updating coupons.
+
+    Starts the API in-process over a generated database (or targets --url), runs concurrent
+    clients that mix company, code and change queries, revalidating half of them with
+    If-None-Match, and reports throughput with p50/p99 latency.
+
+    Run from the project root:
+        python -m Benchmarks.load_test_storefront --coupons 200000 --clients 16 --seconds 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+
+from ManageDB import Database
+from storefront_api import create_server
+
+
+def build_database(db_name, number_of_coupons, number_of_shops):
+    db = Database(db_name)
+    db.create_table()
+    db.connect()
+    db.cursor.executemany('''
+        INSERT INTO coupons (title, description, offer, code, company_name, last_scrapped) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(f"Coupon {i}", f"Description {i}", '10%', f"CODE{i % 1000}", f"Shop {i % number_of_shops}",
+           '2024-01-01 00:00:00') for i in range(number_of_coupons)])
+    db.conn.commit()
+    db.close()
+    return db
+
+
+def run_client(base_url, number_of_shops, deadline, latencies, statuses, lock):
+    session = requests.Session()
+    etags = {}
+    while time.perf_counter() < deadline:
+        choice = random.random()
+        if choice < 0.7:
+            path = f"/coupons?company=Shop%20{random.randrange(number_of_shops)}&limit=50"
+        elif choice < 0.9:
+            path = f"/coupons/code/CODE{random.randrange(1000)}"
+        else:
+            path = "/changes?since=0&limit=100"
+
+        headers = {}
+        if path in etags and random.random() < 0.5:
+            headers['If-None-Match'] = etags[path]
+
+        start = time.perf_counter()
+        response = session.get(base_url + path, headers=headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        if 'ETag' in response.headers:
+            etags[path] = response.headers['ETag']
+
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+def run_writer(db, number_of_shops, deadline, counters):
+    # Behaves like the crawler, one coupon per transaction
+    while time.perf_counter() < deadline:
+        i = random.randrange(1000000)
+        db.insert_coupon(f"New coupon {i}", None, '15%', None, None, None, None, f"CODE{i % 1000}", None,
+                         f"Shop {i % number_of_shops}")
+        counters['writes'] += 1
+        time.sleep(0.05)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the storefront API.')
+    parser.add_argument('--url', help='Base URL of a running API, a local one is started when missing')
+    parser.add_argument('--coupons', type=int, default=200000)
+    parser.add_argument('--shops', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        writer_thread = None
+        counters = {'writes': 0}
+        deadline = time.perf_counter() + args.seconds
+
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            db = build_database(os.path.join(directory, 'bench_coupons.db'), args.coupons, args.shops)
+            server = create_server(db.db_name, port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            deadline = time.perf_counter() + args.seconds
+            writer_thread = threading.Thread(target=run_writer, args=(db, args.shops, deadline, counters))
+            writer_thread.start()
+
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        clients = [threading.Thread(target=run_client,
+                                    args=(base_url, args.shops, deadline, latencies, statuses, lock))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        if writer_thread:
+            writer_thread.join()
+        if server:
+            server.shutdown()
+
+    latencies.sort()
+    print(f"Requests: {len(latencies)} ({len(latencies) / args.seconds:.0f}/s), statuses: {statuses}, "
+          f"writes during the test: {counters['writes']}")
+    print(f"Latency p50 {percentile(latencies, 0.5):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
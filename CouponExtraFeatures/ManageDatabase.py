@@ -1,7 +1,11 @@
 import sqlite3
+from datetime import datetime, timedelta
 
 
 class DatabaseDetails:
+    # Default age after which the details of a company are scraped again
+    REFRESH_TTL_DAYS = 7
+
     def __init__(self, db_name='coupons_detail.db'):
         self.db_name = db_name
         self.conn = None
@@ -18,25 +22,108 @@ class DatabaseDetails:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 company_name TEXT,
                 company_image TEXT,
-                about TEXT
+                about TEXT,
+                last_refreshed TEXT  -- Timestamp of the last time the details were scraped
             )
         ''')
+
+        # Older databases were created without the last_refreshed column
+        columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(coupons_details)")]
+        if 'last_refreshed' not in columns:
+            self.cursor.execute("ALTER TABLE coupons_details ADD COLUMN last_refreshed TEXT")
+
+        # Keep only the newest row of every company before enforcing uniqueness
+        self.cursor.execute('''
+            DELETE FROM coupons_details
+            WHERE id NOT IN (SELECT MAX(id) FROM coupons_details GROUP BY company_name)
+        ''')
+        self.cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_coupons_details_company_name
+            ON coupons_details (company_name)
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_coupons_details_last_refreshed
+            ON coupons_details (last_refreshed)
+        ''')
         self.conn.commit()
         self.close()
 
     def insert_details(self, company_name, company_image, about):
+        """
+            Inserts the details of a company, or refreshes them if the company already exists.
+            Kept for backwards compatibility, it is a single row call of upsert_details.
+        """
+        self.upsert_details([(company_name, company_image, about)])
+
+    def upsert_details(self, details):
+        """
+            Inserts or updates the details of many companies using a single connection and transaction.
+            Every written row gets its last_refreshed column set to the current timestamp.
+
+            Args:
+                details (list): A list of (company_name, company_image, about) tuples.
+
+            Returns:
+                int: The number of rows written.
+        """
+        if not details:
+            return 0
+
+        current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [(company_name, company_image, about, current_timestamp)
+                for company_name, company_image, about in details]
+
         self.connect()
         try:
-            # Insert a new row into the coupons_details table
-            self.cursor.execute('''
-                INSERT INTO coupons_details (company_name, company_image, about)
-                VALUES (?, ?, ?)
-            ''', (company_name, company_image, about))
+            self.cursor.executemany('''
+                INSERT INTO coupons_details (company_name, company_image, about, last_refreshed)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(company_name) DO UPDATE SET
+                    company_image = excluded.company_image,
+                    about = excluded.about,
+                    last_refreshed = excluded.last_refreshed
+            ''', rows)
             self.conn.commit()
-            print(f"Details inserted: {company_name}")
+            print(f"Details upserted: {len(rows)}")
         except sqlite3.Error as e:
-            print(f"Error inserting details: {e}")
+            self.conn.rollback()
+            rows = []
+            print(f"Error upserting details: {e}")
+        self.close()
+        return len(rows)
+
+    def get_stale_companies(self, ttl_days=None):
+        """
+            Retrieves the companies whose details were never refreshed or are older than the TTL.
+            Both conditions are read from the index on last_refreshed.
+
+            Args:
+                ttl_days (int): Age in days after which the details are stale, defaults to REFRESH_TTL_DAYS.
+
+            Returns:
+                set: The names of the companies that need to be scraped again.
+        """
+        ttl_days = self.REFRESH_TTL_DAYS if ttl_days is None else ttl_days
+        threshold = (datetime.now() - timedelta(days=ttl_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+        self.connect()
+        self.cursor.execute('''
+            SELECT company_name FROM coupons_details
+            WHERE last_refreshed IS NULL OR last_refreshed < ?
+        ''', (threshold,))
+        stale_companies = {row[0] for row in self.cursor.fetchall()}
+        self.close()
+        return stale_companies
+
+    def get_company_names(self):
+        """
+            Returns:
+                set: The names of the companies that have details, read from the unique index.
+        """
+        self.connect()
+        company_names = {row[0] for row in self.cursor.execute("SELECT company_name FROM coupons_details")}
         self.close()
+        return company_names
 
     def get_all_columns(self):
         self.connect()
@@ -65,4 +152,4 @@ class DatabaseDetails:
 # if __name__ == "__main__":
 #     db = DatabaseDetails()
 #     db.create_table()
-#     db.insert_details("https://example.com/image.png", "This is a description about the company.")
\ No newline at end of file
+#     db.insert_details("https://example.com/image.png", "This is a description about the company.")
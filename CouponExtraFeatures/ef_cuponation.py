@@ -12,6 +12,8 @@ from ManageDatabase import DatabaseDetails
 
 class ScrapeCouponIconAndAbout:
     file_path = 'shop_links.txt'
+    # Number of scraped companies kept in memory before they are written to the database
+    batch_size = 20
 
     def __init__(self):
         """
@@ -23,26 +25,47 @@ class ScrapeCouponIconAndAbout:
         self.chrome_options = uc.ChromeOptions()
         self.webdriver = uc.Chrome(options=self.chrome_options)
         self.detail_of_coupon = {}
+        self.pending_details = []
+        # URLs scraped since the last flush, they are marked True once their details are in the database
+        self.pending_urls = []
         self.db = DatabaseDetails()  # Creating an instance of ManageDB
         self.db.create_table()  # Ensure the table is created
 
     def start_webdriver(self):
         """
             Begins the web scraping process by first checking and scraping all links,
-            then iterates through URLs from a file. For each URL, configures the logger,
-            starts the WebDriver, maximizes the browser window, and performs scraping.
-            Updates the URL status to 'True' after scraping is complete.
+            then iterates through the URLs whose details are missing or older than the
+            refresh TTL. For each URL, starts the WebDriver, maximizes the browser window,
+            and performs scraping. The collected details are written to the database in
+            batches, and the URLs of a batch are set to 'True' once it is written.
         """
         # First check all links and scrape them before starting
         self.alphabet_section()
-        urls = self.get_urls_from_file()
+        urls = self.get_stale_urls()
         for url in urls:
             self.webdriver.get(url)
             self.webdriver.maximize_window()
             self.scrape_extra_details(url)
+            self.pending_urls.append(url)
 
-            # Update the URL status to True after scraping
+            if len(self.pending_details) >= self.batch_size:
+                self.flush_details()
+
+        self.flush_details()
+
+    def flush_details(self):
+        """
+            Writes the details collected since the last flush to the database in a single batch, then
+            updates the status of their URLs to 'True'. A crash before the flush leaves them 'False'.
+        """
+        if self.pending_details and not self.db.upsert_details(self.pending_details):
+            # The batch was rolled back, the URLs are scraped again by the next run
+            self.pending_urls = []
+            return
+        self.pending_details = []
+        for url in self.pending_urls:
             self.update_url_status(url, 'True')
+        self.pending_urls = []
 
     def scrape_extra_details(self, url):
         """
@@ -93,9 +116,9 @@ class ScrapeCouponIconAndAbout:
         except Exception as e:
             print(f"Error getting the description: {e}")
 
-        # Save details to the database
+        # Queue details for the next database batch
         if icon_link and about:
-            self.db.insert_details(company_name, icon_link, about)
+            self.pending_details.append((company_name, icon_link, about))
 
     def get_company_name_from_file(self, url):
         """
@@ -192,6 +215,24 @@ class ScrapeCouponIconAndAbout:
                     urls_to_scrape.append(url)
         return urls_to_scrape
 
+    def get_stale_urls(self):
+        """
+            Retrieves the URLs of the companies whose details were never scraped or were refreshed
+            longer ago than the TTL of the database. The TTL decides for every link, whatever its status.
+
+            Returns:
+                list: A list of URLs that need to be scraped.
+        """
+        known_companies = self.db.get_company_names()
+        stale_companies = self.db.get_stale_companies()
+        urls_to_scrape = []
+        with open(self.file_path, 'r') as file:
+            for line in file:
+                url, company_name, status = line.strip().split(', ')
+                if company_name not in known_companies or company_name in stale_companies:
+                    urls_to_scrape.append(url)
+        return urls_to_scrape
+
     def read_links(self):
         """
         Reads all lines from the file and splits each line into URL and status.
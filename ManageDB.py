@@ -1,19 +1,71 @@
+import json
 import sqlite3
-from datetime import datetime
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from offer_parser import parse_offer
 
 
 class Database:
-    def __init__(self, db_name='coupons.db'):
+    # Consecutive crawls a coupon can be missing from before it is expired
+    MISSED_LIMIT = 3
+    # Hours a coupon has to be unseen before it is expired
+    GRACE_HOURS = 48
+    # Hours an expired coupon is kept before it is purged
+    PURGE_HOURS = 24 * 7
+    # Days the change log keeps every change, older changes are compacted
+    CHANGE_LOG_DAYS = 30
+    # Columns that only describe the crawl state and are not published in the change log
+    UNTRACKED_COLUMNS = ('last_scrapped', 'missed_count', 'deleted_at')
+    # Regression check of the run ledger: runs in the rolling baseline and the allowed change
+    BASELINE_RUNS = 5
+    REGRESSION_THRESHOLD = 0.5
+    # Days a card that is no longer listed is remembered
+    LISTING_RETENTION_DAYS = 30
+    # Circuit breaker of the shops: failed visits in a row before a shop is quarantined, and the hours to
+    # its first probe, doubled after every failed probe up to MAX_QUARANTINE_HOURS
+    BREAKER_FAILURES = 3
+    QUARANTINE_HOURS = 6
+    MAX_QUARANTINE_HOURS = 24 * 7
+
+    def __init__(self, db_name='coupons.db', missed_limit=None, grace_hours=None, purge_hours=None):
         self.db_name = db_name
+        self.missed_limit = self.MISSED_LIMIT if missed_limit is None else missed_limit
+        self.grace_hours = self.GRACE_HOURS if grace_hours is None else grace_hours
+        self.purge_hours = self.PURGE_HOURS if purge_hours is None else purge_hours
         self.conn = None
         self.cursor = None
 
     def connect(self):
         self.conn = sqlite3.connect(self.db_name)
+        self.conn.execute("PRAGMA foreign_keys = ON")
         self.cursor = self.conn.cursor()
 
+    def add_missing_columns(self, table, columns):
+        # Older databases were created before some columns existed, add them in place
+        existing_columns = [row[1] for row in self.cursor.execute(f"PRAGMA table_info({table})")]
+        for column, definition in columns.items():
+            if column not in existing_columns:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
     def create_table(self):
         self.connect()
+        # WAL lets the storefront read while the crawler writes, the mode is stored in the database file
+        self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shops (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE,
+                name TEXT,
+                icon TEXT,
+                about TEXT,
+                status TEXT DEFAULT 'False',  -- Crawl state, same values as in all_shop_links.txt
+                last_crawled TEXT,
+                details_refreshed TEXT
+            )
+        ''')
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS coupons (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,12 +80,270 @@ class Database:
                 url TEXT,
                 company_name TEXT,
                 last_scrapped TEXT,  -- Add a column for the last_scrapped timestamp
+                shop_id INTEGER REFERENCES shops(id),
+                missed_count INTEGER DEFAULT 0,  -- Consecutive crawls that didn't see the coupon
+                deleted_at TEXT,  -- Set when the coupon expires, the row is purged later
+                discount_percent REAL,  -- Typed values parsed from the offer text, see offer_parser
+                discount_amount REAL,
+                currency TEXT,
+                min_spend REAL,
+                free_shipping INTEGER DEFAULT 0,
                 UNIQUE(title, description)  -- Add a unique constraint on title and description
             )
         ''')
+        self.add_missing_columns('coupons', {
+            'shop_id': 'INTEGER REFERENCES shops(id)',
+            'missed_count': 'INTEGER DEFAULT 0',
+            'deleted_at': 'TEXT',
+            'discount_percent': 'REAL',
+            'discount_amount': 'REAL',
+            'currency': 'TEXT',
+            'min_spend': 'REAL',
+            'free_shipping': 'INTEGER DEFAULT 0',
+        })
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_shops_name ON shops (name)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupons_shop_id ON coupons (shop_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupons_company_name ON coupons (company_name)")
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_coupons_deleted_at ON coupons (deleted_at) WHERE deleted_at IS NOT NULL
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupons_code ON coupons (code)")
+        # Best deal queries only look at live coupons, partial indexes keep them small
+        for column in ('discount_percent', 'discount_amount', 'min_spend'):
+            self.cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_coupons_{column} ON coupons ({column})
+                WHERE deleted_at IS NULL AND {column} IS NOT NULL
+            ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_coupons_free_shipping ON coupons (free_shipping)
+            WHERE deleted_at IS NULL AND free_shipping = 1
+        ''')
+        # Append only log of coupon changes, the seq primary key is the cursor of the consumers
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS coupon_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                coupon_id INTEGER,
+                operation TEXT,  -- inserted, updated or removed
+                changed_fields TEXT,  -- JSON object, every field for inserted and the changed ones for updated
+                changed_at TEXT
+            )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupon_changes_coupon_id ON coupon_changes (coupon_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_coupon_changes_changed_at ON coupon_changes (changed_at)")
+        # Highest seq deleted by compact_change_log, a consumer behind it missed changes
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_log_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                compacted_through INTEGER DEFAULT 0
+            )
+        ''')
+        # Run ledger, one row per cycle of start_webdriver and one per shop visited in it
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT,
+                finished_at TEXT,  -- NULL while running or when the process died
+                shops INTEGER DEFAULT 0,
+                coupons_found INTEGER DEFAULT 0,
+                similar_lookups INTEGER DEFAULT 0,  -- Similar voucher cards checked against the seen set
+                similar_hits INTEGER DEFAULT 0,  -- Cards skipped because the voucher was seen in the run
+                tier TEXT DEFAULT 'full'  -- full, deep or light, see ScrappingCoupon.CRAWL_TIER
+            )
+        ''')
+        self.add_missing_columns('crawl_runs', {
+            'similar_lookups': 'INTEGER DEFAULT 0',
+            'similar_hits': 'INTEGER DEFAULT 0',
+            'tier': "TEXT DEFAULT 'full'",
+        })
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_shop_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER REFERENCES crawl_runs(id),
+                url TEXT,
+                company_name TEXT,
+                started_at TEXT,
+                finished_at TEXT,
+                duration_seconds REAL,
+                coupons_found INTEGER,
+                inserted INTEGER,
+                updated INTEGER,
+                removed INTEGER,
+                failures INTEGER,
+                restarts INTEGER DEFAULT 0,  -- earlier visits of the shop that never finished
+                stage_seconds TEXT  -- JSON object, seconds spent in every stage
+            )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_shop_runs_run_id ON crawl_shop_runs (run_id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_crawl_shop_runs_url ON crawl_shop_runs (url, run_id)")
+        # Circuit breaker of every shop, see record_shop_visit
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shop_health (
+                url TEXT PRIMARY KEY,
+                company_name TEXT,
+                state TEXT DEFAULT 'closed',  -- closed: crawled, open: quarantined until next_probe_at
+                consecutive_failures INTEGER DEFAULT 0,
+                quarantines INTEGER DEFAULT 0,  -- Quarantines in a row, every one doubles the time to the probe
+                last_error TEXT,
+                last_failure_at TEXT,
+                quarantined_at TEXT,
+                next_probe_at TEXT
+            )
+        ''')
+        # Cards listed on the shop pages, the light tier reads them without opening the popups
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS listing_cards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                shop_url TEXT,
+                fingerprint TEXT,  -- See VOUCHER_FINGERPRINT_SCRIPT, a changed card gets a new fingerprint
+                widget TEXT,
+                card_text TEXT,
+                button_name TEXT,
+                first_seen TEXT,
+                last_seen TEXT,
+                deep_scraped_at TEXT,  -- NULL until the popup of the card was read
+                coupon_title TEXT,  -- Key of the coupon saved from the popup
+                coupon_description TEXT,
+                UNIQUE(shop_url, fingerprint)
+            )
+        ''')
+        self.create_search_tables()
         self.conn.commit()
         self.close()
 
+    def create_search_tables(self):
+        # Uses the open cursor, it's called from create_table
+        existing_tables = {row[0] for row in self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        # Full text indexes that read their content from coupons and shops, '%' and '$' are kept
+        # inside the tokens so searches like "20%" or "$10" match
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS coupons_fts USING fts5(
+                title, description, limitations_for_users, limitations_on_brands, company_name,
+                content = 'coupons', content_rowid = 'id',
+                tokenize = "unicode61 tokenchars '%$'", prefix = '2 3'
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS shops_fts USING fts5(
+                name, about,
+                content = 'shops', content_rowid = 'id',
+                tokenize = "unicode61 tokenchars '%$'", prefix = '2 3'
+            )
+        ''')
+
+        # Triggers keep the indexes up to date with every insert_coupon, sweep and purge
+        self.cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS coupons_fts_insert AFTER INSERT ON coupons BEGIN
+                INSERT INTO coupons_fts (rowid, title, description, limitations_for_users,
+                    limitations_on_brands, company_name)
+                VALUES (new.id, new.title, new.description, new.limitations_for_users,
+                    new.limitations_on_brands, new.company_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS coupons_fts_delete AFTER DELETE ON coupons BEGIN
+                INSERT INTO coupons_fts (coupons_fts, rowid, title, description, limitations_for_users,
+                    limitations_on_brands, company_name)
+                VALUES ('delete', old.id, old.title, old.description, old.limitations_for_users,
+                    old.limitations_on_brands, old.company_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS coupons_fts_update AFTER UPDATE OF title, description,
+                limitations_for_users, limitations_on_brands, company_name ON coupons BEGIN
+                INSERT INTO coupons_fts (coupons_fts, rowid, title, description, limitations_for_users,
+                    limitations_on_brands, company_name)
+                VALUES ('delete', old.id, old.title, old.description, old.limitations_for_users,
+                    old.limitations_on_brands, old.company_name);
+                INSERT INTO coupons_fts (rowid, title, description, limitations_for_users,
+                    limitations_on_brands, company_name)
+                VALUES (new.id, new.title, new.description, new.limitations_for_users,
+                    new.limitations_on_brands, new.company_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS shops_fts_insert AFTER INSERT ON shops BEGIN
+                INSERT INTO shops_fts (rowid, name, about) VALUES (new.id, new.name, new.about);
+            END;
+            CREATE TRIGGER IF NOT EXISTS shops_fts_delete AFTER DELETE ON shops BEGIN
+                INSERT INTO shops_fts (shops_fts, rowid, name, about) VALUES ('delete', old.id, old.name, old.about);
+            END;
+            CREATE TRIGGER IF NOT EXISTS shops_fts_update AFTER UPDATE OF name, about ON shops BEGIN
+                INSERT INTO shops_fts (shops_fts, rowid, name, about) VALUES ('delete', old.id, old.name, old.about);
+                INSERT INTO shops_fts (rowid, name, about) VALUES (new.id, new.name, new.about);
+            END;
+        ''')
+
+        # Index the rows that existed before the search tables, and rank matches in the title higher
+        if 'coupons_fts' not in existing_tables:
+            self.cursor.execute(
+                "INSERT INTO coupons_fts (coupons_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0, 1.0, 3.0)')")
+            self.cursor.execute("INSERT INTO coupons_fts (coupons_fts) VALUES ('rebuild')")
+        if 'shops_fts' not in existing_tables:
+            self.cursor.execute("INSERT INTO shops_fts (shops_fts, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+            self.cursor.execute("INSERT INTO shops_fts (shops_fts) VALUES ('rebuild')")
+
+    def rebuild_search_index(self):
+        """
+            Rebuilds both full text indexes from the coupons and shops tables and optimizes them.
+        """
+        self.connect()
+        for table in ('coupons_fts', 'shops_fts'):
+            self.cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+            self.cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        self.conn.commit()
+        self.close()
+
+    @staticmethod
+    def build_match_query(text):
+        # Every word becomes a quoted token, the last one also matches as a prefix while the user types
+        words = [word.replace('"', '""') for word in text.split()]
+        if not words:
+            return None
+        tokens = [f'"{word}"' for word in words]
+        tokens[-1] += '*'
+        return ' '.join(tokens)
+
+    def search_coupons(self, text, limit=20):
+        """
+            Searches the live coupons by keywords in their title, description, limitations and company name.
+            Results are ranked with bm25, a match in the title weighs the most.
+
+            Returns:
+                list: A list of dictionaries, the best match first.
+        """
+        match_query = self.build_match_query(text)
+        if match_query is None:
+            return []
+        self.connect()
+        self.cursor.execute('''
+            SELECT c.id, c.title, c.description, c.offer, c.code, c.url, c.company_name, c.shop_id,
+                coupons_fts.rank
+            FROM coupons_fts JOIN coupons c ON c.id = coupons_fts.rowid
+            WHERE coupons_fts MATCH ? AND c.deleted_at IS NULL
+            ORDER BY coupons_fts.rank LIMIT ?
+        ''', (match_query, limit))
+        column_names = [description[0] for description in self.cursor.description]
+        coupons = [dict(zip(column_names, row)) for row in self.cursor.fetchall()]
+        self.close()
+        return coupons
+
+    def search_shops(self, text, limit=20):
+        """
+            Searches the shops by keywords in their name and about text.
+
+            Returns:
+                list: A list of dictionaries, the best match first.
+        """
+        match_query = self.build_match_query(text)
+        if match_query is None:
+            return []
+        self.connect()
+        self.cursor.execute('''
+            SELECT s.id, s.name, s.url, s.icon, shops_fts.rank
+            FROM shops_fts JOIN shops s ON s.id = shops_fts.rowid
+            WHERE shops_fts MATCH ?
+            ORDER BY shops_fts.rank LIMIT ?
+        ''', (match_query, limit))
+        column_names = [description[0] for description in self.cursor.description]
+        shops = [dict(zip(column_names, row)) for row in self.cursor.fetchall()]
+        self.close()
+        return shops
+
     def get_all_columns(self):
         self.connect()
         cursor = self.conn.cursor()
@@ -45,122 +355,965 @@ class Database:
     def insert_coupon(self, title, description, offer, order_ammount, limitations_for_users, limitations_on_brands,
                       button_name, code, url, company_name):
         self.connect()
+        status = None
         try:
-            # Get the current timestamp
-            current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            # Prepare SQL query with NULL checks
-            query = '''
-                SELECT * FROM coupons WHERE title = ? AND 
-            '''
-            if description is None:
-                query += 'description IS NULL'
-            else:
-                query += 'description = ?'
-
-            # Execute the query
-            self.cursor.execute(query, (title,) if description is None else (title, description))
-            result = self.cursor.fetchone()
-
-            if result is not None:
-                # If a row exists, compare other fields to decide if an update is necessary
-                existing_coupon = dict(zip([description[0] for description in self.cursor.description], result))
-                fields_to_update = {}
-
-                # List of fields to compare and potentially update
-                fields_to_check = {
-                    'offer': offer,
-                    'order_ammount': order_ammount,
-                    'limitations_for_users': limitations_for_users,
-                    'limitations_on_brands': limitations_on_brands,
-                    'button_name': button_name,
-                    'code': code,
-                    'url': url,
-                    'company_name': company_name
-                }
-
-                # Check each field for differences
-                for field, new_value in fields_to_check.items():
-                    if existing_coupon[field] != new_value:
-                        fields_to_update[field] = new_value
-
-                # Always update the last_scrapped field
-                fields_to_update['last_scrapped'] = current_timestamp
-
-                if fields_to_update:
-                    # Update the existing row if any field is different
-                    update_query = 'UPDATE coupons SET ' + ', '.join(
-                        [f"{k} = ?" for k in fields_to_update.keys()]) + ' WHERE title = ? AND '
-                    update_query += 'description IS NULL' if description is None else 'description = ?'
-                    self.cursor.execute(update_query, list(fields_to_update.values()) + (
-                        [title] if description is None else [title, description]))
-                    self.conn.commit()
-                    print(f"Coupon updated: {title}")
-                else:
-                    print(f"No changes detected for the coupon with title '{title}' and description '{description}'.")
-            else:
-                # Insert a new row if no matching row exists
-                self.cursor.execute('''
-                    INSERT INTO coupons (
-                        title, description, offer, order_ammount, limitations_for_users,
-                        limitations_on_brands, button_name, code, url, company_name, last_scrapped
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    title, description, offer, order_ammount, limitations_for_users, limitations_on_brands, button_name,
-                    code, url, company_name, current_timestamp))
-                self.conn.commit()
-                print(f"Coupon inserted: {title}")
-                print("--------------------------------------------------------------------\n\n")
+            status = self.upsert_coupon(title, description, offer, order_ammount, limitations_for_users,
+                                        limitations_on_brands, button_name, code, url, company_name)
+            self.conn.commit()
         except sqlite3.Error as e:
             print(f"Error inserting or updating coupon: {e}")
         self.close()
+        return status
+
+    def insert_coupons(self, coupons):
+        """
+            Saves a batch of Coupon records using a single connection and transaction. A coupon that appears
+            more than once in the batch, with the same title and description, is saved once with its last values.
 
-    def update_last_scrapped_column(self, companyName):
-        current_datetime = datetime.now()
-        current_date_only = current_datetime.date()
+            Args:
+                coupons (list): A list of Coupon records.
+
+            Returns:
+                dict: The number of inserted, updated and unchanged coupons.
+        """
+        unique_coupons = {}
+        for coupon in coupons:
+            unique_coupons[coupon.key()] = coupon
+
+        statuses = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        if not unique_coupons:
+            return statuses
+
+        self.connect()
+        try:
+            for coupon in unique_coupons.values():
+                status = self.upsert_coupon(coupon.title, coupon.description, coupon.offer, coupon.order_ammount,
+                                            coupon.limitations_for_users, coupon.limitations_on_brands,
+                                            coupon.button_name, coupon.code, coupon.url, coupon.company_name)
+                statuses[status] += 1
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            statuses = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+            print(f"Error inserting or updating coupons: {e}")
+        self.close()
+        return statuses
+
+    def upsert_coupon(self, title, description, offer, order_ammount, limitations_for_users, limitations_on_brands,
+                      button_name, code, url, company_name):
+        # Uses the open cursor and leaves the commit to the caller, returns inserted, updated or unchanged
+        # Get the current timestamp
+        current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        # Resolve the shop of the coupon, it stays NULL for shops that are not known yet
+        shop_id = self.get_shop_id(company_name)
+
+        # Typed discount values for the best deal queries
+        discount = parse_offer(offer, order_ammount, title, description)
+
+        # Prepare SQL query with NULL checks
+        query = '''
+            SELECT * FROM coupons WHERE title = ? AND 
+        '''
+        if description is None:
+            query += 'description IS NULL'
+        else:
+            query += 'description = ?'
+
+        # Execute the query
+        self.cursor.execute(query, (title,) if description is None else (title, description))
+        result = self.cursor.fetchone()
+
+        if result is not None:
+            # If a row exists, compare other fields to decide if an update is necessary
+            existing_coupon = dict(zip([description[0] for description in self.cursor.description], result))
+            fields_to_update = {}
+
+            # List of fields to compare and potentially update
+            fields_to_check = {
+                'offer': offer,
+                'order_ammount': order_ammount,
+                'limitations_for_users': limitations_for_users,
+                'limitations_on_brands': limitations_on_brands,
+                'button_name': button_name,
+                'code': code,
+                'url': url,
+                'company_name': company_name,
+                'shop_id': shop_id,
+                # A seen coupon is live again, even if it was expired before
+                'missed_count': 0,
+                'deleted_at': None,
+                **discount
+            }
+
+            # Check each field for differences
+            for field, new_value in fields_to_check.items():
+                if existing_coupon[field] != new_value:
+                    fields_to_update[field] = new_value
+
+            # Always update the last_scrapped field
+            fields_to_update['last_scrapped'] = current_timestamp
+
+            if fields_to_update:
+                # Update the existing row if any field is different
+                update_query = 'UPDATE coupons SET ' + ', '.join(
+                    [f"{k} = ?" for k in fields_to_update.keys()]) + ' WHERE title = ? AND '
+                update_query += 'description IS NULL' if description is None else 'description = ?'
+                self.cursor.execute(update_query, list(fields_to_update.values()) + (
+                    [title] if description is None else [title, description]))
+
+                if existing_coupon['deleted_at'] is not None:
+                    # The consumers saw the coupon removed, publish it again as a whole
+                    existing_coupon.update(fields_to_update)
+                    self.record_change(existing_coupon['id'], 'inserted', {
+                        field: value for field, value in existing_coupon.items()
+                        if field != 'id' and field not in self.UNTRACKED_COLUMNS
+                    })
+                    print(f"Coupon updated: {title}")
+                    return 'updated'
+
+                changed_fields = {field: value for field, value in fields_to_update.items()
+                                  if field not in self.UNTRACKED_COLUMNS}
+                if changed_fields:
+                    self.record_change(existing_coupon['id'], 'updated', changed_fields)
+                    print(f"Coupon updated: {title}")
+                    return 'updated'
+
+            print(f"No changes detected for the coupon with title '{title}' and description '{description}'.")
+            return 'unchanged'
+        else:
+            # Insert a new row if no matching row exists
+            self.cursor.execute('''
+                INSERT INTO coupons (
+                    title, description, offer, order_ammount, limitations_for_users,
+                    limitations_on_brands, button_name, code, url, company_name, last_scrapped, shop_id,
+                    discount_percent, discount_amount, currency, min_spend, free_shipping
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                title, description, offer, order_ammount, limitations_for_users, limitations_on_brands, button_name,
+                code, url, company_name, current_timestamp, shop_id, discount['discount_percent'],
+                discount['discount_amount'], discount['currency'], discount['min_spend'], discount['free_shipping']))
+            self.record_change(self.cursor.lastrowid, 'inserted', {
+                'title': title, 'description': description, 'offer': offer, 'order_ammount': order_ammount,
+                'limitations_for_users': limitations_for_users, 'limitations_on_brands': limitations_on_brands,
+                'button_name': button_name, 'code': code, 'url': url, 'company_name': company_name,
+                'shop_id': shop_id, **discount
+            })
+            print(f"Coupon inserted: {title}")
+            print("--------------------------------------------------------------------\n\n")
+            return 'inserted'
+
+    def update_last_scrapped_column(self, company_name, crawl_started_at=None):
+        """
+            Expires the coupons of a company that were not seen by the current crawl.
+
+            A coupon that is missing from a crawl only gets its missed_count increased. It is soft
+            deleted (deleted_at is set) once it was missed by missed_limit consecutive crawls and
+            wasn't scraped for grace_hours, so a single flaky page load doesn't remove valid coupons.
+            Soft deleted coupons are removed for good by purge_deleted_coupons.
+
+            Args:
+                company_name (str): The company whose coupons are checked.
+                crawl_started_at (str): Timestamp of the start of the crawl, coupons scraped since then
+                    were seen. Defaults to the start of the current day.
+        """
+        now = datetime.now()
+        if crawl_started_at is None:
+            crawl_started_at = now.strftime('%Y-%m-%d 00:00:00')
+        grace_threshold = (now - timedelta(hours=self.grace_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        current_timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
 
         try:
             self.connect()
 
-            if not self.conn or not self.cursor:
-                raise Exception("Database connection failed.")
+            # Count one more missed observation for every live coupon that wasn't scraped by this crawl
+            self.cursor.execute('''
+                UPDATE coupons SET missed_count = missed_count + 1
+                WHERE company_name = ? AND deleted_at IS NULL
+                    AND (last_scrapped IS NULL OR last_scrapped < ?)
+            ''', (company_name, crawl_started_at))
+            missed = self.cursor.rowcount
 
-            # Fetch the rows from the database for the given company name
-            self.cursor.execute("SELECT * FROM coupons WHERE company_name = ?", (companyName,))
-            rows = self.cursor.fetchall()
+            # Soft delete the coupons that are missing for too many crawls and for longer than the grace TTL
+            self.cursor.execute('''
+                SELECT id FROM coupons
+                WHERE company_name = ? AND deleted_at IS NULL AND missed_count >= ?
+                    AND (last_scrapped IS NULL OR last_scrapped < ?)
+            ''', (company_name, self.missed_limit, grace_threshold))
+            expired_ids = [row[0] for row in self.cursor.fetchall()]
+            self.cursor.executemany("UPDATE coupons SET deleted_at = ? WHERE id = ?",
+                                    [(current_timestamp, coupon_id) for coupon_id in expired_ids])
+            for coupon_id in expired_ids:
+                self.record_change(coupon_id, 'removed')
+            expired = len(expired_ids)
+            self.conn.commit()
+            print(f"Coupons missed for '{company_name}': {missed}, expired: {expired}")
+            return expired
 
-            if not rows:
-                print("No rows fetched from the database.")
-                return
-
-            rows_to_delete = []
-
-            for row in rows:
-                row_dict = dict(zip([description[0] for description in self.cursor.description], row))
-                last_scrapped = row_dict.get('last_scrapped', '')
-                last_scrapped_datetime = datetime.strptime(last_scrapped,
-                                                           '%Y-%m-%d %H:%M:%S') if last_scrapped else None
-                last_scrapped_date_only = last_scrapped_datetime.date() if last_scrapped_datetime else None
-
-                if last_scrapped_date_only != current_date_only:
-                    rows_to_delete.append(row_dict['id'])  # Collect IDs of rows to be deleted
-
-            if rows_to_delete:
-                # Delete the rows with IDs collected in rows_to_delete
-                self.cursor.executemany("DELETE FROM coupons WHERE id = ?", [(row_id,) for row_id in rows_to_delete])
-                self.conn.commit()
-                print(f"Deleted rows with IDs: {rows_to_delete}")
-            else:
-                print("No rows to delete.")
-
-        except Exception as e:
+        except sqlite3.Error as e:
             print(f"An error occurred: {e}")
+            return 0
         finally:
             self.close()
 
+    def purge_deleted_coupons(self, retention_hours=None):
+        """
+            Permanently deletes the coupons that were soft deleted more than retention_hours ago.
+
+            Returns:
+                int: The number of purged coupons.
+        """
+        retention_hours = self.purge_hours if retention_hours is None else retention_hours
+        threshold = (datetime.now() - timedelta(hours=retention_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        self.connect()
+        try:
+            self.cursor.execute("DELETE FROM coupons WHERE deleted_at IS NOT NULL AND deleted_at < ?", (threshold,))
+            purged = self.cursor.rowcount
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error purging deleted coupons: {e}")
+            purged = 0
+        self.close()
+        return purged
+
+    def backfill_discount_columns(self, batch_size=5000, only_missing=True):
+        """
+            Fills the typed discount columns of the existing coupons. Rows are read in id order, a batch at
+            a time, parsed with the same parser as insert_coupon and written back with a single executemany
+            per batch, so memory stays flat on large tables.
+
+            Args:
+                batch_size (int): Number of coupons parsed and written per transaction.
+                only_missing (bool): Skip coupons that were already parsed at ingest.
+
+            Returns:
+                int: The number of coupons whose values changed, each one gets an updated change.
+        """
+        condition = ('AND discount_percent IS NULL AND discount_amount IS NULL AND min_spend IS NULL'
+                     if only_missing else '')
+        columns = ('discount_percent', 'discount_amount', 'currency', 'min_spend', 'free_shipping')
+        last_id = 0
+        updated = 0
+        self.connect()
+        while True:
+            rows = self.cursor.execute(f'''
+                SELECT id, offer, order_ammount, title, description, {', '.join(columns)} FROM coupons
+                WHERE id > ? {condition} ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+
+            parameters = []
+            for coupon_id, offer, order_ammount, title, description, *current in rows:
+                discount = parse_offer(offer, order_ammount, title, description)
+                changed_fields = {column: discount[column] for column, value in zip(columns, current)
+                                  if discount[column] != value}
+                if changed_fields:
+                    # The consumers of the change log get the parsed values like from upsert_coupon
+                    parameters.append(tuple(discount[column] for column in columns) + (coupon_id,))
+                    self.record_change(coupon_id, 'updated', changed_fields)
+            self.cursor.executemany('''
+                UPDATE coupons SET discount_percent = ?, discount_amount = ?, currency = ?, min_spend = ?,
+                    free_shipping = ?
+                WHERE id = ?
+            ''', parameters)
+            self.conn.commit()
+            updated += len(parameters)
+            last_id = rows[-1][0]
+            print(f"Discount columns backfilled: {updated}")
+        self.close()
+        return updated
+
+    def get_best_deals(self, sort='percent', limit=20, shop_id=None, free_shipping=None):
+        """
+            Retrieves the best live deals, each sort order is a range scan on its partial index.
+
+            Args:
+                sort (str): 'percent' for the biggest % off, 'amount' for the biggest fixed discount,
+                    'min_spend' for the lowest minimum spend.
+                shop_id (int): Only the deals of this shop.
+                free_shipping (bool): Only the deals with free shipping.
+
+            Returns:
+                list: A list of dictionaries, the best deal first.
+        """
+        order_by = {
+            'percent': ('discount_percent', 'DESC'),
+            'amount': ('discount_amount', 'DESC'),
+            'min_spend': ('min_spend', 'ASC'),
+        }
+        column, direction = order_by[sort]
+        conditions = [f"deleted_at IS NULL AND {column} IS NOT NULL"]
+        parameters = []
+        if shop_id is not None:
+            conditions.append('shop_id = ?')
+            parameters.append(shop_id)
+        if free_shipping:
+            conditions.append('free_shipping = 1')
+
+        self.connect()
+        self.cursor.execute(f'''
+            SELECT id, title, offer, code, url, company_name, shop_id, discount_percent, discount_amount,
+                currency, min_spend, free_shipping
+            FROM coupons WHERE {' AND '.join(conditions)}
+            ORDER BY {column} {direction}, id {direction} LIMIT ?
+        ''', parameters + [limit])
+        column_names = [description[0] for description in self.cursor.description]
+        deals = [dict(zip(column_names, row)) for row in self.cursor.fetchall()]
+        self.close()
+        return deals
+
+    def record_change(self, coupon_id, operation, changed_fields=None):
+        # Uses the open cursor, the change is committed together with the coupon itself
+        self.cursor.execute('''
+            INSERT INTO coupon_changes (coupon_id, operation, changed_fields, changed_at)
+            VALUES (?, ?, ?, ?)
+        ''', (coupon_id, operation, json.dumps(changed_fields) if changed_fields else None,
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    def get_changes_since(self, seq=0, limit=1000):
+        """
+            Retrieves the coupon changes that come after a cursor, in the order they happened.
+
+            Args:
+                seq (int): The last sequence number the consumer has already processed.
+                limit (int): Maximum number of changes to return.
+
+            Returns:
+                list: A list of dictionaries with seq, coupon_id, operation, changed_fields and changed_at.
+        """
+        self.connect()
+        self.cursor.execute('''
+            SELECT seq, coupon_id, operation, changed_fields, changed_at FROM coupon_changes
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (seq, limit))
+        changes = [{
+            'seq': row[0],
+            'coupon_id': row[1],
+            'operation': row[2],
+            'changed_fields': json.loads(row[3]) if row[3] else {},
+            'changed_at': row[4],
+        } for row in self.cursor.fetchall()]
+        self.close()
+        return changes
+
+    def get_change_seq_range(self):
+        """
+            Retrieves the first sequence number from which the change log is complete and the last one.
+            A consumer whose cursor is older than first_seq - 1 missed compacted changes and has to read
+            the full table. The kept entries below first_seq are not enough: an updated entry only has
+            the fields that changed, the inserted entry before it may be gone.
+
+            Returns:
+                tuple: (first_seq, last_seq), both 0 when the log is empty and was never compacted.
+        """
+        self.connect()
+        first_seq, last_seq = self.cursor.execute("SELECT MIN(seq), MAX(seq) FROM coupon_changes").fetchone()
+        row = self.cursor.execute("SELECT compacted_through FROM change_log_state WHERE id = 1").fetchone()
+        self.close()
+        compacted_through = row[0] if row else 0
+        if compacted_through:
+            return compacted_through + 1, max(last_seq or 0, compacted_through)
+        return first_seq or 0, last_seq or 0
+
+    def compact_change_log(self, retention_days=None):
+        """
+            Keeps the change log bounded. Changes older than retention_days are reduced to the latest
+            change of every coupon, and the old removals of purged coupons are dropped.
+
+            Returns:
+                int: The number of deleted log entries.
+        """
+        retention_days = self.CHANGE_LOG_DAYS if retention_days is None else retention_days
+        threshold = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        self.connect()
+        try:
+            compacted_through = self.cursor.execute('''
+                SELECT MAX(seq) FROM coupon_changes
+                WHERE changed_at < ? AND (seq NOT IN (SELECT MAX(seq) FROM coupon_changes GROUP BY coupon_id)
+                    OR (operation = 'removed' AND coupon_id NOT IN (SELECT id FROM coupons)))
+            ''', (threshold,)).fetchone()[0]
+            self.cursor.execute('''
+                DELETE FROM coupon_changes
+                WHERE changed_at < ?
+                    AND seq NOT IN (SELECT MAX(seq) FROM coupon_changes GROUP BY coupon_id)
+            ''', (threshold,))
+            deleted = self.cursor.rowcount
+            self.cursor.execute('''
+                DELETE FROM coupon_changes
+                WHERE changed_at < ? AND operation = 'removed'
+                    AND coupon_id NOT IN (SELECT id FROM coupons)
+            ''', (threshold,))
+            deleted += self.cursor.rowcount
+            if compacted_through:
+                # Consumers behind the last deleted entry have to resync, see get_change_seq_range
+                self.cursor.execute('''
+                    INSERT INTO change_log_state (id, compacted_through) VALUES (1, ?)
+                    ON CONFLICT (id) DO UPDATE
+                    SET compacted_through = MAX(compacted_through, excluded.compacted_through)
+                ''', (compacted_through,))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error compacting the change log: {e}")
+            deleted = 0
+        self.close()
+        return deleted
+
+    def get_shop_id(self, company_name):
+        # Uses the open cursor, it's called from inside other methods
+        if company_name is None:
+            return None
+        row = self.cursor.execute("SELECT id FROM shops WHERE name = ?", (company_name,)).fetchone()
+        return row[0] if row else None
+
+    def upsert_shops(self, shops):
+        """
+            Inserts new shops or renames existing ones, keyed by their URL.
+
+            Args:
+                shops (list): A list of (url, name) tuples.
+        """
+        self.connect()
+        try:
+            self.cursor.executemany('''
+                INSERT INTO shops (url, name) VALUES (?, ?)
+                ON CONFLICT(url) DO UPDATE SET name = excluded.name
+            ''', shops)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error upserting shops: {e}")
+        self.close()
+
+    def update_shop_status(self, url, status):
+        """
+            Updates the crawl state of a shop, a 'True' status also stamps the last_crawled column.
+        """
+        current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.connect()
+        try:
+            self.cursor.execute('''
+                UPDATE shops SET status = ?,
+                    last_crawled = CASE WHEN ? = 'True' THEN ? ELSE last_crawled END
+                WHERE url = ?
+            ''', (str(status), str(status), current_timestamp, url))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error updating shop status: {e}")
+        self.close()
+
+    def import_shop_links(self, file_path):
+        """
+            Imports the shops and their crawl state from a links file with 'url, name, status' lines.
+
+            Returns:
+                int: The number of shops read from the file.
+        """
+        shops = []
+        with open(file_path, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                url, name, status = line.strip().split(', ')
+                shops.append((url, name, status))
+
+        self.connect()
+        try:
+            self.cursor.executemany('''
+                INSERT INTO shops (url, name, status) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET name = excluded.name, status = excluded.status
+            ''', shops)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            shops = []
+            print(f"Error importing shop links: {e}")
+        self.close()
+        return len(shops)
+
+    def import_shop_details(self, details_db_name):
+        """
+            Copies the icon and about text of every shop from the coupons_details table of the
+            extra features database, matching them by company name.
+
+            Returns:
+                int: The number of shops that received details.
+        """
+        self.connect()
+        self.cursor.execute("ATTACH DATABASE ? AS details", (details_db_name,))
+        columns = [row[1] for row in self.cursor.execute("PRAGMA details.table_info(coupons_details)")]
+        refreshed = 'd.last_refreshed' if 'last_refreshed' in columns else 'NULL'
+        self.cursor.execute(f'''
+            UPDATE shops SET
+                icon = d.company_image,
+                about = d.about,
+                details_refreshed = {refreshed}
+            FROM (
+                SELECT * FROM details.coupons_details
+                WHERE id IN (SELECT MAX(id) FROM details.coupons_details GROUP BY company_name)
+            ) AS d
+            WHERE shops.name = d.company_name
+        ''')
+        updated = self.cursor.rowcount
+        self.conn.commit()
+        self.cursor.execute("DETACH DATABASE details")
+        self.close()
+        return updated
+
+    def link_coupons_to_shops(self):
+        """
+            Creates a shop for every company name that only exists in the coupons table and
+            fills coupons.shop_id from the shop with the same name.
+
+            Returns:
+                int: The number of coupons that were linked, each one gets an updated change.
+        """
+        self.connect()
+        try:
+            self.cursor.execute('''
+                INSERT INTO shops (name)
+                SELECT DISTINCT company_name FROM coupons
+                WHERE company_name IS NOT NULL
+                    AND company_name NOT IN (SELECT name FROM shops WHERE name IS NOT NULL)
+            ''')
+            links = self.cursor.execute('''
+                SELECT coupons.id, MIN(shops.id) FROM coupons JOIN shops ON shops.name = coupons.company_name
+                WHERE coupons.shop_id IS NULL
+                GROUP BY coupons.id
+            ''').fetchall()
+            self.cursor.executemany("UPDATE coupons SET shop_id = ? WHERE id = ?",
+                                    [(shop_id, coupon_id) for coupon_id, shop_id in links])
+            # The consumers of the change log publish the shop of the coupon like any other field
+            for coupon_id, shop_id in links:
+                self.record_change(coupon_id, 'updated', {'shop_id': shop_id})
+            self.conn.commit()
+            linked = len(links)
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            linked = 0
+            print(f"Error linking coupons to shops: {e}")
+        self.close()
+        return linked
+
+    def get_shop_coupons(self, shop_id):
+        """
+            Retrieves the coupons of a shop together with the shop metadata, using the shop_id index.
+
+            Returns:
+                list: A list of dictionaries, one per coupon.
+        """
+        self.connect()
+        self.cursor.execute('''
+            SELECT c.*, s.url AS shop_url, s.name AS shop_name, s.icon AS shop_icon, s.about AS shop_about
+            FROM coupons c JOIN shops s ON s.id = c.shop_id
+            WHERE c.shop_id = ? AND c.deleted_at IS NULL
+            ORDER BY c.id
+        ''', (shop_id,))
+        column_names = [description[0] for description in self.cursor.description]
+        coupons = [dict(zip(column_names, row)) for row in self.cursor.fetchall()]
+        self.close()
+        return coupons
+
+    def get_shops_with_coupon_count(self):
+        """
+            Retrieves every shop with the number of coupons it has, for the storefront shop listing.
+
+            Returns:
+                list: A list of (id, name, url, icon, coupon_count) tuples.
+        """
+        self.connect()
+        self.cursor.execute('''
+            SELECT s.id, s.name, s.url, s.icon,
+                (SELECT COUNT(*) FROM coupons c WHERE c.shop_id = s.id AND c.deleted_at IS NULL) AS coupon_count
+            FROM shops s
+            ORDER BY s.name
+        ''')
+        shops = self.cursor.fetchall()
+        self.close()
+        return shops
+
+    def get_live_coupons(self, company_name=None):
+        """
+            Retrieves the coupons that are not expired, for exports.
+
+            Returns:
+                tuple: The column names and a cursor over the rows, the rows are read while they are used.
+        """
+        self.connect()
+        query = "SELECT * FROM coupons WHERE deleted_at IS NULL"
+        params = ()
+        if company_name:
+            query += " AND company_name = ?"
+            params = (company_name,)
+        self.cursor.execute(query + " ORDER BY company_name, id", params)
+        return [description[0] for description in self.cursor.description], self.cursor
+
+    def get_stats(self):
+        """
+            Counts the coupons, the shops and the last crawl run, for a quick look at the database.
+
+            Returns:
+                dict: The counts, last_run is None before the first run.
+        """
+        self.connect()
+        stats = {}
+        stats['live_coupons'], stats['expired_coupons'], stats['companies'] = self.cursor.execute('''
+            SELECT COUNT(*) FILTER (WHERE deleted_at IS NULL), COUNT(*) FILTER (WHERE deleted_at IS NOT NULL),
+                COUNT(DISTINCT company_name)
+            FROM coupons
+        ''').fetchone()
+        stats['shops'], stats['crawled_shops'] = self.cursor.execute(
+            "SELECT COUNT(*), COUNT(*) FILTER (WHERE status = 'True') FROM shops").fetchone()
+        stats['last_scrapped'] = self.cursor.execute("SELECT MAX(last_scrapped) FROM coupons").fetchone()[0]
+        run_columns = ('id', 'tier', 'started_at', 'finished_at', 'shops', 'coupons_found', 'similar_lookups',
+                       'similar_hits')
+        last_run = self.cursor.execute(
+            f"SELECT {', '.join(run_columns)} FROM crawl_runs ORDER BY id DESC LIMIT 1").fetchone()
+        stats['last_run'] = dict(zip(run_columns, last_run)) if last_run else None
+        stats['listing_cards'], stats['cards_waiting_deep'] = self.cursor.execute(
+            "SELECT COUNT(*), COUNT(*) FILTER (WHERE deep_scraped_at IS NULL) FROM listing_cards").fetchone()
+        stats['quarantined_shops'] = self.cursor.execute(
+            "SELECT COUNT(*) FROM shop_health WHERE state = 'open'").fetchone()[0]
+        self.close()
+        return stats
+
+    def start_run(self, tier='full'):
+        # Returns the id of the new run
+        self.connect()
+        self.cursor.execute("INSERT INTO crawl_runs (started_at, tier) VALUES (?, ?)",
+                            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), tier))
+        run_id = self.cursor.lastrowid
+        self.conn.commit()
+        self.close()
+        return run_id
+
+    def finish_run(self, run_id, similar_lookups=0, similar_hits=0):
+        self.connect()
+        self.cursor.execute('''
+            UPDATE crawl_runs SET finished_at = ?,
+                shops = (SELECT COUNT(*) FROM crawl_shop_runs WHERE run_id = ? AND finished_at IS NOT NULL),
+                coupons_found = (SELECT COALESCE(SUM(coupons_found), 0) FROM crawl_shop_runs WHERE run_id = ?),
+                similar_lookups = ?, similar_hits = ?
+            WHERE id = ?
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), run_id, run_id, similar_lookups, similar_hits,
+              run_id))
+        self.conn.commit()
+        self.close()
+
+    def start_shop_run(self, run_id, url):
+        """
+            Records the start of a shop visit. A visit that is started but never finished, because the
+            process died or was restarted on it, counts as a restart of the next visit of the shop.
+
+            Returns:
+                int: The id of the shop run.
+        """
+        self.connect()
+        # Unfinished visits since the last finished one
+        restarts = self.cursor.execute('''
+            SELECT COUNT(*) FROM crawl_shop_runs
+            WHERE url = ? AND finished_at IS NULL
+                AND id > COALESCE((SELECT MAX(id) FROM crawl_shop_runs WHERE url = ? AND finished_at IS NOT NULL), 0)
+        ''', (url, url)).fetchone()[0]
+        self.cursor.execute('''
+            INSERT INTO crawl_shop_runs (run_id, url, started_at, restarts) VALUES (?, ?, ?, ?)
+        ''', (run_id, url, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), restarts))
+        shop_run_id = self.cursor.lastrowid
+        self.conn.commit()
+        self.close()
+        return shop_run_id
+
+    def finish_shop_run(self, shop_run_id, duration_seconds, company_name=None, coupons_found=0, inserted=0,
+                        updated=0, removed=0, failures=0, stage_seconds=None):
+        self.connect()
+        self.cursor.execute('''
+            UPDATE crawl_shop_runs SET finished_at = ?, duration_seconds = ?, company_name = ?, coupons_found = ?,
+                inserted = ?, updated = ?, removed = ?, failures = ?, stage_seconds = ?
+            WHERE id = ?
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), duration_seconds, company_name, coupons_found, inserted,
+              updated, removed, failures, json.dumps(stage_seconds or {}), shop_run_id))
+        self.conn.commit()
+        self.close()
+
+    def get_run_regressions(self, run_id=None, baseline_runs=None, threshold=None, min_seconds=1.0):
+        """
+            Compares the shops of a run with their rolling baseline, the median of their previous
+            finished visits, and returns the regressions: a duration or a stage that got slower by more
+            than threshold (and by at least min_seconds), or a yield of coupons that dropped by more
+            than threshold. Shops that broke because of selector drift or a site change show up here.
+
+            Args:
+                run_id (int): The run to check, defaults to the last run.
+                baseline_runs (int): Number of previous visits of a shop in its baseline.
+                threshold (float): Allowed relative change, 0.5 flags a shop 50% slower or with 50% fewer coupons.
+
+            Returns:
+                list: Dictionaries with url, metric, baseline and value, the worst change first.
+        """
+        baseline_runs = self.BASELINE_RUNS if baseline_runs is None else baseline_runs
+        threshold = self.REGRESSION_THRESHOLD if threshold is None else threshold
+        self.connect()
+        if run_id is None:
+            run_id = self.cursor.execute("SELECT MAX(id) FROM crawl_runs").fetchone()[0]
+        shop_runs = self.cursor.execute('''
+            SELECT id, url, duration_seconds, coupons_found, failures, stage_seconds FROM crawl_shop_runs
+            WHERE run_id = ? AND finished_at IS NOT NULL
+        ''', (run_id,)).fetchall()
+        # A light visit reads no popups, it is only compared with the visits of the same tier
+        tier = self.cursor.execute("SELECT tier FROM crawl_runs WHERE id = ?", (run_id,)).fetchone()
+        tier = tier[0] if tier else 'full'
+
+        regressions = []
+        for shop_run_id, url, duration, coupons_found, failures, stage_seconds in shop_runs:
+            history = self.cursor.execute('''
+                SELECT s.duration_seconds, s.coupons_found, s.failures, s.stage_seconds FROM crawl_shop_runs s
+                JOIN crawl_runs r ON r.id = s.run_id
+                WHERE s.url = ? AND s.id < ? AND s.finished_at IS NOT NULL AND COALESCE(r.tier, 'full') = ?
+                ORDER BY s.id DESC LIMIT ?
+            ''', (url, shop_run_id, tier, baseline_runs)).fetchall()
+            if not history:
+                continue
+
+            # (metric, value, baseline values, True when higher is worse)
+            checks = [
+                ('duration_seconds', duration, [row[0] for row in history], True),
+                ('coupons_found', coupons_found, [row[1] for row in history], False),
+                ('failures', failures, [row[2] for row in history], True),
+            ]
+            stages = json.loads(stage_seconds or '{}')
+            history_stages = [json.loads(row[3] or '{}') for row in history]
+            for stage, seconds in stages.items():
+                checks.append((f"stage:{stage}", seconds, [row.get(stage, 0.0) for row in history_stages], True))
+
+            for metric, value, values, higher_is_worse in checks:
+                baseline = statistics.median(values)
+                if higher_is_worse:
+                    regressed = value - baseline > threshold * baseline and (
+                        metric == 'failures' or value - baseline >= min_seconds)
+                else:
+                    regressed = value < baseline * (1 - threshold)
+                if regressed:
+                    change = (value - baseline) / baseline if baseline else float('inf')
+                    regressions.append({'url': url, 'metric': metric, 'baseline': baseline, 'value': value,
+                                        'change': change})
+        self.close()
+        regressions.sort(key=lambda regression: -abs(regression['change']))
+        return regressions
+
+    def get_last_deep_run(self):
+        # Start of the last finished run that opened the popups, None before the first one
+        self.connect()
+        started_at = self.cursor.execute('''
+            SELECT MAX(started_at) FROM crawl_runs WHERE finished_at IS NOT NULL AND COALESCE(tier, 'full') != 'light'
+        ''').fetchone()[0]
+        self.close()
+        return started_at
+
+    def refresh_listing_cards(self, shop_url, cards, seen_at):
+        """
+            Records the cards listed on a shop page and refreshes the coupons that were saved from
+            them, so the sweep of update_last_scrapped_column keeps every coupon whose card is still
+            listed, even when its popup isn't opened again.
+
+            Args:
+                shop_url (str): The shop page.
+                cards (list): Dictionaries with the fingerprint, widget, text and button of every card.
+                seen_at (str): Timestamp of the start of the shop crawl.
+
+            Returns:
+                tuple: deep_scraped_at of every listed card before the refresh (None for a card that
+                    was never opened) and the number of refreshed coupons.
+        """
+        self.connect()
+        known = dict(self.cursor.execute(
+            "SELECT fingerprint, deep_scraped_at FROM listing_cards WHERE shop_url = ?", (shop_url,)))
+        self.cursor.executemany('''
+            INSERT INTO listing_cards (shop_url, fingerprint, widget, card_text, button_name, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (shop_url, fingerprint) DO UPDATE SET widget = excluded.widget,
+                button_name = excluded.button_name, last_seen = excluded.last_seen
+        ''', [(shop_url, card['fingerprint'], card['widget'], card['text'], card['button'], seen_at, seen_at)
+              for card in cards])
+        # Coupons of the cards that are still listed count as seen by this crawl
+        self.cursor.execute('''
+            UPDATE coupons SET last_scrapped = ?, missed_count = 0
+            WHERE deleted_at IS NULL AND id IN (
+                SELECT c.id FROM listing_cards l
+                JOIN coupons c ON c.title = l.coupon_title AND c.description IS l.coupon_description
+                WHERE l.shop_url = ? AND l.last_seen = ?
+            )
+        ''', (seen_at, shop_url, seen_at))
+        refreshed = self.cursor.rowcount
+        retention = (datetime.now() - timedelta(days=self.LISTING_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+        self.cursor.execute("DELETE FROM listing_cards WHERE shop_url = ? AND last_seen < ?", (shop_url, retention))
+        self.conn.commit()
+        self.close()
+        return {card['fingerprint']: known.get(card['fingerprint']) for card in cards}, refreshed
+
+    def mark_cards_deep_scraped(self, shop_url, cards, scraped_at):
+        """
+            Records the cards whose popup was read and the coupon saved from each of them.
+
+            Args:
+                cards (list): (fingerprint, coupon title, coupon description) tuples.
+        """
+        if not cards:
+            return
+        self.connect()
+        self.cursor.executemany('''
+            INSERT INTO listing_cards (shop_url, fingerprint, first_seen, last_seen, deep_scraped_at, coupon_title,
+                coupon_description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (shop_url, fingerprint) DO UPDATE SET last_seen = excluded.last_seen,
+                deep_scraped_at = excluded.deep_scraped_at, coupon_title = excluded.coupon_title,
+                coupon_description = excluded.coupon_description
+        ''', [(shop_url, fingerprint, scraped_at, scraped_at, scraped_at, title, description)
+              for fingerprint, title, description in cards])
+        self.conn.commit()
+        self.close()
+
+    def get_quarantined_shops(self, include_due=False):
+        """
+            Returns the shops whose circuit is open.
+
+            Args:
+                include_due (bool): Also returns the shops whose probe is due, by default only the shops
+                    that are skipped now are returned.
+
+            Returns:
+                dict: Dictionaries with the company name, the failures, the last error and the next probe
+                    by url.
+        """
+        self.connect()
+        query = '''
+            SELECT url, company_name, consecutive_failures, quarantines, last_error, quarantined_at, next_probe_at
+            FROM shop_health WHERE state = 'open'
+        '''
+        params = ()
+        if not include_due:
+            query += " AND next_probe_at > ?"
+            params = (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
+        columns = ('company_name', 'consecutive_failures', 'quarantines', 'last_error', 'quarantined_at',
+                   'next_probe_at')
+        shops = {row[0]: dict(zip(columns, row[1:])) for row in self.cursor.execute(query, params)}
+        self.close()
+        return shops
+
+    def record_shop_visit(self, url, company_name=None, error=None, failure_limit=None, quarantine_hours=None,
+                          max_quarantine_hours=None):
+        """
+            Updates the circuit breaker of a shop after a visit.
+
+            A visit that worked closes the circuit. A shop that failed failure_limit visits in a row is
+            quarantined: it is skipped until next_probe_at and then visited once as a probe. A failed
+            probe quarantines it again for twice as long, up to max_quarantine_hours.
+
+            Args:
+                error (str): Why the visit failed, None when it worked.
+
+            Returns:
+                dict: The state of the shop, with opened True when this visit quarantined it and recovered
+                    True when a probe closed the circuit.
+        """
+        failure_limit = self.BREAKER_FAILURES if failure_limit is None else failure_limit
+        quarantine_hours = self.QUARANTINE_HOURS if quarantine_hours is None else quarantine_hours
+        max_quarantine_hours = self.MAX_QUARANTINE_HOURS if max_quarantine_hours is None else max_quarantine_hours
+        now = datetime.now()
+        current_timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        self.connect()
+        row = self.cursor.execute(
+            "SELECT state, consecutive_failures, quarantines FROM shop_health WHERE url = ?", (url,)).fetchone()
+        previous_state, failures, quarantines = row or ('closed', 0, 0)
+        health = {'state': 'closed', 'consecutive_failures': 0, 'next_probe_at': None, 'opened': False,
+                  'recovered': previous_state == 'open' and error is None}
+        if error is None:
+            self.cursor.execute('''
+                INSERT INTO shop_health (url, company_name, state, consecutive_failures, quarantines)
+                VALUES (?, ?, 'closed', 0, 0)
+                ON CONFLICT (url) DO UPDATE SET company_name = COALESCE(excluded.company_name, company_name),
+                    state = 'closed', consecutive_failures = 0, quarantines = 0, quarantined_at = NULL,
+                    next_probe_at = NULL
+            ''', (url, company_name))
+        else:
+            failures += 1
+            health['consecutive_failures'] = failures
+            # A failed probe or one failure too many opens the circuit
+            if previous_state == 'open' or failures >= failure_limit:
+                quarantines += 1
+                hours = min(max_quarantine_hours, quarantine_hours * 2 ** (quarantines - 1))
+                health['next_probe_at'] = (now + timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
+                health['state'] = 'open'
+                health['opened'] = previous_state != 'open'
+            self.cursor.execute('''
+                INSERT INTO shop_health (url, company_name, state, consecutive_failures, quarantines, last_error,
+                    last_failure_at, quarantined_at, next_probe_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET company_name = COALESCE(excluded.company_name, company_name),
+                    state = excluded.state, consecutive_failures = excluded.consecutive_failures,
+                    quarantines = excluded.quarantines, last_error = excluded.last_error,
+                    last_failure_at = excluded.last_failure_at,
+                    quarantined_at = COALESCE(quarantined_at, excluded.quarantined_at),
+                    next_probe_at = excluded.next_probe_at
+            ''', (url, company_name, health['state'], failures, quarantines if health['state'] == 'open' else 0,
+                  error, current_timestamp, current_timestamp if health['state'] == 'open' else None,
+                  health['next_probe_at']))
+        self.conn.commit()
+        self.close()
+        return health
+
     def close(self):
         if self.conn:
             self.conn.close()
             self.conn = None
             self.cursor = None
 
+
+def start_purge_thread(db_name='coupons.db', interval_seconds=3600, retention_hours=None):
+    """
+        Starts a daemon thread that purges expired coupons and compacts the change log every interval_seconds.
+        The thread uses its own Database instance so it never shares a connection with the crawler.
+    """
+    db = Database(db_name, purge_hours=retention_hours)
+
+    def purge_loop():
+        while True:
+            purged = db.purge_deleted_coupons()
+            if purged:
+                print(f"Purged expired coupons: {purged}")
+            compacted = db.compact_change_log()
+            if compacted:
+                print(f"Compacted change log entries: {compacted}")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=purge_loop, name='coupon-purge', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Maintenance commands for the coupons database.')
+    parser.add_argument('command', choices=['rebuild-search', 'backfill-discounts', 'compare-runs'])
+    parser.add_argument('--db', default='coupons.db')
+    parser.add_argument('--run', type=int, help='Run checked by compare-runs, the last one by default')
+    parser.add_argument('--baseline-runs', type=int, default=Database.BASELINE_RUNS)
+    parser.add_argument('--threshold', type=float, default=Database.REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    database = Database(args.db)
+    database.create_table()
+    if args.command == 'rebuild-search':
+        database.rebuild_search_index()
+        print("Search indexes rebuilt.")
+    elif args.command == 'backfill-discounts':
+        database.backfill_discount_columns(only_missing=False)
+    elif args.command == 'compare-runs':
+        regressions = database.get_run_regressions(args.run, args.baseline_runs, args.threshold)
+        for regression in regressions:
+            change = 'new' if regression['change'] == float('inf') else f"{regression['change'] * 100:+.0f}%"
+            print(f"{regression['url']:<60} {regression['metric']:<28} "
+                  f"baseline {regression['baseline']:10.2f}  now {regression['value']:10.2f}  {change}")
+        print(f"Regressions: {len(regressions)}")
+        # A non zero exit code lets a cron job or CI alert on it
+        raise SystemExit(1 if regressions else 0)
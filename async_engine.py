@@ -0,0 +1,370 @@
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from coupon_model import Coupon
+from cuponation import (COUPONS_FOUND, DB_COUPONS_WRITTEN, LAST_SHOP_FINISHED, SHOP_COUPONS, SHOP_EXTRACTIONS,
+                        SHOP_SECONDS, SHOPS_CRAWLED, SIMILAR_LOOKUPS, STAGE_FAILURES, STAGE_SECONDS,
+                        VOUCHER_FINGERPRINT_SCRIPT, ScrappingCoupon)
+from metrics import measure
+from network_capture import find_vouchers
+from rate_limiter import CAPTCHA_SCRIPT, block_reason
+from terms_parser import parse_terms_html
+
+# The same elements as the XPaths of ScrappingCoupon
+WIDGETS = ('active-vouchers-widget', 'similar-vouchers-widget')
+SEE_MORE_XPATH = "//div[@class='r0c5x30']/div"
+POPUP_TITLE_XPATH = "//div[@data-testid='voucherPopup-header-popupTitleWrapper']/h4"
+TERMS_BUTTON_XPATH = "//div[@data-testid='voucherPopup-collapsablePanel-header']/button"
+TERMS_XPATH = "//div[@data-testid='voucherPopup-termsAndConditions-root']"
+CODE_XPATH = "//span[@data-testid='voucherPopup-codeHolder-voucherType-code']/h4"
+CLOSE_ICON_SELECTOR = "span[data-testid='CloseIcon']"
+FINGERPRINT_FUNCTION = 'card => (function () {' + VOUCHER_FINGERPRINT_SCRIPT + '})(card)'
+CAPTCHA_FUNCTION = '() => {' + CAPTCHA_SCRIPT + '}'
+NEXT_DATA_SCRIPT = "() => { const script = document.getElementById('__NEXT_DATA__'); return script && script.textContent; }"
+# Waits of the popup elements, like the WebDriverWait of 3 seconds of ScrappingCoupon
+TIMEOUT_MS = 3000
+
+
+class PageBlocked(Exception):
+    # The site refused the page of a shop, reason is rate_limited, server_error or captcha like block_reason
+    def __init__(self, reason):
+        super().__init__(f"The site refused the page: {reason}")
+        self.reason = reason
+
+
+class AsyncShopCrawler:
+    def __init__(self, scraper=None, concurrency=4, headless=False):
+        """
+            Crawls many shops at the same time in one Chrome process with Playwright's async API, a page
+            per shop. The coupons are read like ScrappingCoupon reads them: from the JSON payloads of
+            the page with network_capture.find_vouchers, and by clicking the cards when no payload has
+            them. They are saved with the same Database, run ledger and metrics.
+
+            Playwright is an optional dependency: pip install playwright && playwright install chromium
+
+            Args:
+                scraper (ScrappingCoupon): Gives the links file, the database and the settings.
+                concurrency (int): Pages open at the same time.
+        """
+        self.scraper = scraper or ScrappingCoupon()
+        self.concurrency = concurrency
+        self.headless = headless
+        self.shops_done = 0
+        # Similar vouchers seen in the run, shared by all the pages like the seen set of ScrappingCoupon
+        self.seen_vouchers = set()
+        self.similar_lookups = 0
+        self.similar_hits = 0
+        # The one thread that writes the database and the links file during a run, see run_db
+        self.db_executor = None
+
+    def crawl(self, urls):
+        return asyncio.run(self.crawl_shops(urls))
+
+    async def crawl_shops(self, urls):
+        try:
+            from playwright.async_api import async_playwright
+        except ImportError:
+            raise SystemExit("The async engine needs Playwright: pip install playwright && playwright install chromium")
+
+        names = {link[0]: link[1] for link in self.scraper.read_links() if len(link) > 1}
+        urls = self.scraper.skip_quarantined(urls)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        run_id = self.scraper.db.start_run()
+        self.seen_vouchers = set()
+        self.similar_lookups = self.similar_hits = 0
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        try:
+            async with async_playwright() as playwright:
+                browser = await playwright.chromium.launch(headless=self.headless)
+                # One context for all pages, they share the HTTP cache of the site
+                context = await browser.new_context()
+                try:
+                    await asyncio.gather(*(self.crawl_shop(context, semaphore, run_id, url, names.get(url))
+                                           for url in urls))
+                finally:
+                    await browser.close()
+        finally:
+            self.db_executor.shutdown()
+            self.db_executor = None
+        self.scraper.db.finish_run(run_id, self.similar_lookups, self.similar_hits)
+        if self.similar_lookups:
+            print(f"Similar vouchers skipped as already seen: {self.similar_hits} of {self.similar_lookups} "
+                  f"({self.similar_hits / self.similar_lookups:.0%})")
+        self.scraper.send_quarantine_summary()
+
+    async def run_db(self, function, *args, **kwargs):
+        """
+            Runs a blocking call of the database or the links file in the writer thread, so the event
+            loop keeps driving the other pages. One thread for all of them: Database keeps its connection
+            on the instance and update_url_status rewrites the whole file, two calls can't overlap.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor,
+                                                                functools.partial(function, *args, **kwargs))
+
+    async def crawl_shop(self, context, semaphore, run_id, url, company_name):
+        async with semaphore:
+            shop_started = time.perf_counter()
+            db = self.scraper.db
+            shop_run_id = await self.run_db(db.start_shop_run, run_id, url)
+            shop_run = ScrappingCoupon.new_shop_run()
+            shop_run['company_name'] = company_name
+            coupons = []
+            error = None
+            blocked = False
+            crawl_started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            # Every page the shop opens, the voucher popups open new ones
+            pages = [await context.new_page()]
+            try:
+                coupons = await self.extract_coupons(pages, url, company_name, shop_run)
+                if coupons:
+                    counts = await self.run_db(db.insert_coupons, coupons)
+                    for status, count in counts.items():
+                        DB_COUPONS_WRITTEN.inc(count, status=status)
+                    shop_run['inserted'], shop_run['updated'] = counts['inserted'], counts['updated']
+                elif shop_run['failures']:
+                    error = f"{shop_run['failures']} failed stages and no coupons"
+                # A failed visit didn't see the listed coupons, they are kept until a visit that works
+                if company_name and error is None:
+                    shop_run['removed'] = await self.run_db(db.update_last_scrapped_column, company_name,
+                                                            crawl_started_at)
+            except PageBlocked as e:
+                # Nothing of the shop was read, it is not swept. A throttled site is crawled again, a 5xx or
+                # a challenge of this page is a failed visit like in ScrappingCoupon.start_webdriver
+                shop_run['failures'] += 1
+                if e.reason == 'rate_limited':
+                    blocked = True
+                else:
+                    error = str(e)
+            except Exception as e:
+                shop_run['failures'] += 1
+                error = f"{type(e).__name__}: {e}".strip()
+                print(f"Error crawling {url}: {e}")
+            finally:
+                for page in pages:
+                    if not page.is_closed():
+                        await page.close()
+
+            if not blocked:
+                # The circuit breaker counts the failed visits like ScrappingCoupon.start_webdriver
+                await self.run_db(self.scraper.record_visit, url, company_name, error)
+                await self.run_db(self.scraper.update_url_status, url, 'True')
+
+            seconds = time.perf_counter() - shop_started
+            await self.run_db(db.finish_shop_run, shop_run_id, seconds, coupons_found=len(coupons), **shop_run)
+            COUPONS_FOUND.inc(len(coupons))
+            SHOP_SECONDS.observe(seconds)
+            SHOP_COUPONS.observe(len(coupons))
+            SHOPS_CRAWLED.inc()
+            LAST_SHOP_FINISHED.set(time.time())
+            self.shops_done += 1
+            print(f"{url}: {len(coupons)} coupons in {seconds:.1f} s")
+
+    async def stage(self, shop_run, name, coroutine):
+        # Times an awaited stage for the metrics and the run ledger, like ScrappingCoupon.stage
+        start = time.perf_counter()
+        try:
+            with measure(STAGE_SECONDS, STAGE_FAILURES, stage=name):
+                return await coroutine
+        except Exception:
+            shop_run['failures'] += 1
+            raise
+        finally:
+            shop_run['stage_seconds'][name] = shop_run['stage_seconds'].get(name, 0.0) + time.perf_counter() - start
+
+    async def throttle(self):
+        # Waits for the turn of the next request in the rate limiter shared with the other workers, the
+        # limiter locks its SQLite file so it runs in a thread of its own
+        if self.scraper.rate_limiter is not None:
+            await asyncio.sleep(await asyncio.to_thread(self.scraper.rate_limiter.reserve, self.scraper.site_domain))
+
+    async def check_blocked(self, page, response):
+        # Adapts the rate limiter to the answer of the site like ScrappingCoupon.check_blocked
+        rate_limiter = self.scraper.rate_limiter
+        if rate_limiter is None:
+            return None
+        try:
+            captcha = await page.evaluate(CAPTCHA_FUNCTION)
+        except Exception:
+            captcha = False
+        status = response.status if response else None
+        reason = block_reason(status, captcha)
+        if reason is None:
+            await asyncio.to_thread(rate_limiter.record_success, self.scraper.site_domain)
+            return None
+        rate, backoff = await asyncio.to_thread(rate_limiter.record_block, self.scraper.site_domain, reason)
+        print(f"The site refused the page ({reason}, status {status}), backing off for {backoff:.0f} s "
+              f"at {rate:.2f} requests/s")
+        return reason
+
+    async def extract_coupons(self, pages, url, company_name, shop_run):
+        """
+            Returns:
+                list: The coupons of the shop.
+
+            Raises:
+                PageBlocked: The site refused the page.
+        """
+        page = pages[0]
+        payloads = []
+        pending = []
+
+        async def read_json(response):
+            try:
+                payloads.append(await response.json())
+            except Exception:
+                pass
+
+        def on_response(response):
+            if 'json' in response.headers.get('content-type', '') or response.request.resource_type in ('xhr', 'fetch'):
+                pending.append(asyncio.ensure_future(read_json(response)))
+
+        if self.scraper.CAPTURE_MODE == 'network':
+            page.on('response', on_response)
+        await self.throttle()
+        response = await self.stage(shop_run, 'page_load', page.goto(url, wait_until='domcontentloaded'))
+        reason = await self.check_blocked(page, response)
+        if reason:
+            raise PageBlocked(reason)
+
+        if self.scraper.CAPTURE_MODE == 'network':
+            coupons = await self.stage(shop_run, 'network_capture',
+                                       self.capture_vouchers(page, company_name, payloads, pending))
+            page.remove_listener('response', on_response)
+            if coupons:
+                SHOP_EXTRACTIONS.inc(method='network')
+                return coupons
+            SHOP_EXTRACTIONS.inc(method='dom_fallback')
+        else:
+            SHOP_EXTRACTIONS.inc(method='dom')
+
+        coupons = []
+        for widget in WIDGETS:
+            xpath = f'xpath=//div[@data-testid="{widget}"]/div'
+            try:
+                await pages[-1].locator(xpath).first.wait_for(timeout=TIMEOUT_MS)
+            except Exception:
+                continue
+            await self.collect_vouchers(pages, xpath, company_name, coupons, shop_run,
+                                        dedup=widget == 'similar-vouchers-widget')
+        return coupons
+
+    async def capture_vouchers(self, page, company_name, payloads, pending):
+        try:
+            next_data = await page.evaluate(NEXT_DATA_SCRIPT)
+            if next_data:
+                payloads.append(json.loads(next_data))
+        except Exception:
+            pass
+
+        coupons = {}
+        deadline = time.monotonic() + self.scraper.CAPTURE_WAIT_SECONDS
+        while True:
+            if pending:
+                await asyncio.gather(*pending)
+                pending.clear()
+            for payload in payloads:
+                for coupon in find_vouchers(payload, company_name):
+                    coupons.setdefault(coupon.key(), coupon)
+            payloads.clear()
+            if coupons or time.monotonic() >= deadline:
+                return list(coupons.values())
+            await asyncio.sleep(0.5)
+
+    async def click_see_more(self, page):
+        try:
+            see_more = page.locator(f'xpath={SEE_MORE_XPATH}').first
+            await see_more.click(timeout=TIMEOUT_MS)
+        except Exception:
+            pass
+
+    async def voucher_fingerprint(self, card):
+        try:
+            return await card.evaluate(FINGERPRINT_FUNCTION)
+        except Exception:
+            return None
+
+    def seen_before(self, fingerprint):
+        if not fingerprint:
+            return False
+        self.similar_lookups += 1
+        if fingerprint in self.seen_vouchers:
+            self.similar_hits += 1
+            SIMILAR_LOOKUPS.inc(result='hit')
+            return True
+        SIMILAR_LOOKUPS.inc(result='miss')
+        return False
+
+    async def collect_vouchers(self, pages, xpath, company_name, coupons, shop_run, dedup=False):
+        """
+            Clicks through the cards like ScrappingCoupon.collect_vouchers. A click opens the voucher
+            popup in a new page and sends the old page to the shop behind the voucher, so the crawl
+            goes on in the popup page, the last one of pages.
+        """
+        await self.click_see_more(pages[-1])
+        for i in range(await pages[-1].locator(xpath).count()):
+            page = pages[-1]
+            card = page.locator(xpath).nth(i)
+            coupon = Coupon(company_name=company_name)
+            try:
+                coupon.button_name = (await card.locator("xpath=.//div[@role='button']").first.inner_text(
+                    timeout=TIMEOUT_MS)).strip()
+            except Exception:
+                pass
+            if coupon.button_name == 'SUBSCRIBE' or await card.get_attribute('data-testid') == 'kam-banner-main-1':
+                continue
+            fingerprint = await self.voucher_fingerprint(card) if dedup else None
+            if self.seen_before(fingerprint):
+                continue
+
+            shop_url = page.url
+            await self.throttle()
+            try:
+                async with page.context.expect_page(timeout=TIMEOUT_MS) as popup_info:
+                    await self.stage(shop_run, 'card_click', card.click(timeout=TIMEOUT_MS))
+                popup = await popup_info.value
+                pages.append(popup)
+            except Exception:
+                print("Coupon btn is not find!")
+                continue
+
+            try:
+                coupon.title = await popup.locator(f'xpath={POPUP_TITLE_XPATH}').first.inner_text(timeout=TIMEOUT_MS)
+            except Exception:
+                print("Error fetching title!")
+            try:
+                await popup.locator(f'xpath={TERMS_BUTTON_XPATH}').first.click(timeout=TIMEOUT_MS)
+            except Exception:
+                pass
+            try:
+                terms_html = await popup.locator(f'xpath={TERMS_XPATH}').first.inner_html(timeout=TIMEOUT_MS)
+                for label, value in parse_terms_html(terms_html):
+                    if label is None:
+                        if coupon.description is None:
+                            coupon.description = value
+                    else:
+                        coupon.set_label(label, value)
+            except Exception:
+                print("Paragraphs does not exists!")
+            try:
+                coupon.code = await popup.locator(f'xpath={CODE_XPATH}').first.inner_text(timeout=1000)
+            except Exception:
+                pass
+
+            # The old page goes to the shop of the voucher, its URL is the URL of the coupon
+            try:
+                await page.wait_for_url(lambda current_url: current_url != shop_url, timeout=TIMEOUT_MS)
+            except Exception:
+                pass
+            coupon.url = page.url
+            await page.close()
+            try:
+                await popup.locator(CLOSE_ICON_SELECTOR).first.click(timeout=TIMEOUT_MS)
+            except Exception:
+                print("We can't click on close alert button!")
+            coupons.append(coupon)
+            if fingerprint:
+                self.seen_vouchers.add(fingerprint)
@@ -0,0 +1,343 @@
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import Counter, Gauge, Histogram
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+BROWSER_START_SECONDS = Histogram('cuponation_browser_start_seconds', 'Time to launch Chrome and its driver')
+BROWSER_ACQUIRE_SECONDS = Histogram('cuponation_browser_acquire_seconds',
+                                    'Time a worker waited for a browser, from the warm pool or a cold start',
+                                    ['source'])
+DRIVER_CACHE_LOOKUPS = Counter('cuponation_driver_cache_lookups_total',
+                               'Lookups of the patched chromedriver in the cache by result', ['result'])
+DRIVER_PATCH_SECONDS = Histogram('cuponation_driver_patch_seconds',
+                                 'Time to download and patch chromedriver on a cache miss')
+PROFILE_ROTATIONS = Counter('cuponation_browser_profile_rotations_total',
+                            'Browser profiles deleted because they were too big or too old', ['reason'])
+HTTP_RESPONSES = Counter('cuponation_http_responses_total', 'Responses loaded by Chrome by where they came from',
+                         ['source'])
+HTTP_CACHE_HIT_RATIO = Gauge('cuponation_http_cache_hit_ratio',
+                             'Share of the responses of the last shop served from the browser cache')
+
+
+@contextmanager
+def file_lock(path):
+    # Exclusive lock shared by all the processes that use the same lock file
+    with open(path, 'a+') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            # msvcrt.locking retries for about 10 seconds before it raises, keep waiting like flock
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def try_lock(file):
+    # Non blocking exclusive lock of an open file, False when another process holds it
+    try:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def count_cache_hits(performance_log):
+    """
+        Counts where the responses of Chrome's performance log came from. The log is read with
+        get_log('performance') and needs the goog:loggingPrefs capability.
+
+        Returns:
+            dict: Responses per source, network, disk_cache or memory_cache.
+    """
+    counts = {'network': 0, 'disk_cache': 0, 'memory_cache': 0}
+    served_from_memory = set()
+    responses = []
+    for entry in performance_log:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.requestServedFromCache':
+            served_from_memory.add(message['params']['requestId'])
+        elif message['method'] == 'Network.responseReceived':
+            responses.append(message['params'])
+    for params in responses:
+        response = params['response']
+        if response.get('url', '').startswith('data:'):
+            continue
+        if response.get('fromDiskCache'):
+            counts['disk_cache'] += 1
+        elif params['requestId'] in served_from_memory:
+            counts['memory_cache'] += 1
+        else:
+            counts['network'] += 1
+    return counts
+
+
+class DriverCache:
+    def __init__(self, directory='DriverCache', version_main=0, max_age_days=7):
+        """
+            Keeps one patched chromedriver binary that every process and worker reuses.
+
+            uc.Chrome downloads and patches a fresh chromedriver on every start unless it is given a
+            binary that is already patched. The first caller downloads and patches it under a file lock,
+            the others wait for the lock and then find the binary in the cache.
+
+            Args:
+                version_main (int): Major version of Chrome, 0 for the latest driver.
+                max_age_days (float): The latest driver is downloaded again after this many days, so it
+                    follows the Chrome updates. A pinned version_main is kept until it is invalidated.
+        """
+        self.directory = directory
+        self.version_main = version_main
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+
+    @property
+    def driver_path(self):
+        name = f"chromedriver-{self.version_main or 'latest'}"
+        return os.path.abspath(os.path.join(self.directory, name + ('.exe' if sys.platform == 'win32' else '')))
+
+    def is_fresh(self, path):
+        import undetected_chromedriver as uc
+
+        if not os.path.exists(path) or not uc.Patcher(executable_path=path).is_binary_patched(path):
+            return False
+        if self.version_main:
+            return True
+        return time.time() - os.path.getmtime(path) < self.max_age_days * 24 * 3600
+
+    def get_driver_path(self):
+        """
+            Returns:
+                str: Path of the patched chromedriver, downloaded and patched when it isn't cached.
+        """
+        import undetected_chromedriver as uc
+
+        path = self.driver_path
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock, file_lock(os.path.join(self.directory, '.lock')):
+            if self.is_fresh(path):
+                DRIVER_CACHE_LOOKUPS.inc(result='hit')
+                return path
+
+            DRIVER_CACHE_LOOKUPS.inc(result='miss')
+            start = time.perf_counter()
+            # The binary is patched next to the cache and renamed in place, a running Chrome keeps the old file
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            patcher = uc.Patcher(version_main=self.version_main)
+            patcher.executable_path = temporary_path
+            patcher.auto()
+            os.chmod(temporary_path, 0o755)
+            os.replace(temporary_path, path)
+            DRIVER_PATCH_SECONDS.observe(time.perf_counter() - start)
+            print(f"Patched chromedriver saved to {path}")
+            return path
+
+    def invalidate(self):
+        # Called when Chrome refuses the cached driver, usually after a Chrome update
+        with self.lock, file_lock(os.path.join(self.directory, '.lock')):
+            if os.path.exists(self.driver_path):
+                os.remove(self.driver_path)
+
+
+class BrowserPool:
+    def __init__(self, start_browser, size=1, quit_browser=None):
+        """
+            Keeps size browsers started in the background, so a new or recycled worker gets one at once.
+
+            Args:
+                start_browser (callable): Starts and returns a new browser.
+                size (int): Warm browsers kept waiting. A browser is started to replace every one that
+                    is taken.
+                quit_browser (callable): Quits a browser of the pool, browser.quit() by default.
+        """
+        self.start_browser = start_browser
+        self.quit_browser = quit_browser or (lambda browser: browser.quit())
+        self.size = size
+        self.idle = queue.Queue()
+        self.starting = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.fill()
+
+    def fill(self):
+        with self.lock:
+            missing = self.size - self.idle.qsize() - self.starting
+            if self.closed or missing <= 0:
+                return
+            self.starting += missing
+        for _ in range(missing):
+            threading.Thread(target=self.start_idle_browser, daemon=True).start()
+
+    def start_idle_browser(self):
+        try:
+            browser = self.start_browser()
+        except Exception as e:
+            print(f"Error starting a warm browser: {e}")
+            browser = None
+        with self.lock:
+            self.starting -= 1
+            closed = self.closed
+        if browser is None:
+            return
+        if closed:
+            self.quit_browser(browser)
+        else:
+            self.idle.put(browser)
+
+    @staticmethod
+    def is_alive(browser):
+        try:
+            browser.current_url
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """
+            Returns:
+                A warm browser from the pool, or a browser started now when none is ready.
+        """
+        start = time.perf_counter()
+        while True:
+            try:
+                # A browser that is already starting is ready sooner than a new one
+                browser = self.idle.get(timeout=0.5 if self.starting else 0)
+            except queue.Empty:
+                if self.starting:
+                    continue
+                break
+            if self.is_alive(browser):
+                self.fill()
+                BROWSER_ACQUIRE_SECONDS.observe(time.perf_counter() - start, source='pool')
+                return browser
+            # Chrome died while it was waiting in the pool
+            try:
+                self.quit_browser(browser)
+            except Exception:
+                pass
+
+        browser = self.start_browser()
+        self.fill()
+        BROWSER_ACQUIRE_SECONDS.observe(time.perf_counter() - start, source='cold')
+        return browser
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        while True:
+            try:
+                browser = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.quit_browser(browser)
+            except Exception:
+                pass
+
+
+class ProfileManager:
+    # Written when a profile is created, its age decides the rotation
+    CREATED_FILE = 'profile_created'
+
+    def __init__(self, directory='BrowserProfiles', cache_mb=200, max_mb=500, max_days=7):
+        """
+            Hands out persistent Chrome user data directories, one per running browser, so the HTTP cache
+            of the site survives a browser restart.
+
+            A profile is locked by the process of the browser that uses it, other workers and processes
+            take the next free one. Profiles are checked when they are handed out: one that grew over
+            max_mb or is older than max_days is deleted and starts empty.
+
+            Args:
+                cache_mb (int): Cap of the disk cache of Chrome, passed as --disk-cache-size.
+        """
+        self.directory = directory
+        self.cache_mb = cache_mb
+        self.max_mb = max_mb
+        self.max_days = max_days
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    @property
+    def chrome_arguments(self):
+        return [f"--disk-cache-size={self.cache_mb * 1024 * 1024}"]
+
+    def acquire(self):
+        """
+            Returns:
+                str: Path of a free profile, locked until release is called with it.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            slot = 0
+            while True:
+                path = os.path.abspath(os.path.join(self.directory, f"worker-{slot}"))
+                if path not in self.locks:
+                    lock_file = open(f"{path}.lock", 'a+')
+                    if try_lock(lock_file):
+                        self.locks[path] = lock_file
+                        self.rotate_if_needed(path)
+                        return path
+                    lock_file.close()
+                slot += 1
+
+    def release(self, path):
+        with self.lock:
+            lock_file = self.locks.pop(path, None)
+        if lock_file is not None:
+            # Closing the file releases the lock
+            lock_file.close()
+
+    @staticmethod
+    def directory_size(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return size
+
+    def rotate_if_needed(self, path):
+        created_file = os.path.join(path, self.CREATED_FILE)
+        reason = None
+        if os.path.exists(created_file):
+            if time.time() - os.path.getmtime(created_file) > self.max_days * 24 * 3600:
+                reason = 'age'
+            elif self.directory_size(path) > self.max_mb * 1024 * 1024:
+                reason = 'size'
+        if reason:
+            print(f"Rotating the browser profile {path} ({reason})")
+            PROFILE_ROTATIONS.inc(reason=reason)
+            shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(created_file):
+            os.makedirs(path, exist_ok=True)
+            open(created_file, 'w').close()
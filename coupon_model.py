@@ -0,0 +1,96 @@
+import re
+
+# Labels found in the <b> tags of the terms, normalized to lower case without the colon, mapped to the field they fill
+LABEL_TO_FIELD = {
+    'title': 'title',
+    'description': 'description',
+    'offer': 'offer',
+    'discount': 'offer',
+    'order amount': 'order_ammount',
+    'order ammount': 'order_ammount',
+    'minimum order': 'order_ammount',
+    'minimum order amount': 'order_ammount',
+    'minimum order value': 'order_ammount',
+    'minimum spend': 'order_ammount',
+    'min. order value': 'order_ammount',
+    'limitation for users': 'limitations_for_users',
+    'limitations for users': 'limitations_for_users',
+    'limitation for user': 'limitations_for_users',
+    'user limitations': 'limitations_for_users',
+    'limitations on brands': 'limitations_on_brands',
+    'limitation on brands': 'limitations_on_brands',
+    'limitations on brand': 'limitations_on_brands',
+    'brand limitations': 'limitations_on_brands',
+    'button name': 'button_name',
+    'code': 'code',
+    'url': 'url',
+    'company name': 'company_name',
+}
+
+
+def normalize_label(label):
+    return re.sub(r'\s+', ' ', label).strip().strip(':').strip().lower()
+
+
+class Coupon:
+    """
+        One scraped coupon. Uses __slots__ so the thousands of records of a crawl don't each carry a dict.
+        The field names are the columns of the coupons table.
+    """
+    FIELDS = ('title', 'description', 'offer', 'order_ammount', 'limitations_for_users', 'limitations_on_brands',
+              'button_name', 'code', 'url', 'company_name')
+    __slots__ = FIELDS + ('unknown_labels',)
+
+    def __init__(self, title=None, description=None, offer=None, order_ammount=None, limitations_for_users=None,
+                 limitations_on_brands=None, button_name=None, code=None, url=None, company_name=None):
+        self.title = title
+        self.description = description
+        self.offer = offer
+        self.order_ammount = order_ammount
+        self.limitations_for_users = limitations_for_users
+        self.limitations_on_brands = limitations_on_brands
+        self.button_name = button_name
+        self.code = code
+        self.url = url
+        self.company_name = company_name
+        # Labels that are not in LABEL_TO_FIELD, kept so they can be logged and added to the map
+        self.unknown_labels = None
+
+    def set_label(self, label, value):
+        """
+            Stores a value found in the terms under its label, e.g. 'Order amount:'.
+
+            Returns:
+                bool: False if the label is not known, the value is then kept in unknown_labels.
+        """
+        field = LABEL_TO_FIELD.get(normalize_label(label))
+        if field is None:
+            if self.unknown_labels is None:
+                self.unknown_labels = {}
+            self.unknown_labels[label] = value
+            return False
+        setattr(self, field, value)
+        return True
+
+    def key(self):
+        # Same identity as the UNIQUE(title, description) constraint of the coupons table
+        return self.title, self.description
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{field: values.get(field) for field in cls.FIELDS})
+
+    def __eq__(self, other):
+        if not isinstance(other, Coupon):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    def __hash__(self):
+        # Equal coupons have the same key, a coupon must not change its title or description while in a set
+        return hash(self.key())
+
+    def __repr__(self):
+        return f"Coupon(title={self.title!r}, company_name={self.company_name!r}, code={self.code!r})"
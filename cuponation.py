@@ -1,41 +1,354 @@
 import sys
 import os
+import json
 import time
 import logging
-import requests
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
 from dotenv import load_dotenv
-from ManageDB import Database
+from ManageDB import Database, start_purge_thread
+from coupon_model import Coupon
+from terms_parser import parse_terms_html
+from network_capture import find_vouchers, json_responses
+from metrics import Counter, Gauge, Histogram, measure, start_http_server, start_textfile_writer
+from tracing import Tracer
+from profiling import ShopProfiler
+from browser_pool import (BROWSER_ACQUIRE_SECONDS, BROWSER_START_SECONDS, HTTP_CACHE_HIT_RATIO, HTTP_RESPONSES,
+                          BrowserPool, DriverCache, ProfileManager, count_cache_hits)
+from rate_limiter import CAPTCHA_SCRIPT, RateLimiter, block_reason, document_status
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Selenium and undetected_chromedriver take most of the startup time, they are imported by
+# load_browser_modules when the browser is first needed so the database commands start quickly
+uc = By = WebDriverWait = EC = TimeoutException = None
+
+
+def load_browser_modules():
+    global uc, By, WebDriverWait, EC, TimeoutException
+    if uc is not None:
+        return
+    import undetected_chromedriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+    uc = undetected_chromedriver
+
+
+# Prometheus metrics of the scraper, exported by start_http_server or start_textfile_writer
+STAGE_SECONDS = Histogram('cuponation_stage_seconds', 'Time spent in each stage of a shop crawl', ['stage'])
+STAGE_FAILURES = Counter('cuponation_stage_failures_total', 'Failed attempts of each stage of a shop crawl',
+                         ['stage'])
+SHOP_SECONDS = Histogram('cuponation_shop_seconds', 'Time to crawl one shop, page load included')
+SHOP_COUPONS = Histogram('cuponation_shop_coupons_found', 'Coupons found per crawled shop',
+                         buckets=(0, 1, 5, 10, 20, 50, 100, 200, 500))
+COUPONS_FOUND = Counter('cuponation_coupons_found_total', 'Coupons found by the scraper')
+SHOPS_CRAWLED = Counter('cuponation_shops_crawled_total', 'Shops crawled by the scraper')
+LAST_SHOP_FINISHED = Gauge('cuponation_last_shop_finished_timestamp_seconds', 'Unix time of the last crawled shop')
+DB_WRITE_SECONDS = Histogram('cuponation_db_write_seconds', 'Latency of the database writes of the scraper',
+                             ['operation'])
+DB_COUPONS_WRITTEN = Counter('cuponation_db_coupons_written_total', 'Coupons saved in the database by result',
+                             ['status'])
+SIMILAR_LOOKUPS = Counter('cuponation_similar_voucher_lookups_total',
+                          'Similar voucher cards checked against the vouchers seen in the run, a hit is skipped',
+                          ['result'])
+SHOP_EXTRACTIONS = Counter('cuponation_shop_extractions_total',
+                           'Shops by how their coupons were read, from network payloads or from the page', ['method'])
+SHOP_CIRCUIT_EVENTS = Counter('cuponation_shop_circuit_events_total',
+                              'Circuit breaker events of the shops: skipped, quarantined, probe_failed or recovered',
+                              ['event'])
+LISTING_CARDS = Counter('cuponation_listing_cards_total',
+                        'Cards read from the shop listings by state: new, fresh or stale popup', ['state'])
+
+# Identifies the voucher of a card without opening it: its voucher id when the card has one, else the
+# logo alt texts and the text of the card, which hold the shop and the title of the voucher
+VOUCHER_FINGERPRINT_SCRIPT = '''
+var card = arguments[0];
+var marked = card.matches('[data-voucher-id], [data-id]') ? card : card.querySelector('[data-voucher-id], [data-id]');
+if (marked) {
+    return 'id:' + (marked.getAttribute('data-voucher-id') || marked.getAttribute('data-id'));
+}
+var logos = Array.prototype.map.call(card.querySelectorAll('img[alt]'), function (img) { return img.alt; });
+return 'text:' + logos.concat([card.innerText]).join('|').replace(/\\s+/g, ' ').trim().toLowerCase();
+'''
+# Every card of both widgets in one round trip: its fingerprint, button and text, without opening it
+LISTING_SCRIPT = '''
+var fingerprint = function () {''' + VOUCHER_FINGERPRINT_SCRIPT + '''};
+var cards = [];
+['active-vouchers-widget', 'similar-vouchers-widget'].forEach(function (widget) {
+    document.querySelectorAll('div[data-testid="' + widget + '"] > div').forEach(function (card) {
+        var button = card.querySelector('div[role="button"]');
+        cards.push({widget: widget, fingerprint: fingerprint(card), button: button ? button.innerText.trim() : null,
+                    text: card.innerText.trim(), banner: card.getAttribute('data-testid') === 'kam-banner-main-1'});
+    });
+});
+return cards;
+'''
+
 
 class ScrappingCoupon:
     file_path = 'all_shop_links.txt'
+    db_name = 'coupons.db'
+    # Site that is scraped, a local replay of it for the benchmarks (see replay_server.py)
+    BASE_URL = os.getenv('CUPONATION_BASE_URL', 'https://www.cuponation.com.au').rstrip('/')
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     CHAT_ID = os.getenv('CHAT_ID')
     MESSAGE = os.getenv('MESSAGE')
+    # Expiry of coupons that are no longer listed, see Database.update_last_scrapped_column
+    MISSED_LIMIT = int(os.getenv('COUPON_MISSED_LIMIT', Database.MISSED_LIMIT))
+    GRACE_HOURS = float(os.getenv('COUPON_GRACE_HOURS', Database.GRACE_HOURS))
+    PURGE_HOURS = float(os.getenv('COUPON_PURGE_HOURS', Database.PURGE_HOURS))
+    # Shop traces for Perfetto, see tracing.Tracer. A TRACE_SLOW_SECONDS of 0 only keeps the sampled shops
+    TRACE_DIR = os.getenv('TRACE_DIR', 'Traces')
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))
+    TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', 120)) or None
+    # CPU and memory profiles of selected shops, see profiling.ShopProfiler. SIGUSR1 profiles the next shop
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'Profiling')
+    PROFILE_SHOPS = os.getenv('PROFILE_SHOPS', '').split(',')
+    PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 0))
+    PROFILE_MEMORY = os.getenv('PROFILE_MEMORY', 'False') == 'True'
+    PROFILE_MAX = int(os.getenv('PROFILE_MAX', 50))
+    # Patched chromedriver reused by every start, warm browsers kept ready and the shops a browser
+    # crawls before it is replaced (0 keeps it for the whole run), see browser_pool.py
+    DRIVER_CACHE_DIR = os.getenv('DRIVER_CACHE_DIR', 'DriverCache')
+    CHROME_VERSION_MAIN = int(os.getenv('CHROME_VERSION_MAIN', 0))
+    BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 0))
+    BROWSER_RECYCLE_SHOPS = int(os.getenv('BROWSER_RECYCLE_SHOPS', 0))
+    # Persistent Chrome profiles keep the HTTP cache of the site between browsers, an empty
+    # BROWSER_PROFILES_DIR starts every browser with a new temporary profile
+    BROWSER_PROFILES_DIR = os.getenv('BROWSER_PROFILES_DIR', 'BrowserProfiles')
+    BROWSER_CACHE_MB = int(os.getenv('BROWSER_CACHE_MB', 200))
+    BROWSER_PROFILE_MAX_MB = int(os.getenv('BROWSER_PROFILE_MAX_MB', 500))
+    BROWSER_PROFILE_MAX_DAYS = float(os.getenv('BROWSER_PROFILE_MAX_DAYS', 7))
+    # Reads Chrome's performance log after every shop for the cache hit ratio
+    BROWSER_CACHE_STATS = os.getenv('BROWSER_CACHE_STATS', 'True') == 'True'
+    # 'network' reads the vouchers from the JSON the shop page loads (see network_capture.py) and only
+    # clicks through the cards when no payload has them, 'dom' always clicks through the cards
+    CAPTURE_MODE = os.getenv('CAPTURE_MODE', 'dom')
+    CAPTURE_WAIT_SECONDS = float(os.getenv('CAPTURE_WAIT_SECONDS', 3))
+    # 'full' opens the popup of every card, 'light' only reads the listing of the shops and expires nothing,
+    # 'deep' opens the popups of new and changed cards and of cards not opened for CARD_REFRESH_HOURS,
+    # 'auto' runs light passes and a deep one when the last started DEEP_INTERVAL_HOURS ago
+    CRAWL_TIER = os.getenv('CRAWL_TIER', 'full')
+    DEEP_INTERVAL_HOURS = float(os.getenv('DEEP_INTERVAL_HOURS', 6))
+    CARD_REFRESH_HOURS = float(os.getenv('CARD_REFRESH_HOURS', 72))
+    # Requests per second to the site, shared by all the workers and processes that use RATE_LIMIT_DB and
+    # adapted to 429, 5xx and captcha answers, see rate_limiter.py. A RATE_LIMIT_RPS of 0 turns it off
+    RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', 'rate_limit.db')
+    RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', 1))
+    RATE_LIMIT_MAX_RPS = float(os.getenv('RATE_LIMIT_MAX_RPS', 4))
+    RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv('RATE_LIMIT_BACKOFF_SECONDS', 30))
+    # Circuit breaker of the shops, see Database.record_shop_visit. A visit stops reading the cards of a shop
+    # after CARD_FAILURE_LIMIT cards in a row failed
+    BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', Database.BREAKER_FAILURES))
+    QUARANTINE_HOURS = float(os.getenv('QUARANTINE_HOURS', Database.QUARANTINE_HOURS))
+    MAX_QUARANTINE_HOURS = float(os.getenv('MAX_QUARANTINE_HOURS', Database.MAX_QUARANTINE_HOURS))
+    CARD_FAILURE_LIMIT = int(os.getenv('CARD_FAILURE_LIMIT', 3))
 
     def __init__(self):
         """
-            Initializes the scraper with Chrome options, sets up the WebDriver,
-            initializes an empty dictionary for coupon details, creates an instance
-            of the ManageDB class, ensures the database table is created, and sets up
-            the default logger.
+            Initializes an empty Coupon record and the batch of coupons waiting to be
+            saved, and sets up the default logger. Chrome and the database are started
+            on first use by the webdriver and db properties.
         """
-        self.chrome_options = uc.ChromeOptions()
-        self.webdriver = uc.Chrome(options=self.chrome_options)
-        self.detail_of_coupon = {}
-        self.db = Database()  # Creating an instance of ManageDB
-        self.db.create_table()  # Ensure the table is created
+        self.chrome = None
+        self.database = None
+        self.driver_cache = DriverCache(self.DRIVER_CACHE_DIR, self.CHROME_VERSION_MAIN)
+        self.browser_pool = None
+        self.browser_profiles = ProfileManager(
+            self.BROWSER_PROFILES_DIR, self.BROWSER_CACHE_MB, self.BROWSER_PROFILE_MAX_MB,
+            self.BROWSER_PROFILE_MAX_DAYS) if self.BROWSER_PROFILES_DIR else None
+        self.site_domain = urlsplit(self.BASE_URL).netloc
+        self.rate_limiter = RateLimiter(
+            self.RATE_LIMIT_DB, self.RATE_LIMIT_RPS, self.RATE_LIMIT_MAX_RPS,
+            backoff_seconds=self.RATE_LIMIT_BACKOFF_SECONDS) if self.RATE_LIMIT_RPS else None
+        self.coupon = Coupon()
+        self.pending_coupons = []
+        self.shop_coupons = 0
+        # Results of the current shop for the run ledger
+        self.shop_run = self.new_shop_run()
+        # Performance log entries of the current shop and the responses read by the network capture
+        self.performance_log = []
+        self.captured_request_ids = set()
+        # Similar vouchers seen in the current run, they are opened once per run and not once per shop
+        self.seen_vouchers = set()
+        self.coupon_fingerprint = None
+        self.similar_lookups = 0
+        self.similar_hits = 0
+        # Tier of the current run, the listing of the current shop (deep_scraped_at by fingerprint) and
+        # the cards opened in it, as (fingerprint, title, description)
+        self.tier = 'full'
+        self.shop_url = None
+        self.listing = {}
+        self.card_fingerprint = None
+        self.deep_cards = []
+        # True after refresh_listing clicked the 'See More' button, the next widget reuses the expanded listing
+        self.listing_expanded = False
+        # Why the visit of the current shop failed and its cards, for the circuit breaker, and the shops
+        # quarantined or recovered in the run for the summary alert
+        self.visit_error = None
+        self.card_attempts = 0
+        self.card_failures = 0
+        self.quarantined_in_run = {}
+        self.recovered_in_run = []
+        self.tracer = Tracer(self.TRACE_DIR, self.TRACE_SAMPLE_RATE, self.TRACE_SLOW_SECONDS)
+        self.profiler = ShopProfiler(self.PROFILE_DIR, [shop.strip() for shop in self.PROFILE_SHOPS],
+                                     self.PROFILE_EVERY, self.PROFILE_MEMORY, self.PROFILE_MAX)
         self.setup_default_logger()
 
+    @property
+    def webdriver(self):
+        """
+            The Chrome WebDriver, taken from the warm pool or started on first use.
+        """
+        if self.chrome is None:
+            if self.BROWSER_POOL_SIZE:
+                if self.browser_pool is None:
+                    self.browser_pool = BrowserPool(self.start_browser, self.BROWSER_POOL_SIZE, self.quit_browser)
+                self.chrome = self.browser_pool.acquire()
+            else:
+                start = time.perf_counter()
+                self.chrome = self.start_browser()
+                BROWSER_ACQUIRE_SECONDS.observe(time.perf_counter() - start, source='cold')
+        return self.chrome
+
+    def new_chrome_options(self):
+        # uc.Chrome doesn't accept ChromeOptions that were used before, every start gets new ones
+        options = uc.ChromeOptions()
+        if self.browser_profiles:
+            for argument in self.browser_profiles.chrome_arguments:
+                options.add_argument(argument)
+        if self.performance_logging:
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        return options
+
+    def start_browser(self):
+        """
+            Starts Chrome with the patched chromedriver of the driver cache and a persistent profile
+            of the profile manager. The pool calls it from its own threads.
+        """
+        load_browser_modules()
+        from selenium.common.exceptions import SessionNotCreatedException
+
+        start = time.perf_counter()
+        user_data_dir = self.browser_profiles.acquire() if self.browser_profiles else None
+        try:
+            try:
+                browser = uc.Chrome(options=self.new_chrome_options(), user_data_dir=user_data_dir,
+                                    driver_executable_path=self.driver_cache.get_driver_path())
+            except SessionNotCreatedException:
+                # The cached driver doesn't match the installed Chrome any more, patch a new one
+                self.driver_cache.invalidate()
+                browser = uc.Chrome(options=self.new_chrome_options(), user_data_dir=user_data_dir,
+                                    driver_executable_path=self.driver_cache.get_driver_path())
+        except Exception:
+            if user_data_dir:
+                self.browser_profiles.release(user_data_dir)
+            raise
+        BROWSER_START_SECONDS.observe(time.perf_counter() - start)
+        return browser
+
+    def quit_browser(self, browser):
+        # The profile is only free again once Chrome stopped writing to it
+        try:
+            browser.quit()
+        finally:
+            if self.browser_profiles:
+                self.browser_profiles.release(browser.user_data_dir)
+
+    def recycle_webdriver(self):
+        # Replaces the browser, the next use of webdriver takes a warm one from the pool
+        if self.chrome is not None:
+            self.quit_browser(self.chrome)
+            self.chrome = None
+
+    @property
+    def performance_logging(self):
+        # Chrome keeps a performance log for the cache stats, the network capture and the page status
+        return self.BROWSER_CACHE_STATS or self.CAPTURE_MODE == 'network' or self.rate_limiter is not None
+
+    def throttle(self):
+        # Waits for the turn of the next request to the site
+        if self.rate_limiter is None:
+            return
+        with self.tracer.span('rate_limit', 'wait') as span_args:
+            span_args['seconds'] = self.rate_limiter.acquire(self.site_domain)
+
+    def check_blocked(self):
+        """
+            Looks for a 429 or 5xx answer to the page that was just loaded and for a captcha, and
+            adapts the rate limiter: the rate goes up after a page that loaded and backs off after a
+            refused one.
+
+            Returns:
+                str: The reason of the block, None when the page loaded.
+        """
+        if self.rate_limiter is None:
+            return None
+        status = None
+        try:
+            status = document_status(self.read_performance_log())
+        except Exception as e:
+            self.logger.error(f"Error reading the performance log: {e}")
+        try:
+            captcha = self.webdriver.execute_script(CAPTCHA_SCRIPT)
+        except Exception:
+            captcha = False
+
+        reason = block_reason(status, captcha)
+        if reason is None:
+            self.rate_limiter.record_success(self.site_domain)
+            return None
+        rate, backoff = self.rate_limiter.record_block(self.site_domain, reason)
+        message = (f"The site refused the page ({reason}, status {status}), backing off for {backoff:.0f} s "
+                   f"at {rate:.2f} requests/s")
+        self.logger.warning(message)
+        print(message)
+        return reason
+
+    def read_performance_log(self):
+        """
+            Returns the performance log entries of the current shop. get_log empties the buffer of
+            chromedriver, so the entries are kept for every reader until the next shop.
+        """
+        self.performance_log.extend(self.webdriver.get_log('performance'))
+        return self.performance_log
+
+    def record_cache_hits(self):
+        """
+            Reads the performance log of the browser, buffered since the previous shop, and exports
+            how many responses of the shop came from the HTTP cache.
+        """
+        if not self.BROWSER_CACHE_STATS or self.chrome is None:
+            return
+        try:
+            counts = count_cache_hits(self.read_performance_log())
+        except Exception as e:
+            self.logger.error(f"Error reading the performance log: {e}")
+            return
+        for source, count in counts.items():
+            HTTP_RESPONSES.inc(count, source=source)
+        total = sum(counts.values())
+        if total:
+            ratio = (counts['disk_cache'] + counts['memory_cache']) / total
+            HTTP_CACHE_HIT_RATIO.set(ratio)
+            self.logger.info(f"HTTP cache hit ratio: {ratio:.0%} of {total} responses")
+
+    @property
+    def db(self):
+        """
+            The ManageDB instance, its tables are created on first use.
+        """
+        if self.database is None:
+            self.database = Database(self.db_name, missed_limit=self.MISSED_LIMIT, grace_hours=self.GRACE_HOURS,
+                                     purge_hours=self.PURGE_HOURS)  # Creating an instance of ManageDB
+            self.database.create_table()  # Ensure the table is created
+        return self.database
+
     def setup_default_logger(self):
         """
             Configures the default logger to output log messages to standard output
@@ -51,6 +364,26 @@ class ScrappingCoupon:
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
 
+    @staticmethod
+    def new_shop_run():
+        return {'company_name': None, 'inserted': 0, 'updated': 0, 'removed': 0, 'failures': 0, 'stage_seconds': {}}
+
+    @contextmanager
+    def stage(self, name, count_failures=True):
+        # Times a stage of the crawl for the metrics, the trace of the shop and the run ledger
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(name) as span_args, \
+                    measure(STAGE_SECONDS, STAGE_FAILURES if count_failures else None, stage=name):
+                yield span_args
+        except Exception:
+            if count_failures:
+                self.shop_run['failures'] += 1
+            raise
+        finally:
+            stage_seconds = self.shop_run['stage_seconds']
+            stage_seconds[name] = stage_seconds.get(name, 0.0) + time.perf_counter() - start
+
     def start_webdriver(self):
         """
             Begins the web scraping process by first checking and scraping all links,
@@ -60,18 +393,153 @@ class ScrappingCoupon:
         """
         # First check all links and scrape them before starting
         self.alphabet_section()
-        urls = self.get_urls_from_file()
-        for url in urls:
+        urls = self.skip_quarantined(self.get_urls_from_file())
+        self.tier = self.choose_tier()
+        self.logger.info(f"Crawl tier: {self.tier}")
+        print(f"Crawl tier: {self.tier}")
+        run_id = self.db.start_run(self.tier)
+        self.seen_vouchers = set()
+        self.similar_lookups = self.similar_hits = 0
+        for shop_number, url in enumerate(urls, 1):
             # Configure logger for each URL
             self.setup_logger(url)
             self.logger.info(f"Starting scraping for URL: {url}")
 
-            self.webdriver.get(url)
-            self.webdriver.maximize_window()
-            self.scrape_all_shop_links()
+            shop_started = time.perf_counter()
+            self.shop_run = self.new_shop_run()
+            self.shop_coupons = 0
+            shop_run_id = self.db.start_shop_run(run_id, url)
+            self.performance_log = []
+            self.captured_request_ids = set()
+            self.tracer.start_trace(url, url=url)
+            blocked = None
+            self.visit_error = None
+            self.card_attempts = self.card_failures = 0
+            try:
+                with self.profiler.profile(url):
+                    self.throttle()
+                    with self.stage('page_load'):
+                        self.webdriver.get(url)
+                        self.webdriver.maximize_window()
+                    blocked = self.check_blocked()
+                    if blocked == 'rate_limited':
+                        # The whole site throttles, nothing of the shop was read and it is crawled again
+                        self.shop_run['failures'] += 1
+                    elif blocked:
+                        # A 5xx or a challenge of this page, its coupons are not swept and the circuit
+                        # breaker counts the failed visit, so a shop that is always refused is quarantined
+                        # instead of being crawled again and again
+                        self.visit_error = f"The site refused the page: {blocked}"
+                        self.shop_run['failures'] += 1
+                    else:
+                        self.scrape_all_shop_links()
+            except Exception as e:
+                # A broken shop doesn't stop the run, the circuit breaker counts the failed visit
+                self.visit_error = f"{type(e).__name__}: {e}".strip()
+                self.shop_run['failures'] += 1
+                self.logger.error(f"Error crawling {url}: {self.visit_error}")
+                print(f"Error crawling {url}: {self.visit_error}")
+                if self.chrome is not None and not BrowserPool.is_alive(self.chrome):
+                    try:
+                        self.recycle_webdriver()
+                    except Exception:
+                        self.chrome = None
+            finally:
+                trace_path = self.tracer.end_trace()
+                if trace_path:
+                    self.logger.info(f"Trace of the shop saved to {trace_path}")
+            SHOP_SECONDS.observe(time.perf_counter() - shop_started)
+            self.record_cache_hits()
+            self.db.finish_shop_run(shop_run_id, time.perf_counter() - shop_started, coupons_found=self.shop_coupons,
+                                    **self.shop_run)
 
             # Update the URL status to True after scraping
-            self.update_url_status(url, 'True')
+            if blocked != 'rate_limited':
+                # A light visit doesn't open the popups, it can't tell that a broken shop works again
+                if self.visit_error or self.tier != 'light':
+                    self.record_visit(url, self.shop_run['company_name'], self.visit_error)
+                self.update_url_status(url, 'True')
+
+            # A long lived Chrome grows in memory, it is replaced every BROWSER_RECYCLE_SHOPS shops
+            if self.BROWSER_RECYCLE_SHOPS and shop_number % self.BROWSER_RECYCLE_SHOPS == 0:
+                self.recycle_webdriver()
+
+        self.db.finish_run(run_id, self.similar_lookups, self.similar_hits)
+        if self.similar_lookups:
+            summary = (f"Similar vouchers skipped as already seen: {self.similar_hits} of {self.similar_lookups} "
+                       f"({self.similar_hits / self.similar_lookups:.0%})")
+            self.logger.info(summary)
+            print(summary)
+        self.send_quarantine_summary()
+
+    def skip_quarantined(self, urls):
+        """
+            Starts the circuit breaker events of a run and drops the quarantined shops from urls. They
+            are marked as crawled for this cycle and visited again as a probe once their quarantine ends.
+
+            Returns:
+                list: The urls to crawl.
+        """
+        self.quarantined_in_run = {}
+        self.recovered_in_run = []
+        quarantined = self.db.get_quarantined_shops()
+        skipped = [url for url in urls if url in quarantined]
+        for url in skipped:
+            self.update_url_status(url, 'True', notify=False)
+        if skipped:
+            SHOP_CIRCUIT_EVENTS.inc(len(skipped), event='skipped')
+            self.logger.info(f"Skipping {len(skipped)} quarantined shops")
+            print(f"Skipping {len(skipped)} quarantined shops")
+        return [url for url in urls if url not in quarantined]
+
+    def record_visit(self, url, company_name=None, error=None):
+        # Updates the circuit breaker of the shop, see Database.record_shop_visit
+        health = self.db.record_shop_visit(url, company_name, error, self.BREAKER_FAILURES, self.QUARANTINE_HOURS,
+                                           self.MAX_QUARANTINE_HOURS)
+        if health['opened']:
+            SHOP_CIRCUIT_EVENTS.inc(event='quarantined')
+            self.quarantined_in_run[url] = (error, health['next_probe_at'])
+        elif health['state'] == 'open':
+            SHOP_CIRCUIT_EVENTS.inc(event='probe_failed')
+        elif health['recovered']:
+            SHOP_CIRCUIT_EVENTS.inc(event='recovered')
+            self.recovered_in_run.append(url)
+        if health['state'] == 'open':
+            self.logger.warning(f"{url} is quarantined until {health['next_probe_at']} after "
+                                f"{health['consecutive_failures']} failed visits: {error}")
+        return health
+
+    def send_quarantine_summary(self):
+        # One alert for the shops quarantined or recovered in the run, instead of one per failed card
+        if not self.quarantined_in_run and not self.recovered_in_run:
+            return
+        lines = []
+        if self.quarantined_in_run:
+            lines.append(f"Quarantined {len(self.quarantined_in_run)} shops after {self.BREAKER_FAILURES} "
+                         f"failed visits:")
+            for url, (error, next_probe_at) in self.quarantined_in_run.items():
+                lines.append(f"{url}: {error} (next probe {next_probe_at})")
+        if self.recovered_in_run:
+            lines.append(f"Recovered {len(self.recovered_in_run)} shops: {', '.join(self.recovered_in_run)}")
+        message = '\n'.join(lines)
+        self.logger.warning(message)
+        print(message)
+        try:
+            self.send_telegram_message(self.BOT_TOKEN, self.CHAT_ID, message)
+        except Exception as e:
+            self.logger.error(f"Error sending the summary alert: {e}")
+
+    def choose_tier(self):
+        """
+            Returns the tier of the next run, CRAWL_TIER unless it is 'auto'. The auto tier reads the
+            listings of all shops on every run and opens the popups on a slower schedule, in a deep
+            run when the last one started more than DEEP_INTERVAL_HOURS ago.
+        """
+        if self.CRAWL_TIER != 'auto':
+            return self.CRAWL_TIER
+        last_deep_run = self.db.get_last_deep_run()
+        threshold = (datetime.now() - timedelta(hours=self.DEEP_INTERVAL_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+        return 'deep' if last_deep_run is None or last_deep_run < threshold else 'light'
 
     def setup_logger(self, url):
         """
@@ -120,10 +588,14 @@ class ScrappingCoupon:
             'chat_id': chat_id,
             'text': message
         }
-        response = requests.post(url, data=payload)
+        # requests is only imported when an alert is sent, like the browser modules
+        import requests
+        with self.stage('telegram'):
+            response = requests.post(url, data=payload)
         if response.status_code == 200:
             print('Message sent successfully!')
         else:
+            STAGE_FAILURES.inc(stage='telegram')
             print(f'Failed to send message: {response.status_code} {response.text}')
             new_chat_id = self.get_updates(bot_token)
             if new_chat_id:
@@ -143,6 +615,7 @@ class ScrappingCoupon:
             Returns:
             str: The latest chat_id if available, otherwise None.
         """
+        import requests
         url = f'https://api.telegram.org/bot{bot_token}/getUpdates'
         response = requests.get(url)
         if response.status_code == 200:
@@ -170,7 +643,8 @@ class ScrappingCoupon:
             of sections, then calls a method to save all coupon links based on the section count.
             Logs an error if the page takes too long to load.
         """
-        self.webdriver.get("https://www.cuponation.com.au/allshop")
+        self.throttle()
+        self.webdriver.get(f"{self.BASE_URL}/allshop")
         try:
             sections = WebDriverWait(self.webdriver, 10).until(
                 EC.presence_of_all_elements_located((
@@ -206,6 +680,7 @@ class ScrappingCoupon:
                     existing_urls[url] = {'text': text, 'status': status}
 
         # Find new links and write them to the file with status False if they are not already in the dictionary
+        new_shops = []
         with open(self.file_path, 'a') as file:
             count_hrefs = 0
             for i in range(1, number_of_sections + 1):
@@ -225,6 +700,10 @@ class ScrappingCoupon:
                     if href not in existing_urls:
                         file.write(f"{href}, {text}, False\n")
                         existing_urls[href] = {'text': text, 'status': 'False'}
+                        new_shops.append((href, text))
+
+        # Keep the shops table in sync with the links file
+        self.db.upsert_shops(new_shops)
 
         self.logger.info(f"Number of urls to scrape: {count_hrefs}")
         print(f"Number of urls to scrape: {count_hrefs}")
@@ -232,14 +711,14 @@ class ScrappingCoupon:
     def check_button_name(self, xpath, index):
         """
            Retrieves the text of a button from a specific element found using the given XPath
-           and index, and stores it in the 'detail_of_coupon' dictionary under the key 'Button Name'.
+           and index, and stores it in the button_name field of the current coupon.
            Returns the button text if found; otherwise, returns None.
         """
         try:
             button = self.webdriver.find_element(
                 By.XPATH, f"{xpath}[{index}]//div[@role='button']"
             )
-            self.detail_of_coupon['Button Name'] = button.text
+            self.coupon.button_name = button.text
 
             return button.text.strip()
         except:
@@ -249,43 +728,45 @@ class ScrappingCoupon:
         """
             Retrieves a voucher code and URL based on the provided button text. If the button text is 'SEE CODE',
             waits for the voucher code to appear, switches to the appropriate window, and stores the URL and code
-            in the 'detail_of_coupon' dictionary. If the button text is not 'SEE CODE', attempts to find the voucher
+            in the current coupon. If the button text is not 'SEE CODE', attempts to find the voucher
             code and URL similarly. Logs an error if the code or buttons are not found.
             """
         try:
-            if button_text == 'SEE CODE':
-                # Wait for up to 5 seconds for the codes to be present
-                codes = WebDriverWait(self.webdriver, 3).until(EC.presence_of_all_elements_located(
-                    (By.XPATH, "//span[@data-testid='voucherPopup-codeHolder-voucherType-code']/h4")
-                ))
-                code = [code.text for code in codes][0]
-
-                time.sleep(1)
-                self.webdriver.switch_to.window(self.webdriver.window_handles[0])
-                time.sleep(1)
-                self.detail_of_coupon['Url'] = self.webdriver.current_url
-                self.webdriver.close()
-
-                time.sleep(1)
-                self.webdriver.switch_to.window(self.webdriver.window_handles[0])
-                self.detail_of_coupon['Code'] = code
-            else:
-                try:
-                    codes = self.webdriver.find_elements(
-                        By.XPATH, "//span[@data-testid='voucherPopup-codeHolder-voucherType-code']/h4")
+            with self.stage('code_reveal'):
+                if button_text == 'SEE CODE':
+                    # Wait for up to 5 seconds for the codes to be present
+                    codes = WebDriverWait(self.webdriver, 3).until(EC.presence_of_all_elements_located(
+                        (By.XPATH, "//span[@data-testid='voucherPopup-codeHolder-voucherType-code']/h4")
+                    ))
                     code = [code.text for code in codes][0]
-                except:
-                    self.logger.error("We don't find any code!")
 
-                time.sleep(1)
-                self.webdriver.switch_to.window(self.webdriver.window_handles[0])
-                time.sleep(1)
-                self.detail_of_coupon['Url'] = self.webdriver.current_url
-                self.webdriver.close()
+                    time.sleep(1)
+                    self.webdriver.switch_to.window(self.webdriver.window_handles[0])
+                    time.sleep(1)
+                    self.coupon.url = self.webdriver.current_url
+                    self.webdriver.close()
 
-                time.sleep(1)
-                self.webdriver.switch_to.window(self.webdriver.window_handles[0])
-                self.detail_of_coupon['Code'] = code
+                    time.sleep(1)
+                    self.webdriver.switch_to.window(self.webdriver.window_handles[0])
+                    self.coupon.code = code
+                else:
+                    code = None
+                    try:
+                        codes = self.webdriver.find_elements(
+                            By.XPATH, "//span[@data-testid='voucherPopup-codeHolder-voucherType-code']/h4")
+                        code = [code.text for code in codes][0]
+                    except:
+                        self.logger.error("We don't find any code!")
+
+                    time.sleep(1)
+                    self.webdriver.switch_to.window(self.webdriver.window_handles[0])
+                    time.sleep(1)
+                    self.coupon.url = self.webdriver.current_url
+                    self.webdriver.close()
+
+                    time.sleep(1)
+                    self.webdriver.switch_to.window(self.webdriver.window_handles[0])
+                    self.coupon.code = code
         except:
             self.logger.error("We don't find buttons: see code & see deal!")
             print("We don't find buttons: see code & see deal!")
@@ -296,17 +777,17 @@ class ScrappingCoupon:
             Logs an error if the close button cannot be clicked.
         """
         try:
-            # Wait until the element is clickable
-            close_icon = WebDriverWait(self.webdriver, 3).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "span[data-testid='CloseIcon']"))
-            )
-            # Click the close icon
-            close_icon.click()
+            with self.stage('close_popup'):
+                # Wait until the element is clickable
+                close_icon = WebDriverWait(self.webdriver, 3).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, "span[data-testid='CloseIcon']"))
+                )
+                # Click the close icon
+                close_icon.click()
         except:
             self.logger.error("We can't click on close alert button!")
-            self.send_telegram_message(self.BOT_TOKEN, self.CHAT_ID, self.MESSAGE)
 
-    def update_url_status(self, url, status):
+    def update_url_status(self, url, status, notify=True):
         """
             Updates the status of a specific URL in the file. Reads all lines from the file, modifies
             the status for the specified URL, and writes the updated lines back to the file.
@@ -314,8 +795,10 @@ class ScrappingCoupon:
             Args:
                 url (str): The URL whose status needs to be updated.
                 status (str): The new status to set for the URL.
+                notify (bool): Sends the Telegram message of the status change.
         """
-        self.send_telegram_message(self.BOT_TOKEN, self.CHAT_ID, "U nderrua statusi i linkut kuponave!")
+        if notify:
+            self.send_telegram_message(self.BOT_TOKEN, self.CHAT_ID, "U nderrua statusi i linkut kuponave!")
 
         # Read all lines from the file
         with open(self.file_path, 'r') as file:
@@ -330,6 +813,8 @@ class ScrappingCoupon:
                 else:
                     file.write(line)
 
+        self.db.update_shop_status(url, status)
+
     def get_urls_from_file(self):
         """
             Retrieves URLs with a status of 'False' from the file.
@@ -374,15 +859,17 @@ class ScrappingCoupon:
             button is not found or cannot be clicked.
         """
         try:
-            # If we have to show more see more button then click on it
-            see_more_btn = WebDriverWait(self.webdriver, 3).until(
-                EC.element_to_be_clickable(
-                    (By.XPATH, f"//div[@class='r0c5x30']/div")
+            # Not finding the button is normal, it is not counted as a failure
+            with self.stage('see_more', count_failures=False):
+                # If we have to show more see more button then click on it
+                see_more_btn = WebDriverWait(self.webdriver, 3).until(
+                    EC.element_to_be_clickable(
+                        (By.XPATH, f"//div[@class='r0c5x30']/div")
+                    )
                 )
-            )
-            self.webdriver.execute_script("arguments[0].scrollIntoView(true);", see_more_btn)
-            time.sleep(1)
-            see_more_btn.click()
+                self.webdriver.execute_script("arguments[0].scrollIntoView(true);", see_more_btn)
+                time.sleep(1)
+                see_more_btn.click()
         except:
             self.logger.info("We don't have see more button!")
             print("We don't have see more button!")
@@ -390,31 +877,110 @@ class ScrappingCoupon:
     def get_company_name(self):
         current_url = self.webdriver.current_url
         print(f"\n\nCurrent url: {current_url}\n\n")
+        company_name = None
         with open(self.file_path, 'r') as file:
             for line in file:
                 parts = line.strip().split(',')
                 if len(parts) > 1 and parts[0] == current_url:
                     company_name = parts[1].strip()
-                    self.detail_of_coupon['Company Name'] = company_name
+                    self.coupon.company_name = company_name
                     break
 
         return company_name
 
-    def collect_vouchers(self, xpath):
+    def voucher_fingerprint(self, xpath, index):
+        try:
+            card = self.webdriver.find_element(By.XPATH, f"{xpath}[{index}]")
+            return self.webdriver.execute_script(VOUCHER_FINGERPRINT_SCRIPT, card)
+        except Exception:
+            return None
+
+    def refresh_listing(self, crawl_started_at):
+        """
+            Reads every card listed on the shop page in one script call and saves them in the
+            listing_cards table. The coupons of the cards that are still listed count as seen, so
+            the sweep of a deep visit keeps them without opening their popups.
+
+            Returns:
+                int: The number of listed cards, or None if the listing could not be read.
+        """
+        # The cards behind the 'See More' button are only in the page after a click
+        self.check_for_see_more_btn()
+        self.listing_expanded = True
+        try:
+            with self.stage('listing') as span_args:
+                cards = [card for card in self.webdriver.execute_script(LISTING_SCRIPT)
+                         if card['fingerprint'] and not card['banner'] and card['button'] != 'SUBSCRIBE']
+                self.listing, refreshed = self.db.refresh_listing_cards(self.shop_url, cards, crawl_started_at)
+                span_args['cards'] = len(cards)
+        except Exception as e:
+            self.logger.error(f"Error reading the listing: {e}")
+            print(f"Error reading the listing: {e}")
+            return None
+
+        stale_threshold = self.card_refresh_threshold()
+        states = {'new': 0, 'fresh': 0, 'stale': 0}
+        for deep_scraped_at in self.listing.values():
+            if deep_scraped_at is None:
+                states['new'] += 1
+            else:
+                states['fresh' if deep_scraped_at >= stale_threshold else 'stale'] += 1
+        for state, count in states.items():
+            LISTING_CARDS.inc(count, state=state)
+        self.logger.info(f"Listing: {len(cards)} cards, {states['new']} new or changed, {states['stale']} stale, "
+                         f"{refreshed} coupons refreshed")
+        print(f"Listing: {len(cards)} cards, {states['new']} new or changed, {states['stale']} stale")
+        return len(cards)
+
+    def card_refresh_threshold(self):
+        return (datetime.now() - timedelta(hours=self.CARD_REFRESH_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def is_fresh_card(self, fingerprint):
+        # The popup of the card was read within CARD_REFRESH_HOURS and the listing refreshed its coupon
+        deep_scraped_at = self.listing.get(fingerprint)
+        return deep_scraped_at is not None and deep_scraped_at >= self.card_refresh_threshold()
+
+    def seen_before(self, fingerprint):
+        """
+            Checks a similar voucher against the vouchers saved earlier in the run. The fingerprint is
+            added to the seen set by save_details_in_database, so a voucher that failed is tried again.
+        """
+        if not fingerprint:
+            return False
+        self.similar_lookups += 1
+        if fingerprint in self.seen_vouchers:
+            self.similar_hits += 1
+            SIMILAR_LOOKUPS.inc(result='hit')
+            return True
+        SIMILAR_LOOKUPS.inc(result='miss')
+        return False
+
+    def collect_vouchers(self, xpath, dedup=False):
         """
             Collects and processes voucher details from the specified XPath.
 
-            - Checks for and clicks a 'See More' button if present.
+            - Checks for and clicks a 'See More' button if present, unless `refresh_listing` already did for this widget.
             - Retrieves and logs information about each coupon, including title, description, offer, and any associated code or URL.
             - Handles elements within a modal or popup window and interacts with various parts of the page to extract relevant data.
-            - Saves collected voucher details in a database and clears the detail dictionary after processing.
+            - Fills one Coupon record per card and saves the whole batch in a single transaction at the end.
 
             Args:
                 xpath (str): The XPath expression used to locate coupon elements on the page.
+                dedup (bool): Skips the cards of vouchers that were already saved in this run, for the
+                    similar vouchers that show up on the pages of many shops.
+
+            In the deep tier the cards that didn't change since their popup was read are skipped. After
+            CARD_FAILURE_LIMIT cards in a row failed the rest of the shop is skipped, its layout changed.
         """
+        if self.visit_error:
+            return
 
-        # Check first if we have see more btn to upload all coupon buttons
-        self.check_for_see_more_btn()
+        # Check first if we have see more btn to upload all coupon buttons, unless the listing of the deep
+        # tier already clicked it, the wait for a button that is gone takes 3 seconds
+        if self.listing_expanded:
+            self.listing_expanded = False
+        else:
+            self.check_for_see_more_btn()
 
         div_elements = WebDriverWait(self.webdriver, 3).until(
             EC.presence_of_all_elements_located((By.XPATH, xpath))
@@ -428,170 +994,239 @@ class ScrappingCoupon:
         print(f"We are scrapping: {self.webdriver.current_url}")
         company_name = self.get_company_name()
         print(f"Company name: {company_name}")
+        failed_in_row = 0
         for i in range(1, len(div_elements) + 1):
-            self.logger.info(f"Coupon {i}:")
-            self.logger.info(f"Inside web element: {xpath}[{i}]")
-            print(f"\n\nCoupon {i}:")
-            print(f"Inside web element: {xpath}[{i}]")
-            button_text = self.check_button_name(xpath, i)
-
-            # Get the name of company for the coupons
-            self.get_company_name()
-
-            if button_text == "SUBSCRIBE":
-                continue
-
-            # call the function to click the see more btn to get info of coupon
-            self.check_for_see_more_btn()
+            if failed_in_row >= self.CARD_FAILURE_LIMIT:
+                self.visit_error = f"{failed_in_row} cards in a row failed"
+                self.logger.error(f"{self.visit_error}, skipping the rest of the shop")
+                print(f"{self.visit_error}, skipping the rest of the shop")
+                break
+            with self.tracer.span('card', index=i) as card_args:
+                self.logger.info(f"Coupon {i}:")
+                self.logger.info(f"Inside web element: {xpath}[{i}]")
+                print(f"\n\nCoupon {i}:")
+                print(f"Inside web element: {xpath}[{i}]")
+                # A new record for every card, the company is the same for all of them
+                self.coupon = Coupon(company_name=company_name)
+                button_text = self.check_button_name(xpath, i)
+                card_args['button'] = button_text
+
+                if button_text == "SUBSCRIBE":
+                    continue
 
-            try:
-                #
-                banner = WebDriverWait(self.webdriver, 3).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, f"{xpath}[{i}][@data-testid='kam-banner-main-1']")
-                    )
-                )
-                continue
-            except:
-                pass
+                self.coupon_fingerprint = None
+                self.card_fingerprint = fingerprint = self.voucher_fingerprint(xpath, i)
+                if dedup:
+                    card_args['repeat'] = self.seen_before(fingerprint)
+                    if card_args['repeat']:
+                        continue
+                    self.coupon_fingerprint = fingerprint
+                if self.tier == 'deep' and self.is_fresh_card(fingerprint):
+                    # Same card as in the last deep run, its coupon is still listed
+                    card_args['fresh'] = True
+                    self.shop_coupons += 1
+                    continue
 
-            try:
-                coupon_btn = WebDriverWait(self.webdriver, 3).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, f"{xpath}[{i}]")
-                    )
-                )
+                # call the function to click the see more btn to get info of coupon
+                self.check_for_see_more_btn()
 
-                # Scroll to the element
-                self.webdriver.execute_script("arguments[0].scrollIntoView(true);", coupon_btn)
-                time.sleep(1)
-                coupon_btn.click()
-            except:
-                self.logger.error("Coupon btn is not find!")
-                print("Coupon btn is not find!")
-                continue
+                try:
+                    #
+                    with self.tracer.span('wait banner', 'wait'):
+                        banner = WebDriverWait(self.webdriver, 3).until(
+                            EC.element_to_be_clickable(
+                                (By.XPATH, f"{xpath}[{i}][@data-testid='kam-banner-main-1']")
+                            )
+                        )
+                    continue
+                except:
+                    pass
 
-            try:
-                self.webdriver.switch_to.window(self.webdriver.window_handles[1])
-                title_element = WebDriverWait(self.webdriver, 3).until(
-                    EC.presence_of_element_located(
-                        (By.XPATH, "//div[@data-testid='voucherPopup-header-popupTitleWrapper']/h4"))
-                )
-                self.detail_of_coupon['Title'] = title_element.text
-            except:
-                self.logger.error("Error fetching title!")
-                self.send_telegram_message(self.BOT_TOKEN, self.CHAT_ID, self.MESSAGE)
-                print("Error fetching title!")
+                # The popup loads the shop page again in a new tab
+                self.throttle()
+                self.card_attempts += 1
+                try:
+                    with self.stage('card_click'):
+                        coupon_btn = WebDriverWait(self.webdriver, 3).until(
+                            EC.element_to_be_clickable(
+                                (By.XPATH, f"{xpath}[{i}]")
+                            )
+                        )
+
+                        # Scroll to the element
+                        self.webdriver.execute_script("arguments[0].scrollIntoView(true);", coupon_btn)
+                        time.sleep(1)
+                        coupon_btn.click()
+                except:
+                    self.logger.error("Coupon btn is not find!")
+                    print("Coupon btn is not find!")
+                    self.card_failures += 1
+                    failed_in_row += 1
+                    continue
 
-            try:
-                # Wait until the button is clickable
-                terms_button = WebDriverWait(self.webdriver, 3).until(
-                    EC.element_to_be_clickable(
-                        (By.XPATH, "//div[@data-testid='voucherPopup-collapsablePanel-header']/button"))
-                )
-                terms_button.click()
-            except:
-                self.logger.info("We don't have terms_button for this coupon!")
-                print("We don't have terms_button for this coupon!")
+                try:
+                    with self.stage('popup_title'):
+                        self.webdriver.switch_to.window(self.webdriver.window_handles[1])
+                        title_element = WebDriverWait(self.webdriver, 3).until(
+                            EC.presence_of_element_located(
+                                (By.XPATH, "//div[@data-testid='voucherPopup-header-popupTitleWrapper']/h4"))
+                        )
+                        self.coupon.title = title_element.text
+                    failed_in_row = 0
+                except:
+                    # No alert per card, the circuit breaker sends one for the shops that keep failing
+                    self.logger.error("Error fetching title!")
+                    print("Error fetching title!")
+                    self.card_failures += 1
+                    failed_in_row += 1
 
-            try:
-                all_paragraphs = WebDriverWait(self.webdriver, 3).until(EC.presence_of_all_elements_located(
-                    (By.XPATH,
-                     "//div[@data-testid='voucherPopup-termsAndConditions-root']//div[@data-testid='rich-text-root']/p")
-                ))
-
-                for p in all_paragraphs:
-                    p_text = p.text.strip()
-                    if not p_text:
-                        continue  # Skip empty <p> elements
-
-                    b_elements = p.find_elements(By.TAG_NAME, 'b')
-                    if b_elements:
-                        for b_element in b_elements:
-                            field_name = b_element.text.strip(':')
-                            field_value = p_text.replace(b_element.text, '').strip()
-                            # Remove colon from the value if present
-                            field_value = field_value.lstrip(':').strip()
-                            self.detail_of_coupon[field_name] = field_value
+                try:
+                    # Wait until the button is clickable
+                    terms_button = WebDriverWait(self.webdriver, 3).until(
+                        EC.element_to_be_clickable(
+                            (By.XPATH, "//div[@data-testid='voucherPopup-collapsablePanel-header']/button"))
+                    )
+                    terms_button.click()
+                except:
+                    self.logger.info("We don't have terms_button for this coupon!")
+                    print("We don't have terms_button for this coupon!")
 
-                    else:
-                        # Handle cases where <p> does not contain <b>
-                        if 'description' not in self.detail_of_coupon:
-                            self.detail_of_coupon['Description'] = p_text
-
-                # Interact with tabs windows and get code and url
-                self.get_code_or_url_from_voucher(button_text)  # <-- For getting the code or url of voucher
-
-                # Logs Details
-                self.logger.info(f"\n\nTitle: {self.detail_of_coupon.get('Title', None),}")
-                self.logger.info(f"Description: {self.detail_of_coupon.get('Description', None)}")
-                self.logger.info(f"Offer: {self.detail_of_coupon.get('Offer', None)}")
-                self.logger.info(f"Order amount: {self.detail_of_coupon.get('Order amount', None)}")
-                self.logger.info(f"Limitation for Users: {self.detail_of_coupon.get('Limitation for Users', None)}")
-                self.logger.info(f"Limitations on brands: {self.detail_of_coupon.get('Limitations on Brands', None)}")
-                self.logger.info(f"Button Name: {self.detail_of_coupon.get('Button Name', None)}")
-                self.logger.info(f"Code: {self.detail_of_coupon.get('Code', None)}")
-                self.logger.info(f"URL: {self.detail_of_coupon.get('Url', None)}")
-
-                print(f"\n\nTitle: {self.detail_of_coupon.get('Title', None),}")
-                print(f"Description: {self.detail_of_coupon.get('Description', None)}")
-                print(f"Offer: {self.detail_of_coupon.get('Offer', None)}")
-                print(f"Order amount: {self.detail_of_coupon.get('Order amount', None)}")
-                print(f"Limitation for Users: {self.detail_of_coupon.get('Limitation for Users', None)}")
-                print(f"Limitations on brands: {self.detail_of_coupon.get('Limitations on Brands', None)}")
-                print(f"Button Name: {self.detail_of_coupon.get('Button Name', None)}")
-                print(f"Code: {self.detail_of_coupon.get('Code', None)}")
-                print(f"URL: {self.detail_of_coupon.get('Url', None)}")
-                print(f"Company Name: {self.detail_of_coupon.get('Company Name', None)}")
-
-                # Close modal after fetching data
-                self.close_alert()
-
-                # Save the coupon in database
-                self.save_details_in_database()
+                try:
+                    with self.stage('terms'):
+                        terms_root = WebDriverWait(self.webdriver, 3).until(EC.presence_of_element_located(
+                            (By.XPATH, "//div[@data-testid='voucherPopup-termsAndConditions-root']")
+                        ))
+
+                        # One round trip for the whole block, the paragraphs are parsed locally
+                        terms = parse_terms_html(terms_root.get_attribute('innerHTML'))
+                        if not terms:
+                            raise TimeoutException("Terms without paragraphs")
+
+                    for field_name, field_value in terms:
+                        if field_name is None:
+                            # Handle cases where <p> does not contain <b>
+                            if self.coupon.description is None:
+                                self.coupon.description = field_value
+                        elif not self.coupon.set_label(field_name, field_value):
+                            self.logger.warning(f"Unknown label in terms: {field_name}")
+
+                    # Interact with tabs windows and get code and url
+                    self.get_code_or_url_from_voucher(button_text)  # <-- For getting the code or url of voucher
+
+                    # Logs Details
+                    self.log_coupon(self.coupon)
+
+                    # Close modal after fetching data
+                    self.close_alert()
+
+                    # Save the coupon in database
+                    self.save_details_in_database()
+                except:
+                    self.logger.error("Paragraphs does not exists!")
+                    print(f"Paragraphs does not exists!")
+                    # Interact with tabs windows and get code and url
+                    self.get_code_or_url_from_voucher(button_text)  # <-- For getting the code or url of voucher
 
-                # Clear the dictionary after processing
-                self.detail_of_coupon.clear()
-            except:
-                self.logger.error("Paragraphs does not exists!")
-                print(f"Paragraphs does not exists!")
-                # Interact with tabs windows and get code and url
-                self.get_code_or_url_from_voucher(button_text)  # <-- For getting the code or url of voucher
+                    # Close modal after fetching data
+                    self.close_alert()
 
-                # Close modal after fetching data
-                self.close_alert()
+                    # Save the coupon in database
+                    self.save_details_in_database()
 
-                # Save the coupon in database
-                self.save_details_in_database()
+        # Write the coupons of this widget in one transaction
+        self.flush_coupons()
 
-                # Clear the dictionary after processing
-                self.detail_of_coupon.clear()
+    def log_coupon(self, coupon):
+        """
+            Logs and prints every field of the given coupon, together with any label of the terms
+            that is not mapped to a field yet.
+        """
+        lines = [
+            f"Title: {coupon.title}",
+            f"Description: {coupon.description}",
+            f"Offer: {coupon.offer}",
+            f"Order amount: {coupon.order_ammount}",
+            f"Limitation for Users: {coupon.limitations_for_users}",
+            f"Limitations on brands: {coupon.limitations_on_brands}",
+            f"Button Name: {coupon.button_name}",
+            f"Code: {coupon.code}",
+            f"URL: {coupon.url}",
+            f"Company Name: {coupon.company_name}",
+        ]
+        if coupon.unknown_labels:
+            lines.append(f"Unknown labels: {coupon.unknown_labels}")
+
+        print()
+        for line in lines:
+            self.logger.info(line)
+            print(line)
+
+    def capture_vouchers(self, company_name):
+        """
+            Reads the vouchers of the shop from the JSON the page loaded: the __NEXT_DATA__ of the
+            document and the XHR and fetch responses of the performance log. Waits up to
+            CAPTURE_WAIT_SECONDS for a payload with vouchers.
 
-        # This function checks for last_scrapped column value.
-        self.db.update_last_scrapped_column(companyName)
+            Returns:
+                list: The coupons, empty when no payload had vouchers.
+        """
+        payloads = []
+        try:
+            next_data = self.webdriver.execute_script(
+                "var script = document.getElementById('__NEXT_DATA__'); return script && script.textContent;")
+            if next_data:
+                payloads.append(json.loads(next_data))
+        except Exception as e:
+            self.logger.info(f"No page data: {e}")
+
+        coupons = {}
+        deadline = time.monotonic() + self.CAPTURE_WAIT_SECONDS
+        while True:
+            payloads += [payload for _, payload in
+                         json_responses(self.webdriver, self.read_performance_log(), self.captured_request_ids)]
+            for payload in payloads:
+                for coupon in find_vouchers(payload, company_name):
+                    coupons.setdefault(coupon.key(), coupon)
+            payloads = []
+            if coupons or time.monotonic() >= deadline:
+                return list(coupons.values())
+            time.sleep(0.5)
 
     def save_details_in_database(self):
         """
-            Saves the collected coupon details to the database.
+            Queues the current coupon to be saved in the database.
 
-            This method retrieves the coupon details from the `detail_of_coupon` dictionary and inserts them into the database using the `insert_coupon` method of the `db` object. It includes fields such as title, description, offer, order amount, limitations for users, limitations on brands, button name, code, and URL.
-
-            Prints a message indicating that the coupon is being saved to the database.
+            The coupons of a page are written together by `flush_coupons`, in one transaction
+            instead of one commit per coupon.
         """
-
-        print(f"Saving coupon to database!")
-        self.db.insert_coupon(
-            title=self.detail_of_coupon.get('Title', None),
-            description=self.detail_of_coupon.get('Description', None),
-            offer=self.detail_of_coupon.get('Offer', None),
-            order_ammount=self.detail_of_coupon.get('Order amount', None),
-            limitations_for_users=self.detail_of_coupon.get('Limitation for Users', None),
-            limitations_on_brands=self.detail_of_coupon.get('Limitations on Brands', None),
-            button_name=self.detail_of_coupon.get('Button Name', None),
-            code=self.detail_of_coupon.get('Code', None),
-            url=self.detail_of_coupon.get('Url', None),
-            company_name=self.detail_of_coupon.get('Company Name', None),
-        )
+        self.pending_coupons.append(self.coupon)
+        if self.coupon_fingerprint:
+            self.seen_vouchers.add(self.coupon_fingerprint)
+        if self.card_fingerprint:
+            self.deep_cards.append((self.card_fingerprint, self.coupon.title, self.coupon.description))
+        self.shop_coupons += 1
+        COUPONS_FOUND.inc()
+
+    def flush_coupons(self):
+        """
+            Saves the queued coupons in the database with the `insert_coupons` method of the `db`
+            object and empties the queue.
+        """
+        if not self.pending_coupons:
+            return
+
+        print(f"Saving {len(self.pending_coupons)} coupons to database!")
+        with self.tracer.span('insert_coupons', 'db', coupons=len(self.pending_coupons)), \
+                measure(DB_WRITE_SECONDS, operation='insert_coupons'):
+            counts = self.db.insert_coupons(self.pending_coupons)
+        for status, count in counts.items():
+            DB_COUPONS_WRITTEN.inc(count, status=status)
+        self.shop_run['inserted'] += counts['inserted']
+        self.shop_run['updated'] += counts['updated']
+        self.logger.info(f"Saved coupons: {counts}")
+        self.pending_coupons = []
+        self.db.mark_cards_deep_scraped(self.shop_url, self.deep_cards, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self.deep_cards = []
 
     def scrape_all_shop_links(self):
         """
@@ -604,6 +1239,10 @@ class ScrappingCoupon:
 
             The helper functions `check_active_vouchers` and `check_similar_vouchers` use WebDriverWait to ensure the widgets are present before attempting to collect vouchers.
 
+            In the light tier only the listing of the cards is read (see `refresh_listing`) and the shop is
+            not swept, in the deep tier the listing is read first so `collect_vouchers` can skip the cards
+            that didn't change.
+
             The collected voucher details are processed by the `collect_vouchers` method.
         """
 
@@ -629,25 +1268,207 @@ class ScrappingCoupon:
             except:
                 return False
 
-        time.sleep(1)
-        if check_active_vouchers():
-            xpath = '//div[@data-testid="active-vouchers-widget"]/div'
-            self.collect_vouchers(xpath)
-
-        if check_similar_vouchers():
-            xpath = '//div[@data-testid="similar-vouchers-widget"]/div'
-            self.collect_vouchers(xpath)
+        # Coupons scraped from now on count as seen by this crawl
+        crawl_started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        company_name = self.get_company_name()
+        self.shop_coupons = 0
+        self.shop_run['company_name'] = company_name
+        self.shop_url = self.webdriver.current_url
+        self.listing = {}
+        self.listing_expanded = False
+        self.card_fingerprint = None
+        self.deep_cards = []
+
+        captured = []
+        if self.CAPTURE_MODE == 'network' and self.tier != 'light':
+            with self.stage('network_capture') as span_args:
+                captured = self.capture_vouchers(company_name)
+                span_args['coupons'] = len(captured)
+
+        if self.tier == 'light':
+            # Only the listing, the popups of its new and changed cards are opened by a deep run
+            SHOP_EXTRACTIONS.inc(method='listing')
+            time.sleep(1)
+            with self.tracer.span('wait active-vouchers-widget', 'wait') as span_args:
+                span_args['found'] = check_active_vouchers()
+            listed = self.refresh_listing(crawl_started_at)
+            if listed is None:
+                self.visit_error = "The listing could not be read"
+            else:
+                self.shop_coupons = listed
+        elif captured:
+            # No clicks on the cards, the payloads already have the popup details
+            SHOP_EXTRACTIONS.inc(method='network')
+            self.coupon_fingerprint = None
+            for coupon in captured:
+                self.coupon = coupon
+                self.log_coupon(coupon)
+                self.save_details_in_database()
+            self.flush_coupons()
+        else:
+            SHOP_EXTRACTIONS.inc(method='dom_fallback' if self.CAPTURE_MODE == 'network' else 'dom')
+            time.sleep(1)
+            with self.tracer.span('wait active-vouchers-widget', 'wait') as span_args:
+                span_args['found'] = has_active_vouchers = check_active_vouchers()
+            if self.tier == 'deep':
+                self.refresh_listing(crawl_started_at)
+            if has_active_vouchers:
+                xpath = '//div[@data-testid="active-vouchers-widget"]/div'
+                with self.tracer.span('collect_vouchers', widget='active-vouchers-widget'):
+                    self.collect_vouchers(xpath)
+
+            with self.tracer.span('wait similar-vouchers-widget', 'wait') as span_args:
+                span_args['found'] = has_similar_vouchers = check_similar_vouchers()
+            if has_similar_vouchers:
+                xpath = '//div[@data-testid="similar-vouchers-widget"]/div'
+                with self.tracer.span('collect_vouchers', widget='similar-vouchers-widget'):
+                    self.collect_vouchers(xpath, dedup=True)
+
+        if self.visit_error is None and self.card_attempts and self.card_failures == self.card_attempts:
+            self.visit_error = f"All {self.card_attempts} cards failed"
+
+        # Expire the coupons of this company that the crawl didn't see, once per shop visit. A failed
+        # visit didn't see the coupons that are still listed, they are kept until a visit that works.
+        # A light visit only refreshes the coupons linked to a listing card, the coupons saved from the
+        # network payloads or before the listing existed have no card, so only full and deep visits sweep
+        if company_name and not self.visit_error and self.tier != 'light':
+            with self.tracer.span('sweep', 'db'), measure(DB_WRITE_SECONDS, operation='sweep'):
+                self.shop_run['removed'] = self.db.update_last_scrapped_column(company_name, crawl_started_at)
+
+        SHOP_COUPONS.observe(self.shop_coupons)
+        SHOPS_CRAWLED.inc()
+        LAST_SHOP_FINISHED.set(time.time())
 
     def close_webdriver(self):
-        self.webdriver.quit()
+        self.recycle_webdriver()
+        if self.browser_pool is not None:
+            self.browser_pool.close()
+            self.browser_pool = None
 
 
-if __name__ == '__main__':
+def crawl(args):
     scrapping_coupon = ScrappingCoupon()
+    scrapping_coupon.CRAWL_TIER = args.tier
+    if args.engine == 'async':
+        # Imported here, it needs the optional Playwright package
+        from async_engine import AsyncShopCrawler
+        crawler = AsyncShopCrawler(scrapping_coupon, args.concurrency)
+        if args.tier != 'full':
+            print("The async engine always opens every card, --tier is ignored.")
+    # Metrics for Prometheus, on a /metrics endpoint or in a textfile read by node_exporter
+    if os.getenv('METRICS_PORT'):
+        start_http_server(int(os.getenv('METRICS_PORT')), os.getenv('METRICS_HOST', '127.0.0.1'))
+    if os.getenv('METRICS_TEXTFILE'):
+        start_textfile_writer(os.getenv('METRICS_TEXTFILE'))
+    # kill -USR1 <pid> profiles the next shop without restarting the loop
+    scrapping_coupon.profiler.install_signal_handler()
+    # Expired coupons are removed in the background instead of during the crawl
+    start_purge_thread(scrapping_coupon.db.db_name, retention_hours=scrapping_coupon.PURGE_HOURS)
     while True:
         links = scrapping_coupon.read_links()
         all_true = all(status == 'True' for _, _, status in links)
         if all_true:
             urls = [scrapping_coupon.update_url_status(item[0], False) for item in links]
             print("All links now have the status False!")
-        scrapping_coupon.start_webdriver()
+        if args.engine == 'async':
+            scrapping_coupon.alphabet_section()
+            scrapping_coupon.close_webdriver()
+            crawler.crawl(scrapping_coupon.get_urls_from_file())
+        else:
+            scrapping_coupon.start_webdriver()
+        if args.once:
+            scrapping_coupon.close_webdriver()
+            return
+
+
+def discover(args):
+    # Refreshes the shop links file and the shops table from the allshop page
+    scrapping_coupon = ScrappingCoupon()
+    try:
+        scrapping_coupon.alphabet_section()
+    finally:
+        scrapping_coupon.close_webdriver()
+
+
+def sweep(args):
+    database = Database(args.db, purge_hours=ScrappingCoupon.PURGE_HOURS)
+    database.create_table()
+    print(f"Purged expired coupons: {database.purge_deleted_coupons()}")
+    print(f"Compacted changes: {database.compact_change_log()}")
+
+
+def export(args):
+    import csv
+    import json
+
+    database = Database(args.db)
+    database.create_table()
+    columns, rows = database.get_live_coupons(args.shop)
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        else:
+            # One JSON object per line, the export is written while the rows are read
+            for row in rows:
+                output.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+    finally:
+        database.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+def stats(args):
+    database = Database(args.db)
+    database.create_table()
+    for name, value in database.get_stats().items():
+        print(f"{name}: {value}")
+    if ScrappingCoupon.RATE_LIMIT_RPS and os.path.exists(ScrappingCoupon.RATE_LIMIT_DB):
+        for bucket in RateLimiter(ScrappingCoupon.RATE_LIMIT_DB).get_state():
+            backoff = max(bucket['backoff_until'] - time.time(), 0)
+            print(f"rate limit {bucket['domain']}: {bucket['rate']:.2f} requests/s, backoff {backoff:.0f} s, "
+                  f"blocks in a row {bucket['blocks']}")
+    if os.path.exists(ScrappingCoupon.file_path):
+        with open(ScrappingCoupon.file_path) as file:
+            statuses = [line.strip().rsplit(', ', 1)[-1] for line in file if line.strip()]
+        print(f"links: {len(statuses)}, left in this crawl: {statuses.count('False')}")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scrapes the coupons of cuponation.com.au and manages them.')
+    parser.add_argument('--db', default=ScrappingCoupon.db_name, help='Database file of the coupons')
+    subparsers = parser.add_subparsers(dest='command')
+    crawl_parser = subparsers.add_parser('crawl', help='Crawl the shops of the links file, the default')
+    crawl_parser.add_argument('--once', action='store_true', help='Stop after one pass over the links')
+    crawl_parser.add_argument('--engine', choices=['selenium', 'async'], default='selenium',
+                              help='async crawls several shops at once in one browser, see async_engine.py')
+    crawl_parser.add_argument('--concurrency', type=int, default=4, help='Shops at once of the async engine')
+    crawl_parser.add_argument('--tier', choices=['full', 'deep', 'light', 'auto'],
+                              default=ScrappingCoupon.CRAWL_TIER,
+                              help='light only reads the listings, deep opens the new and changed cards, auto '
+                                   'runs light passes and a deep one every DEEP_INTERVAL_HOURS')
+    subparsers.add_parser('discover', help='Refresh the shop links from the allshop page')
+    subparsers.add_parser('sweep', help='Purge expired coupons and compact the change log')
+    export_parser = subparsers.add_parser('export', help='Export the live coupons')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    export_parser.add_argument('--output', help='File to write, stdout by default')
+    export_parser.add_argument('--shop', help='Only the coupons of this company name')
+    subparsers.add_parser('stats', help='Show counts of the coupons, shops and last run')
+    args = parser.parse_args(argv)
+
+    ScrappingCoupon.db_name = args.db
+    if args.command is None:
+        # Running the script without a command keeps crawling like before
+        args.command, args.once, args.engine, args.tier = 'crawl', False, 'selenium', ScrappingCoupon.CRAWL_TIER
+    commands = {'crawl': crawl, 'discover': discover, 'sweep': sweep, 'export': export, 'stats': stats}
+    commands[args.command](args)
+
+
+if __name__ == '__main__':
+    # async_engine imports cuponation, it has to get this module and not a second copy with its own metrics
+    sys.modules['cuponation'] = sys.modules[__name__]
+    main()
@@ -0,0 +1,222 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a DB write of a few coupons to a page that takes minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, label_names=(), registry=None):
+        """
+            Base of the metrics, the values are kept per combination of label values.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def label_values(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            lines += self.render_samples()
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.label_values(labels), 0)
+
+    def render_samples(self):
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels):
+        return self.values.get(self.label_values(labels), 0)
+
+    def render_samples(self):
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, label_names, registry)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def get_count(self, **labels):
+        state = self.values.get(self.label_values(labels))
+        return state['count'] if state else 0
+
+    def render_samples(self):
+        lines = []
+        for key, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['buckets']):
+                # Buckets are cumulative in the exposition format
+                cumulative += count
+                labels = format_labels(self.label_names, key, [('le', format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """
+            Returns:
+                str: All metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def measure(histogram, failures=None, **labels):
+    """
+        Observes the time of the block in the histogram. When the block raises, the failures counter is
+        increased with the same labels and the exception goes on to the caller.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if failures is not None:
+            failures.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+def start_http_server(port=9108, host='127.0.0.1', registry=REGISTRY):
+    """
+        Serves the metrics on http://host:port/metrics from a daemon thread.
+    """
+    # http.server is imported here, it adds to the startup of every command that imports the metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_textfile(path, registry=REGISTRY):
+    # node_exporter may read the file at any moment, it is replaced in one rename
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+        file.write(registry.render())
+    # Temporary files are only readable by their owner, node_exporter usually runs as another user
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+def start_textfile_writer(path, interval_seconds=15, registry=REGISTRY):
+    """
+        Rewrites the metrics to a .prom file for the textfile collector of node_exporter, every
+        interval_seconds from a daemon thread.
+    """
+    def run():
+        while True:
+            try:
+                write_textfile(path, registry)
+            except OSError as e:
+                print(f"Error writing the metrics textfile: {e}")
+            time.sleep(interval_seconds)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
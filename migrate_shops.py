@@ -0,0 +1,39 @@
+import argparse
+import os
+
+from ManageDB import Database
+
+
+def migrate(links_file, coupons_db, details_db):
+    """
+        Moves the shop metadata into the shops table of the coupons database.
+
+        - Creates the shops table and the coupons.shop_id column if they don't exist.
+        - Imports the shop URLs, names and crawl state from the links file.
+        - Copies icons and about texts from the extra features database.
+        - Links every coupon to its shop by company name.
+
+        The migration can run again at any time, it only updates what has changed.
+    """
+    db = Database(coupons_db)
+    db.create_table()
+
+    imported = db.import_shop_links(links_file)
+    print(f"Shops imported from {links_file}: {imported}")
+
+    if details_db and os.path.exists(details_db):
+        detailed = db.import_shop_details(details_db)
+        print(f"Shops updated with details from {details_db}: {detailed}")
+
+    linked = db.link_coupons_to_shops()
+    print(f"Coupons linked to their shop: {linked}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate shop metadata into the shops table.')
+    parser.add_argument('--links', default='all_shop_links.txt', help='File with "url, name, status" lines')
+    parser.add_argument('--coupons-db', default='coupons.db', help='Database with the coupons table')
+    parser.add_argument('--details-db', default='CouponExtraFeatures/coupons_detail.db',
+                        help='Database with the coupons_details table, pass an empty value to skip it')
+    args = parser.parse_args()
+    migrate(args.links, args.coupons_db, args.details_db)
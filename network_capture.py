@@ -0,0 +1,127 @@
+import base64
+import json
+import re
+from collections import deque
+
+from coupon_model import Coupon
+from terms_parser import RICH_TEXT_TEST_ID, parse_terms_html
+
+# Keys of the JSON payloads that hold each Coupon field, compared without case, '_' and '-'
+FIELD_KEYS = {
+    'title': ('title', 'headline', 'vouchertitle'),
+    'description': ('description', 'terms', 'termsandconditions', 'conditions', 'details'),
+    'offer': ('offer', 'discount', 'discountvalue', 'savings', 'discounttext'),
+    'order_ammount': ('minimumordervalue', 'minordervalue', 'minimumorder', 'minimumspend', 'orderamount'),
+    'limitations_for_users': ('userlimitations', 'limitationsforusers', 'customerrestrictions'),
+    'limitations_on_brands': ('brandlimitations', 'limitationsonbrands', 'excludedbrands'),
+    'button_name': ('buttontext', 'ctatext', 'cta'),
+    'code': ('code', 'vouchercode', 'couponcode', 'promocode'),
+    'url': ('clickouturl', 'affiliateurl', 'outurl', 'deeplink', 'url', 'link'),
+}
+KEY_TO_FIELD = {key: field for field, keys in FIELD_KEYS.items() for key in keys}
+# Keys that only vouchers have, the shop teasers of the same payloads also have a title, a link and a discount.
+# A plain id is not one of them, the shops of the payloads have ids too
+VOUCHER_KEYS = ('voucherid', 'couponid', 'offerid', 'type', 'vouchertype', 'terms', 'termsandconditions')
+# A dict is taken as a voucher when it has a title, a code or an offer, a code or one of VOUCHER_KEYS, and
+# this many fields besides the title and the url
+MIN_VOUCHER_FIELDS = 2
+
+
+def normalize_key(key):
+    return re.sub(r'[_\-\s]', '', key).lower()
+
+
+def json_responses(browser, performance_log, seen_request_ids):
+    """
+        Reads the bodies of the JSON responses (XHR, fetch or a JSON document) found in Chrome's
+        performance log. Request ids in seen_request_ids are skipped and the new ones are added.
+
+        Returns:
+            list: (url, payload) tuples.
+    """
+    responses = {}
+    finished = set()
+    for entry in performance_log:
+        message = json.loads(entry['message'])['message']
+        params = message.get('params', {})
+        if message['method'] == 'Network.responseReceived':
+            response = params['response']
+            if 'json' in response.get('mimeType', '') or params.get('type') in ('XHR', 'Fetch'):
+                responses[params['requestId']] = response.get('url')
+        elif message['method'] == 'Network.loadingFinished':
+            finished.add(params['requestId'])
+
+    payloads = []
+    # The body can only be read once the response finished loading
+    for request_id, url in responses.items():
+        if request_id in seen_request_ids or request_id not in finished:
+            continue
+        seen_request_ids.add(request_id)
+        try:
+            result = browser.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+        except Exception:
+            # Chrome drops the bodies of old or redirected requests
+            continue
+        body = base64.b64decode(result['body']).decode('utf-8', 'replace') if result.get('base64Encoded') \
+            else result['body']
+        try:
+            payloads.append((url, json.loads(body)))
+        except ValueError:
+            continue
+    return payloads
+
+
+def coupon_from_dict(values, company_name=None):
+    fields = {}
+    voucher_key = False
+    for key, value in values.items():
+        voucher_key = voucher_key or normalize_key(key) in VOUCHER_KEYS
+        field = KEY_TO_FIELD.get(normalize_key(key))
+        if field is None or field in fields or value in (None, '') or not isinstance(value, (str, int, float)):
+            continue
+        fields[field] = str(value).strip()
+    if 'title' not in fields or not {'code', 'offer'} & fields.keys() or not ('code' in fields or voucher_key):
+        return None
+    if len(fields.keys() - {'title', 'url'}) < MIN_VOUCHER_FIELDS:
+        return None
+
+    coupon = Coupon(company_name=company_name)
+    description = fields.pop('description', None)
+    for field, value in fields.items():
+        setattr(coupon, field, value)
+    if description and '<' in description:
+        # Terms sent as HTML have the same labelled paragraphs as the rich text of the popup
+        for label, value in parse_terms_html(f'<div data-testid="{RICH_TEXT_TEST_ID}">{description}</div>'):
+            if label is None:
+                if coupon.description is None:
+                    coupon.description = value
+            else:
+                coupon.set_label(label, value)
+    else:
+        coupon.description = description
+    if coupon.button_name is None:
+        # The same button texts as the cards of the page
+        coupon.button_name = 'SEE CODE' if coupon.code else 'SEE DEAL'
+    return coupon
+
+
+def find_vouchers(payload, company_name=None):
+    """
+        Walks a JSON payload and maps every dict that looks like a voucher to a Coupon.
+
+        Returns:
+            list: The coupons, without duplicates of the same title and description.
+    """
+    coupons = {}
+    # Breadth first, so the coupons keep the order of the lists of the payload
+    queue = deque([payload])
+    while queue:
+        value = queue.popleft()
+        if isinstance(value, dict):
+            coupon = coupon_from_dict(value, company_name)
+            if coupon is not None:
+                coupons.setdefault(coupon.key(), coupon)
+            queue.extend(value.values())
+        elif isinstance(value, list):
+            queue.extend(value)
+    return list(coupons.values())
@@ -0,0 +1,86 @@
+import re
+
+# Currency written before an amount, cuponation.com.au prices are in Australian dollars by default
+CURRENCY_SYMBOLS = {
+    '$': 'AUD',
+    'A$': 'AUD',
+    'AU$': 'AUD',
+    'AUD': 'AUD',
+    'US$': 'USD',
+    'USD': 'USD',
+    'NZ$': 'NZD',
+    'NZD': 'NZD',
+    '€': 'EUR',
+    'EUR': 'EUR',
+    '£': 'GBP',
+    'GBP': 'GBP',
+}
+
+PERCENT_PATTERN = re.compile(r'(\d{1,3}(?:\.\d+)?)\s*%')
+MONEY_PATTERN = re.compile(
+    r'(?P<currency>AU\$|A\$|US\$|NZ\$|AUD|USD|NZD|EUR|GBP|\$|€|£)\s?(?P<amount>\d{1,3}(?:,\d{3})+|\d+)(?:\.(?P<cents>\d{1,2}))?',
+    re.IGNORECASE
+)
+AMOUNT_OFF_PATTERN = re.compile(MONEY_PATTERN.pattern + r'\s*(?:off|discount|saving|back)', re.IGNORECASE)
+MIN_SPEND_PATTERN = re.compile(
+    r'(?:min(?:imum)?\.?\s*(?:spend|order|purchase)(?:\s*(?:of|is))?|orders?\s*(?:over|above|of)|spend(?:\s*over)?)'
+    r'\s*:?\s*' + MONEY_PATTERN.pattern,
+    re.IGNORECASE
+)
+FREE_SHIPPING_PATTERN = re.compile(r'free\s+(?:standard\s+|express\s+)?(?:shipping|delivery|postage)', re.IGNORECASE)
+
+
+def to_amount(match):
+    amount = float(match.group('amount').replace(',', ''))
+    if match.group('cents'):
+        amount += float(f"0.{match.group('cents')}")
+    return amount, CURRENCY_SYMBOLS.get(match.group('currency').upper(), 'AUD')
+
+
+def parse_offer(offer=None, order_ammount=None, title=None, description=None):
+    """
+        Turns the free text of a coupon into typed discount values.
+
+        The offer field is trusted first, the title and description are only used when the offer
+        doesn't say anything. The minimum spend comes from the order amount field or phrases like
+        "orders over $50".
+
+        Returns:
+            dict: discount_percent, discount_amount, currency, min_spend and free_shipping (0 or 1).
+    """
+    parsed = {'discount_percent': None, 'discount_amount': None, 'currency': None, 'min_spend': None,
+              'free_shipping': 0}
+    sources = [text for text in (offer, title, description) if text]
+
+    for text in sources:
+        percents = [float(value) for value in PERCENT_PATTERN.findall(text) if 0 < float(value) <= 100]
+        if percents:
+            parsed['discount_percent'] = max(percents)
+            break
+
+    for text in sources:
+        match = AMOUNT_OFF_PATTERN.search(text)
+        if match is None and text is offer and not PERCENT_PATTERN.search(text):
+            # An offer like "$10" without "off" is still the discount itself
+            match = MONEY_PATTERN.search(text)
+        if match:
+            parsed['discount_amount'], parsed['currency'] = to_amount(match)
+            break
+
+    if order_ammount:
+        match = MONEY_PATTERN.search(order_ammount)
+        if match:
+            parsed['min_spend'], currency = to_amount(match)
+            parsed['currency'] = parsed['currency'] or currency
+    if parsed['min_spend'] is None:
+        for text in sources:
+            match = MIN_SPEND_PATTERN.search(text)
+            if match:
+                parsed['min_spend'], currency = to_amount(match)
+                parsed['currency'] = parsed['currency'] or currency
+                break
+
+    if any(FREE_SHIPPING_PATTERN.search(text) for text in sources):
+        parsed['free_shipping'] = 1
+
+    return parsed
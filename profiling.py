@@ -0,0 +1,127 @@
+import io
+import os
+import re
+import signal
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class ShopProfiler:
+    # Touching this file in the profile directory profiles the next shop, like SIGUSR1
+    TRIGGER_FILE = 'profile_next'
+
+    def __init__(self, directory='Profiling', shops=(), every=0, memory=False, max_profiles=50, top=40):
+        """
+            Attaches cProfile and tracemalloc to selected shops of the crawl loop.
+
+            A shop is profiled when its URL contains one of shops, when it is every n-th shop, or on request
+            while the loop runs: SIGUSR1 or a profile_next file in the directory profile the next shop.
+            Every profiled shop leaves a .prof file (for pstats or snakeviz) and a .txt summary, with the
+            memory allocations the shop left behind and their growth since the previous profiled shop when
+            memory is on. tracemalloc only runs during a profiled shop, it slows down every allocation.
+
+            Args:
+                max_profiles (int): Profiles of the oldest shops above this number are removed.
+                top (int): Number of functions and allocation sites in the summaries.
+        """
+        self.directory = directory
+        self.shops = [shop for shop in shops if shop]
+        self.every = every
+        self.memory = memory
+        self.max_profiles = max_profiles
+        self.top = top
+        self.shop_count = 0
+        self.requested = threading.Event()
+        self.previous_snapshot = None
+
+    def install_signal_handler(self):
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.requested.set())
+
+    def should_profile(self, url):
+        self.shop_count += 1
+        trigger = os.path.join(self.directory, self.TRIGGER_FILE)
+        if os.path.exists(trigger):
+            os.remove(trigger)
+            self.requested.set()
+        if self.requested.is_set():
+            self.requested.clear()
+            return True
+        if self.every and self.shop_count % self.every == 0:
+            return True
+        return any(shop in url for shop in self.shops)
+
+    @contextmanager
+    def profile(self, url):
+        """
+            Profiles the block when the shop is selected, does nothing otherwise.
+        """
+        if not self.should_profile(url):
+            yield None
+            return
+
+        # The profilers are only imported for a profiled shop, they slow down the startup of every command
+        import cProfile
+        import tracemalloc
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            try:
+                self.save(url, profiler)
+            except OSError as e:
+                print(f"Error saving the profile of {url}: {e}")
+            finally:
+                # Only the snapshot is kept for the growth of the next profiled shop, tracing stops
+                if started_tracing:
+                    tracemalloc.stop()
+
+    def save(self, url, profiler):
+        import pstats
+        import tracemalloc
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = re.sub(r'[^\w.-]+', '_', url)[:80]
+        base = os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{safe_name}")
+        profiler.dump_stats(f"{base}.prof")
+
+        summary = io.StringIO()
+        summary.write(f"Profile of {url}, shop {self.shop_count} of this run\n\n")
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        stats.sort_stats('tottime').print_stats(self.top)
+
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ])
+            current, peak = tracemalloc.get_traced_memory()
+            summary.write(f"\nTraced memory: {current / 1024 / 1024:.1f} MB, peak {peak / 1024 / 1024:.1f} MB\n")
+            summary.write("\nLargest allocation sites:\n")
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                summary.write(f"{stat}\n")
+            if self.previous_snapshot is not None:
+                # Growth since the previous profiled shop, what keeps growing over days of uptime shows here
+                summary.write("\nGrowth since the previous profiled shop:\n")
+                for stat in snapshot.compare_to(self.previous_snapshot, 'lineno')[:self.top]:
+                    summary.write(f"{stat}\n")
+            self.previous_snapshot = snapshot
+
+        with open(f"{base}.txt", 'w') as file:
+            file.write(summary.getvalue())
+        self.remove_old_profiles()
+        print(f"Profile of {url} saved to {base}.prof")
+
+    def remove_old_profiles(self):
+        profiles = sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                           if name.endswith('.prof')), key=os.path.getmtime)
+        for path in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            for extension in ('.prof', '.txt'):
+                if os.path.exists(path[:-len('.prof')] + extension):
+                    os.remove(path[:-len('.prof')] + extension)
@@ -0,0 +1,216 @@
+import json
+import sqlite3
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+RATE_LIMIT_RATE = Gauge('cuponation_rate_limit_requests_per_second', 'Current request rate allowed per domain',
+                        ['domain'])
+RATE_LIMIT_WAIT_SECONDS = Histogram('cuponation_rate_limit_wait_seconds',
+                                    'Time a request waited for a token of the rate limiter')
+RATE_LIMIT_BACKOFFS = Counter('cuponation_rate_limit_backoffs_total',
+                              'Backoffs of the rate limiter by reason: rate_limited, server_error or captcha',
+                              ['reason'])
+
+# True when the page is the challenge of a bot protection instead of the shop: the title or the challenge
+# form of the protection, or a captcha that is almost all of the page. A captcha in the newsletter or contact
+# form of a shop page that loaded is not a challenge
+CAPTCHA_SCRIPT = '''
+var title = /just a moment|attention required|access denied|are you a robot|security check/i;
+if (title.test(document.title)) {
+    return true;
+}
+if (document.querySelector('#challenge-form, #cf-challenge-running, #px-captcha, form[action*="challenge"]')) {
+    return true;
+}
+var captcha = document.querySelector('iframe[src*="captcha"], iframe[src*="challenges.cloudflare.com"], '
+    + '.g-recaptcha, .h-captcha');
+var text = document.body ? document.body.innerText.trim() : '';
+return captcha !== null && text.length < 500;
+'''
+
+
+def document_status(performance_log):
+    # HTTP status of the last page loaded in the tab, from Chrome's performance log
+    status = None
+    for entry in performance_log:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.responseReceived' and message['params'].get('type') == 'Document':
+            status = message['params']['response'].get('status')
+    return status
+
+
+def block_reason(status=None, captcha=False):
+    """
+        Returns:
+            str: Why the site refused the page, rate_limited, server_error or captcha, None when it didn't.
+    """
+    if status == 429:
+        return 'rate_limited'
+    if status is not None and status >= 500:
+        return 'server_error'
+    if captcha:
+        return 'captcha'
+    return None
+
+
+class RateLimiter:
+    def __init__(self, db_name='rate_limit.db', rate=1.0, max_rate=4.0, min_rate=0.05, burst=3, increase=0.05,
+                 backoff_seconds=30, max_backoff_seconds=1800):
+        """
+            Token bucket per domain shared by every worker and process that uses the same SQLite file,
+            the bucket is read and updated in one write transaction per request.
+
+            The rate adapts like TCP congestion control: every page that loads adds increase requests
+            per second up to max_rate, a 429, a 5xx or a captcha halves it down to min_rate and stops
+            all requests to the domain for backoff_seconds, doubled for every block in a row.
+
+            Args:
+                rate (float): Requests per second of a new domain.
+                burst (float): Requests that can go at once after an idle time.
+        """
+        self.db_name = db_name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase = increase
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.conn = None
+        self.cursor = None
+        self.lock = threading.Lock()
+        self.table_created = False
+
+    def connect(self):
+        # Autocommit mode, BEGIN IMMEDIATE locks the bucket so two processes can't take the same tokens
+        self.conn = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)
+        self.cursor = self.conn.cursor()
+        if not self.table_created:
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    domain TEXT PRIMARY KEY,
+                    rate REAL,  -- Requests per second
+                    tokens REAL,  -- Negative when requests are waiting for their turn
+                    updated_at REAL,  -- Unix time of the last refill
+                    backoff_until REAL DEFAULT 0,  -- No request starts before this Unix time
+                    blocks INTEGER DEFAULT 0  -- Blocks in a row since the last page that loaded
+                )
+            ''')
+            self.table_created = True
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+
+    def load_bucket(self, domain):
+        # Must run inside a transaction, returns the row of the domain and creates it on first use
+        row = self.cursor.execute(
+            "SELECT rate, tokens, updated_at, backoff_until, blocks FROM rate_limits WHERE domain = ?",
+            (domain,)).fetchone()
+        if row is None:
+            row = (self.rate, self.burst, time.time(), 0.0, 0)
+            self.cursor.execute('''
+                INSERT INTO rate_limits (domain, rate, tokens, updated_at, backoff_until, blocks)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (domain, *row))
+        return row
+
+    def reserve(self, domain):
+        """
+            Takes a token of the domain, waiting tokens can go below zero so every caller gets its own turn.
+
+            Returns:
+                float: Seconds to wait before the request.
+        """
+        with self.lock:
+            self.connect()
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE")
+                rate, tokens, updated_at, backoff_until, _ = self.load_bucket(domain)
+                now = time.time()
+                # The bucket doesn't refill during a backoff, the requests after it are spaced at the new rate
+                start = max(now, backoff_until)
+                tokens = min(self.burst, tokens + max(start - updated_at, 0) * rate) - 1
+                wait = start - now + max(-tokens / rate, 0.0)
+                self.cursor.execute("UPDATE rate_limits SET tokens = ?, updated_at = ? WHERE domain = ?",
+                                    (tokens, start, domain))
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.close()
+        RATE_LIMIT_RATE.set(rate, domain=domain)
+        RATE_LIMIT_WAIT_SECONDS.observe(wait)
+        return wait
+
+    def acquire(self, domain):
+        # Blocks until the request can go
+        wait = self.reserve(domain)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_success(self, domain):
+        # Additive increase, the page loaded
+        with self.lock:
+            self.connect()
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE")
+                rate = min(self.max_rate, self.load_bucket(domain)[0] + self.increase)
+                self.cursor.execute("UPDATE rate_limits SET rate = ?, blocks = 0 WHERE domain = ?", (rate, domain))
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.close()
+        RATE_LIMIT_RATE.set(rate, domain=domain)
+        return rate
+
+    def record_block(self, domain, reason):
+        """
+            Multiplicative decrease and an exponential backoff after the site refused a page.
+
+            Returns:
+                tuple: The new rate and the seconds of the backoff.
+        """
+        with self.lock:
+            self.connect()
+            try:
+                self.cursor.execute("BEGIN IMMEDIATE")
+                rate, _, _, backoff_until, blocks = self.load_bucket(domain)
+                now = time.time()
+                if backoff_until > now:
+                    # Requests that were already on their way when the first block came, not a new block
+                    backoff = backoff_until - now
+                else:
+                    blocks += 1
+                    rate = max(self.min_rate, rate / 2)
+                    backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (blocks - 1))
+                    self.cursor.execute('''
+                        UPDATE rate_limits SET rate = ?, tokens = 0, updated_at = ?, backoff_until = ?, blocks = ?
+                        WHERE domain = ?
+                    ''', (rate, now + backoff, now + backoff, blocks, domain))
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                self.close()
+        RATE_LIMIT_BACKOFFS.inc(reason=reason)
+        RATE_LIMIT_RATE.set(rate, domain=domain)
+        return rate, backoff
+
+    def get_state(self):
+        """
+            Returns:
+                list: A dictionary per domain with its rate, the end of its backoff and its blocks in a row.
+        """
+        self.connect()
+        columns = ('domain', 'rate', 'backoff_until', 'blocks')
+        rows = self.cursor.execute(f"SELECT {', '.join(columns)} FROM rate_limits ORDER BY domain").fetchall()
+        self.close()
+        return [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,237 @@
+import argparse
+import html as html_escape
+import json
+import re
+import threading
+import zipfile
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Scripts, stylesheets and media of a recorded page would load from the live site, they are removed so a
+# replay never leaves the machine and takes the same time on every run
+SCRIPT_PATTERN = re.compile(r'<script\b.*?</script\s*>', re.IGNORECASE | re.DOTALL)
+EXTERNAL_TAG_PATTERN = re.compile(r'<(?:link|iframe|base)\b[^>]*>(?:\s*</iframe\s*>)?', re.IGNORECASE)
+MEDIA_SOURCE_PATTERN = re.compile(r'\s(?:src|srcset)=("[^"]*"|\'[^\']*\')', re.IGNORECASE)
+WIDGET_PATTERN = re.compile(r'data-testid=["\']([\w-]+)["\']')
+VOUCHER_PARAMETER = 'replay_voucher'
+
+# Click handler added to the replayed pages. Clicking the n-th card of a widget does what the live site does:
+# the voucher popup opens in a new tab and the current tab goes to the shop behind the voucher.
+CLICK_SHIM = '''
+<script>
+(function () {
+    var vouchers = %(vouchers)s;
+    document.addEventListener('click', function (event) {
+        var card = event.target.closest('[data-testid$="vouchers-widget"] > div');
+        if (!card) {
+            return;
+        }
+        var cards = Array.prototype.filter.call(card.parentElement.children, function (element) {
+            return element.tagName === 'DIV';
+        });
+        var key = card.parentElement.getAttribute('data-testid') + '-' + (cards.indexOf(card) + 1);
+        if (!(key in vouchers)) {
+            return;
+        }
+        event.preventDefault();
+        event.stopPropagation();
+        window.open(location.pathname + '?%(parameter)s=' + encodeURIComponent(key), '_blank');
+        location.href = '/out?to=' + encodeURIComponent(vouchers[key] || '');
+    }, true);
+})();
+</script>
+'''
+
+
+def clean_page(html):
+    html = SCRIPT_PATTERN.sub('', html)
+    html = EXTERNAL_TAG_PATTERN.sub('', html)
+    return MEDIA_SOURCE_PATTERN.sub('', html)
+
+
+def add_click_shim(html, vouchers, extra_script=''):
+    # '</' would end the script tag early if a merchant URL contains it
+    shim = CLICK_SHIM % {'vouchers': json.dumps(vouchers).replace('</', '<\\/'), 'parameter': VOUCHER_PARAMETER}
+    shim += extra_script
+    if '</body>' in html:
+        return html.replace('</body>', shim + '</body>', 1)
+    return html + shim
+
+
+def voucher_key(xpath, index):
+    # '//div[@data-testid="active-vouchers-widget"]/div' and 3 give 'active-vouchers-widget-3'
+    match = WIDGET_PATTERN.search(xpath)
+    return f"{match.group(1) if match else 'vouchers-widget'}-{index}"
+
+
+class SnapshotArchive:
+    """
+        Compressed archive of recorded pages, one zip file with a manifest.json that maps the
+        paths of the site to the stored pages:
+
+            {
+                "base_url": "https://www.cuponation.com.au",
+                "recorded_at": "...",
+                "allshop": "allshop.html",
+                "shops": {
+                    "/amazon": {
+                        "name": "Amazon",
+                        "page": "shops/1/page.html",
+                        "vouchers": {"active-vouchers-widget-1": {"popup": "shops/1/active-vouchers-widget-1.html",
+                                                                  "merchant_url": "https://..."}}
+                    }
+                }
+            }
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+        self.zip_file = None
+        # Shop pages can be saved again after the see more click, they are written once on close
+        self.pending_pages = {}
+        self.lock = threading.Lock()
+
+    # Writing
+
+    def open_for_writing(self, base_url):
+        self.zip_file = zipfile.ZipFile(self.path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+        self.manifest = {'base_url': base_url, 'recorded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                         'allshop': None, 'shops': {}}
+
+    def write_page(self, name, html):
+        with self.lock:
+            self.zip_file.writestr(name, clean_page(html))
+
+    def save_allshop(self, html):
+        self.write_page('allshop.html', html)
+        self.manifest['allshop'] = 'allshop.html'
+
+    def shop_entry(self, url, name=None):
+        path = urlparse(url).path
+        if path not in self.manifest['shops']:
+            self.manifest['shops'][path] = {'name': name, 'page': None, 'vouchers': {}}
+        entry = self.manifest['shops'][path]
+        if name:
+            entry['name'] = name
+        return entry
+
+    def save_shop_page(self, url, html, name=None):
+        entry = self.shop_entry(url, name)
+        number = list(self.manifest['shops']).index(urlparse(url).path) + 1
+        entry['page'] = f"shops/{number}/page.html"
+        self.pending_pages[entry['page']] = html
+
+    def save_voucher(self, url, key, popup_html, merchant_url):
+        entry = self.shop_entry(url)
+        number = list(self.manifest['shops']).index(urlparse(url).path) + 1
+        popup = f"shops/{number}/{key}.html"
+        entry['vouchers'][key] = {'popup': popup, 'merchant_url': merchant_url}
+        self.write_page(popup, popup_html)
+
+    def close(self):
+        if self.zip_file is None:
+            return
+        if self.zip_file.mode == 'w':
+            for name, html in self.pending_pages.items():
+                self.write_page(name, html)
+            self.pending_pages = {}
+            self.zip_file.writestr('manifest.json', json.dumps(self.manifest, indent=2))
+        self.zip_file.close()
+        self.zip_file = None
+
+    # Reading
+
+    def open_for_reading(self):
+        self.zip_file = zipfile.ZipFile(self.path, 'r')
+        self.manifest = json.loads(self.zip_file.read('manifest.json'))
+        return self
+
+    def read_page(self, name):
+        with self.lock:
+            return self.zip_file.read(name).decode('utf-8')
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    site = None
+
+    def do_GET(self):
+        status, body = self.site.render(self.path, f"http://{self.headers.get('Host', 'localhost')}")
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplaySite:
+    def __init__(self, archive):
+        """
+            Serves the pages of a SnapshotArchive. Pages are read from the archive, the links to the live
+            site are pointed at the local server and the click shim is added to the shop pages.
+        """
+        self.archive = archive
+        self.manifest = archive.manifest
+        self.base_url = self.manifest['base_url'].rstrip('/')
+
+    def localize(self, html, local_url):
+        return html.replace(self.base_url, local_url)
+
+    def render(self, raw_path, local_url):
+        """
+            Returns:
+                tuple: (status, html)
+        """
+        parsed = urlparse(raw_path)
+        query = parse_qs(parsed.query)
+
+        if parsed.path == '/out':
+            # Stand-in for the shop behind a voucher
+            target = html_escape.escape(query.get('to', [''])[0])
+            return 200, f"<html><head><title>Redirect</title></head><body><p>{target}</p></body></html>"
+
+        if parsed.path == '/allshop' and self.manifest.get('allshop'):
+            return 200, self.localize(self.archive.read_page(self.manifest['allshop']), local_url)
+
+        shop = self.manifest['shops'].get(parsed.path)
+        if shop is None or shop['page'] is None:
+            return 404, '<html><body><h1>Not found</h1></body></html>'
+
+        vouchers = {key: voucher['merchant_url'] for key, voucher in shop['vouchers'].items()}
+        key = query.get(VOUCHER_PARAMETER, [None])[0]
+        if key in shop['vouchers']:
+            html = self.archive.read_page(shop['vouchers'][key]['popup'])
+        else:
+            html = self.archive.read_page(shop['page'])
+        return 200, add_click_shim(self.localize(html, local_url), vouchers)
+
+    def write_links_file(self, file_path, local_url):
+        # The links file of the scraper, pointing at the replayed shops
+        with open(file_path, 'w') as file:
+            for path, shop in self.manifest['shops'].items():
+                if shop['page'] is not None:
+                    file.write(f"{local_url}{path}, {shop['name'] or path.strip('/')}, False\n")
+
+
+def create_server(site, host='127.0.0.1', port=8000):
+    handler = type('BoundReplayRequestHandler', (ReplayRequestHandler,), {'site': site})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a recorded snapshot archive of cuponation.com.au.')
+    parser.add_argument('archive')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = create_server(ReplaySite(SnapshotArchive(args.archive).open_for_reading()), args.host, args.port)
+    print(f"Replaying {args.archive} on http://{args.host}:{args.port}")
+    server.serve_forever()
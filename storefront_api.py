@@ -0,0 +1,232 @@
+import argparse
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from ManageDB import Database
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024):
+        """
+            Bounded LRU cache of encoded responses. Every entry belongs to the change sequence that was
+            current when it was built, the whole cache is dropped as soon as the sequence moves on.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.seq = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, seq):
+        with self.lock:
+            if seq != self.seq:
+                # The coupons changed, nothing in the cache can be trusted anymore
+                self.entries.clear()
+                self.seq = seq
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, seq, entry):
+        with self.lock:
+            if seq != self.seq:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class StorefrontAPI:
+    # Columns of the coupons table returned by the API. Only tracked columns, the cache and the ETags are
+    # keyed on the change sequence and Database.UNTRACKED_COLUMNS such as last_scrapped never move it
+    COUPON_FIELDS = ('id', 'title', 'description', 'offer', 'order_ammount', 'limitations_for_users',
+                     'limitations_on_brands', 'button_name', 'code', 'url', 'company_name', 'shop_id',
+                     'discount_percent', 'discount_amount', 'currency', 'min_spend', 'free_shipping')
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 500
+
+    def __init__(self, db_name='coupons.db', cache_size=1024, pool_size=8):
+        """
+            Read only query service over coupons.db for the storefront. Requests borrow a read only
+            connection from a pool, with the database in WAL mode they never block the crawler or each other.
+        """
+        self.db_name = db_name
+        self.cache = ResponseCache(cache_size)
+        self.pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self.pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def current_seq(self, conn):
+        # The last change sequence, a primary key lookup that tells if anything changed since the cache was built
+        return conn.execute("SELECT MAX(seq) FROM coupon_changes").fetchone()[0] or 0
+
+    def fetch_coupons(self, conn, where, params, limit):
+        rows = conn.execute(f'''
+            SELECT {', '.join(self.COUPON_FIELDS)} FROM coupons
+            WHERE deleted_at IS NULL AND {where}
+            ORDER BY id LIMIT ?
+        ''', list(params) + [limit]).fetchall()
+        coupons = [dict(zip(self.COUPON_FIELDS, row)) for row in rows]
+        # Keyset pagination, the next page starts after the last id of this one
+        next_after = coupons[-1]['id'] if len(coupons) == limit else None
+        return {'coupons': coupons, 'next_after': next_after}
+
+    def coupons_by_company(self, conn, company, after, limit):
+        return self.fetch_coupons(conn, 'company_name = ? AND id > ?', (company, after), limit)
+
+    def coupons_by_code(self, conn, code, after, limit):
+        return self.fetch_coupons(conn, 'code = ? AND id > ?', (code, after), limit)
+
+    def recent_changes(self, conn, since, limit):
+        rows = conn.execute('''
+            SELECT seq, coupon_id, operation, changed_fields, changed_at FROM coupon_changes
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (since, limit)).fetchall()
+        changes = [{
+            'seq': row[0],
+            'coupon_id': row[1],
+            'operation': row[2],
+            'changed_fields': json.loads(row[3]) if row[3] else {},
+            'changed_at': row[4],
+        } for row in rows]
+        return {'changes': changes, 'next_since': changes[-1]['seq'] if changes else since}
+
+    def search(self, conn, text, limit):
+        match_query = Database.build_match_query(text)
+        if match_query is None:
+            return {'coupons': []}
+        rows = conn.execute(f'''
+            SELECT {', '.join('c.' + field for field in self.COUPON_FIELDS)}
+            FROM coupons_fts JOIN coupons c ON c.id = coupons_fts.rowid
+            WHERE coupons_fts MATCH ? AND c.deleted_at IS NULL
+            ORDER BY coupons_fts.rank LIMIT ?
+        ''', (match_query, limit)).fetchall()
+        return {'coupons': [dict(zip(self.COUPON_FIELDS, row)) for row in rows]}
+
+    def best_deals(self, conn, sort, limit):
+        column, direction = {
+            'percent': ('discount_percent', 'DESC'),
+            'amount': ('discount_amount', 'DESC'),
+            'min_spend': ('min_spend', 'ASC'),
+        }[sort]
+        rows = conn.execute(f'''
+            SELECT {', '.join(self.COUPON_FIELDS)} FROM coupons
+            WHERE deleted_at IS NULL AND {column} IS NOT NULL
+            ORDER BY {column} {direction}, id {direction} LIMIT ?
+        ''', (limit,)).fetchall()
+        return {'coupons': [dict(zip(self.COUPON_FIELDS, row)) for row in rows]}
+
+    def route(self, conn, path, query):
+        """
+            Maps a request to its query.
+
+            Returns:
+                tuple: (status, payload)
+        """
+        after = int(query.get('after', ['0'])[0])
+        limit = max(1, min(int(query.get('limit', [self.DEFAULT_LIMIT])[0]), self.MAX_LIMIT))
+
+        if path == '/coupons' and 'company' in query:
+            return 200, self.coupons_by_company(conn, query['company'][0], after, limit)
+        if path.startswith('/coupons/code/'):
+            return 200, self.coupons_by_code(conn, unquote(path[len('/coupons/code/'):]), after, limit)
+        if path == '/search' and 'q' in query:
+            return 200, self.search(conn, query['q'][0], limit)
+        if path == '/deals' and query.get('sort', ['percent'])[0] in ('percent', 'amount', 'min_spend'):
+            return 200, self.best_deals(conn, query.get('sort', ['percent'])[0], limit)
+        if path == '/changes':
+            return 200, self.recent_changes(conn, int(query.get('since', ['0'])[0]), limit)
+        return 404, {'error': 'Not found'}
+
+    def handle(self, raw_path):
+        """
+            Answers a GET request from the cache or the database.
+
+            Returns:
+                tuple: (status, etag, body)
+        """
+        parsed = urlparse(raw_path)
+        with self.connection() as conn:
+            seq = self.current_seq(conn)
+            cached = self.cache.get(raw_path, seq)
+            if cached is not None:
+                return cached
+
+            try:
+                status, payload = self.route(conn, parsed.path, parse_qs(parsed.query))
+            except ValueError:
+                status, payload = 400, {'error': 'Invalid parameter'}
+
+        body = json.dumps(payload).encode('utf-8')
+        etag = f'"{seq}-{hashlib.md5(body).hexdigest()[:16]}"'
+        if status == 200:
+            self.cache.put(raw_path, seq, (status, etag, body))
+        return status, etag, body
+
+
+class StorefrontRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, the storefront reuses its connections, and no Nagle delay between headers and body
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    api = None
+
+    def do_GET(self):
+        status, etag, body = self.api.handle(self.path)
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(db_name='coupons.db', host='127.0.0.1', port=8080, cache_size=1024):
+    handler = type('BoundStorefrontRequestHandler', (StorefrontRequestHandler,),
+                   {'api': StorefrontAPI(db_name, cache_size)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read only HTTP API over the coupons database.')
+    parser.add_argument('--db', default='coupons.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    server = create_server(args.db, args.host, args.port, args.cache_size)
+    print(f"Storefront API listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,252 @@
+import argparse
+import html
+import random
+import string
+from urllib.parse import parse_qs, urlparse
+
+from coupon_model import Coupon
+from replay_server import VOUCHER_PARAMETER, add_click_shim, create_server
+
+SYLLABLES = ['ba', 'bo', 'ca', 'co', 'da', 'de', 'fi', 'fo', 'ga', 'ha', 'ki', 'la', 'lu', 'ma', 'mi', 'na', 'no',
+             'pa', 'pe', 'ra', 'ri', 'sa', 'so', 'ta', 'to', 'va', 'vi', 'xa', 'yo', 'za', 'ze']
+SUFFIXES = ['', '', ' Store', ' Shop', ' Outlet', ' Online', ' AU', ' Direct']
+PRODUCTS = ['shoes', 'dresses', 'furniture', 'electronics', 'beauty', 'travel', 'flights', 'hotels', 'toys',
+            'books', 'groceries', 'jewellery', 'sportswear', 'laptops', 'phones', 'pet food', 'gifts']
+OFFERS = ['5%', '10%', '15%', '20%', '25%', '30%', '40%', '50%', '$5', '$10', '$15', '$20', '$50', 'Free shipping']
+USERS = ['All users', 'New customers', 'Existing customers', 'Members only', 'Students']
+
+# Opens the hidden cards of the see more button and closes the voucher popup, like the live site
+SITE_SCRIPT = '''
+<script>
+document.addEventListener('click', function (event) {
+    var seeMore = event.target.closest('.r0c5x30 > div');
+    if (seeMore) {
+        var widget = document.querySelector('[data-testid="active-vouchers-widget"]');
+        widget.appendChild(document.getElementById('more-vouchers').content.cloneNode(true));
+        seeMore.parentElement.remove();
+        return;
+    }
+    if (event.target.closest('[data-testid="CloseIcon"]')) {
+        document.querySelector('[data-testid="voucherPopup-root"]').remove();
+    }
+});
+</script>
+'''
+
+
+class SyntheticSite:
+    WIDGETS = ('active-vouchers-widget', 'similar-vouchers-widget')
+
+    def __init__(self, number_of_shops=600, coupons_per_shop=30, similar_per_shop=6, visible_coupons=20,
+                 churn=0.1, seed=0):
+        """
+            Fake Cuponation site with the DOM the scraper relies on: the alphabet sections of the allshop
+            page, the active and similar voucher widgets, the see more button and the voucher popups.
+
+            Pages are rendered on request from the seed, so 10k shops with 100 coupons each don't need to
+            be stored anywhere. It has the render and write_links_file methods of ReplaySite and is served
+            by the same server.
+
+            Args:
+                churn (float): Part of the coupons of a shop replaced by new ones at every crawl round.
+        """
+        self.number_of_shops = number_of_shops
+        self.coupons_per_shop = coupons_per_shop
+        self.similar_per_shop = similar_per_shop
+        self.visible_coupons = visible_coupons
+        self.churn = churn
+        self.seed = seed
+        # Crawl round of the site, set it to a higher number to get the coupons of a later crawl
+        self.round_number = 0
+
+        rng = random.Random(f"{seed}:shops")
+        self.shops = []
+        self.shops_by_path = {}
+        used_names = set()
+        for number in range(1, number_of_shops + 1):
+            name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+            name += rng.choice(SUFFIXES)
+            if name in used_names:
+                name = f"{name} {number}"
+            used_names.add(name)
+            path = '/' + name.lower().replace(' ', '-')
+            shop = {'number': number, 'name': name, 'path': path}
+            self.shops.append(shop)
+            self.shops_by_path[path] = shop
+
+    # Content
+
+    def card_count(self, widget):
+        return self.coupons_per_shop if widget == 'active-vouchers-widget' else self.similar_per_shop
+
+    def card(self, shop, widget, index):
+        """
+            The card at a position of a widget. Every crawl round replaces a part of the coupons, the others
+            keep the same title and description and are seen again by the scraper.
+
+            Returns:
+                dict: kind ('code', 'deal', 'subscribe' or 'banner') and the fields of the coupon.
+        """
+        if widget == 'active-vouchers-widget' and index == 3:
+            return {'kind': 'banner'}
+        if widget == 'active-vouchers-widget' and index == 5:
+            return {'kind': 'subscribe'}
+
+        generation = 0
+        for round_number in range(1, self.round_number + 1):
+            if random.Random(f"{self.seed}:{shop['number']}:{widget}:{index}:{round_number}").random() < self.churn:
+                generation = round_number
+        rng = random.Random(f"{self.seed}:{shop['number']}:{widget}:{index}:{generation}")
+
+        offer = rng.choice(OFFERS)
+        product = rng.choice(PRODUCTS)
+        minimum = rng.choice([None, 30, 50, 80, 100, 150])
+        kind = 'code' if rng.random() < 0.6 else 'deal'
+        return {
+            'kind': kind,
+            'title': f"{offer} {'on' if offer == 'Free shipping' else 'off'} {product} at {shop['name']} #{index}.{generation}",
+            'description': f"Save {offer} on selected {product} at {shop['name']}. Offer {widget[:1]}{index}.",
+            'offer': offer,
+            'order_ammount': f"${minimum}" if minimum else 'No minimum order',
+            'limitations_for_users': rng.choice(USERS),
+            'limitations_on_brands': rng.choice(['All brands', f"{product.capitalize()} only", 'Excludes sale items']),
+            'code': ''.join(rng.choices(string.ascii_uppercase + string.digits, k=8)) if kind == 'code' else None,
+            'merchant_url': f"https://shop.example/{shop['path'].strip('/')}?voucher={index}.{generation}",
+        }
+
+    def generate_coupons(self, shop):
+        """
+            The coupons a crawl of the shop would save in the current round, without a browser.
+
+            Returns:
+                list: Coupon records.
+        """
+        coupons = []
+        for widget in self.WIDGETS:
+            for index in range(1, self.card_count(widget) + 1):
+                card = self.card(shop, widget, index)
+                if card['kind'] in ('banner', 'subscribe'):
+                    continue
+                coupons.append(Coupon(
+                    title=card['title'], description=card['description'], offer=card['offer'],
+                    order_ammount=card['order_ammount'], limitations_for_users=card['limitations_for_users'],
+                    limitations_on_brands=card['limitations_on_brands'],
+                    button_name='SEE CODE' if card['kind'] == 'code' else 'GET DEAL', code=card['code'],
+                    url=card['merchant_url'], company_name=shop['name']
+                ))
+        return coupons
+
+    # Pages
+
+    def render_card(self, card):
+        if card['kind'] == 'banner':
+            return '<div data-testid="kam-banner-main-1"><p>Sponsored</p></div>'
+        if card['kind'] == 'subscribe':
+            return '<div><h3>Get the best vouchers by email</h3><div role="button">SUBSCRIBE</div></div>'
+        button = 'SEE CODE' if card['kind'] == 'code' else 'GET DEAL'
+        return (f"<div><span>{html.escape(card['offer'])}</span><h3>{html.escape(card['title'])}</h3>"
+                f"<div role=\"button\">{button}</div></div>")
+
+    def render_popup(self, card):
+        code = ''
+        if card['code']:
+            code = f"<span data-testid=\"voucherPopup-codeHolder-voucherType-code\"><h4>{card['code']}</h4></span>"
+        terms = ''.join(f"<p><b>{label}:</b> {html.escape(card[field])}</p>" for label, field in (
+            ('Offer', 'offer'), ('Order amount', 'order_ammount'), ('Limitation for Users', 'limitations_for_users'),
+            ('Limitations on Brands', 'limitations_on_brands')))
+        return f'''
+            <div data-testid="voucherPopup-root">
+                <div data-testid="voucherPopup-header-popupTitleWrapper"><h4>{html.escape(card['title'])}</h4></div>
+                {code}
+                <div data-testid="voucherPopup-collapsablePanel-header"><button>Terms and conditions</button></div>
+                <div data-testid="voucherPopup-termsAndConditions-root">
+                    <div data-testid="rich-text-root"><p>{html.escape(card['description'])}</p>{terms}</div>
+                </div>
+                <span data-testid="CloseIcon" role="button">x</span>
+            </div>
+        '''
+
+    def render_shop(self, shop, voucher):
+        vouchers = {}
+        widgets = {}
+        for widget in self.WIDGETS:
+            cards = []
+            for index in range(1, self.card_count(widget) + 1):
+                card = self.card(shop, widget, index)
+                cards.append(self.render_card(card))
+                if card['kind'] in ('code', 'deal'):
+                    vouchers[f"{widget}-{index}"] = card['merchant_url']
+            widgets[widget] = cards
+
+        active = widgets['active-vouchers-widget']
+        see_more = ''
+        if len(active) > self.visible_coupons:
+            see_more = (f"<div class=\"r0c5x30\"><div role=\"button\">See more</div></div>"
+                        f"<template id=\"more-vouchers\">{''.join(active[self.visible_coupons:])}</template>")
+        popup = ''
+        if voucher in vouchers:
+            widget, index = voucher.rsplit('-', 1)
+            popup = self.render_popup(self.card(shop, widget, int(index)))
+
+        page = f'''<html><head><title>{html.escape(shop['name'])} vouchers</title></head><body>
+            <h1>{html.escape(shop['name'])} voucher codes</h1>
+            <div data-testid="active-vouchers-widget">{''.join(active[:self.visible_coupons])}</div>
+            {see_more}
+            <h2>Similar vouchers</h2>
+            <div data-testid="similar-vouchers-widget">{''.join(widgets['similar-vouchers-widget'])}</div>
+            {popup}
+        </body></html>'''
+        return add_click_shim(page, vouchers, SITE_SCRIPT)
+
+    def render_allshop(self, local_url):
+        sections = {}
+        for shop in self.shops:
+            letter = shop['name'][0].upper()
+            sections.setdefault(letter if letter.isalpha() else '0-9', []).append(shop)
+        rendered = []
+        for letter in sorted(sections):
+            links = ''.join(f"<a href=\"{local_url}{shop['path']}\">{html.escape(shop['name'])}</a>"
+                            for shop in sections[letter])
+            rendered.append(f"<div><h2>{letter}</h2><div><div>{links}</div></div></div>")
+        return (f"<html><head><title>All shops</title></head><body>"
+                f"<div data-testid=\"alphabet-sections\">{''.join(rendered)}</div></body></html>")
+
+    def render(self, raw_path, local_url):
+        """
+            Returns:
+                tuple: (status, html)
+        """
+        parsed = urlparse(raw_path)
+        query = parse_qs(parsed.query)
+        if parsed.path == '/out':
+            return 200, f"<html><body><p>{html.escape(query.get('to', [''])[0])}</p></body></html>"
+        if parsed.path == '/allshop':
+            return 200, self.render_allshop(local_url)
+        shop = self.shops_by_path.get(parsed.path)
+        if shop is None:
+            return 404, '<html><body><h1>Not found</h1></body></html>'
+        return 200, self.render_shop(shop, query.get(VOUCHER_PARAMETER, [None])[0])
+
+    def write_links_file(self, file_path, local_url):
+        with open(file_path, 'w') as file:
+            for shop in self.shops:
+                file.write(f"{local_url}{shop['path']}, {shop['name']}, False\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a synthetic Cuponation-like site for scale tests.')
+    parser.add_argument('--shops', type=int, default=10000)
+    parser.add_argument('--coupons', type=int, default=100, help='Coupons in the active widget of every shop')
+    parser.add_argument('--similar', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--links', help='Write a links file of the shops for ScrappingCoupon.file_path')
+    args = parser.parse_args()
+
+    site = SyntheticSite(args.shops, args.coupons, args.similar, seed=args.seed)
+    local_url = f"http://{args.host}:{args.port}"
+    if args.links:
+        site.write_links_file(args.links, local_url)
+    print(f"Serving {args.shops} synthetic shops on {local_url} (CUPONATION_BASE_URL={local_url})")
+    create_server(site, args.host, args.port).serve_forever()
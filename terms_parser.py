@@ -0,0 +1,100 @@
+import re
+from html.parser import HTMLParser
+
+# The rich text block of the voucher popup that holds the terms paragraphs
+RICH_TEXT_TEST_ID = 'rich-text-root'
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def clean_text(text):
+    # Line breaks of <br> are kept, the rest of the whitespace was already collapsed by handle_data
+    lines = [line.strip(' ') for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+
+class TermsHTMLParser(HTMLParser):
+    def __init__(self):
+        """
+            Collects the <p> paragraphs of the rich text block. Every <b> label of a paragraph
+            is kept with the text that follows it, up to the next label.
+        """
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        # Depth of open <div> tags inside the rich text block, None while outside of it
+        self.rich_text_depth = None
+        self.paragraph = None
+        self.label = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'div':
+            if self.rich_text_depth is not None:
+                self.rich_text_depth += 1
+            elif dict(attrs).get('data-testid') == RICH_TEXT_TEST_ID:
+                self.rich_text_depth = 0
+        elif tag == 'p' and self.rich_text_depth is not None:
+            self.paragraph = {'text': [], 'labels': []}
+        elif tag == 'b' and self.paragraph is not None:
+            self.label = []
+        elif tag == 'br' and self.paragraph is not None:
+            self.add_text('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'div' and self.rich_text_depth is not None:
+            self.rich_text_depth -= 1
+            if self.rich_text_depth < 0:
+                self.rich_text_depth = None
+        elif tag == 'p' and self.paragraph is not None:
+            labels = [(label, clean_text(''.join(value))) for label, value in self.paragraph['labels']]
+            self.paragraphs.append((clean_text(''.join(self.paragraph['text'])), labels))
+            self.paragraph = None
+        elif tag == 'b' and self.label is not None:
+            self.paragraph['labels'].append((clean_text(''.join(self.label)), []))
+            self.label = None
+
+    def handle_data(self, data):
+        if self.paragraph is not None:
+            # Whitespace of the HTML source, newlines included, renders as one space
+            self.add_text(WHITESPACE_PATTERN.sub(' ', data))
+
+    def add_text(self, data):
+        self.paragraph['text'].append(data)
+        if self.label is not None:
+            self.label.append(data)
+        elif self.paragraph['labels']:
+            # Value of the last label
+            self.paragraph['labels'][-1][1].append(data)
+
+
+def parse_terms_html(html):
+    """
+        Parses the innerHTML of the voucherPopup-termsAndConditions-root element into the
+        fields of the terms, without a browser.
+
+        A paragraph with a <b> label, e.g. "<b>Order amount:</b> $50", gives the label and the
+        text after it as its value. A paragraph without a label is free text, the first
+        one is usually the description.
+
+        Args:
+            html (str): The HTML of the terms block.
+
+        Returns:
+            list: (label, value) tuples in the order of the page, the label is None for free text.
+    """
+    parser = TermsHTMLParser()
+    parser.feed(html or '')
+    parser.close()
+
+    terms = []
+    for text, labels in parser.paragraphs:
+        if not text:
+            continue  # Skip empty <p> elements
+
+        labels = [(label, value) for label, value in labels if label]
+        if not labels:
+            terms.append((None, text))
+            continue
+
+        for label, value in labels:
+            # Remove the colon between the label and its value
+            terms.append((label.strip(':').strip(), value.lstrip(':').strip()))
+    return terms
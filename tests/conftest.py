@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repository, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ManageDB import Database  # noqa: E402
+from coupon_model import Coupon  # noqa: E402
+from cuponation import ScrappingCoupon  # noqa: E402
+
+SHOP_URL = 'https://www.cuponation.com.au/acme'
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(db_name=str(tmp_path / 'coupons.db'))
+    database.create_table()
+    return database
+
+
+@pytest.fixture
+def scraper(tmp_path, monkeypatch):
+    """
+        A ScrappingCoupon without Chrome, the rate limiter or Telegram, working in tmp_path. The shop
+        Acme has one coupon that was last seen long ago, so a sweep that works expires it.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ScrappingCoupon, 'send_telegram_message', lambda self, bot_token, chat_id, message: None)
+    scraper = ScrappingCoupon()
+    scraper.rate_limiter = None
+    scraper.file_path = str(tmp_path / 'all_shop_links.txt')
+    with open(scraper.file_path, 'w') as file:
+        file.write(f"{SHOP_URL}, Acme, False\n")
+    scraper.database = Database(str(tmp_path / 'coupons.db'), missed_limit=1, grace_hours=0)
+    scraper.database.create_table()
+    scraper.database.insert_coupons([Coupon(title='A', description='A description', company_name='Acme')])
+    scraper.database.connect()
+    scraper.database.cursor.execute("UPDATE coupons SET last_scrapped = '2024-01-01 00:00:00'")
+    scraper.database.conn.commit()
+    scraper.database.close()
+    return scraper
+
+
+def live_titles(db, company_name='Acme'):
+    columns, rows = db.get_live_coupons(company_name)
+    titles = [row[columns.index('title')] for row in rows]
+    db.close()
+    return titles
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_engine import AsyncShopCrawler, PageBlocked
+from conftest import SHOP_URL, live_titles
+from coupon_model import Coupon
+from rate_limiter import RateLimiter
+
+
+class FakePage:
+    def __init__(self, captcha=False):
+        self.captcha = captcha
+        self.closed = False
+
+    async def evaluate(self, script):
+        return self.captcha
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+
+    async def new_page(self):
+        self.pages.append(FakePage())
+        return self.pages[-1]
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+
+
+@pytest.fixture
+def crawler(scraper):
+    crawler = AsyncShopCrawler(scraper)
+    crawler.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+    yield crawler
+    crawler.db_executor.shutdown()
+
+
+def crawl_shop(crawler, extract_coupons):
+    async def crawl():
+        crawler.extract_coupons = extract_coupons
+        run_id = await crawler.run_db(crawler.scraper.db.start_run)
+        context = FakeContext()
+        await crawler.crawl_shop(context, asyncio.Semaphore(1), run_id, SHOP_URL, 'Acme')
+        return context
+    return asyncio.run(crawl())
+
+
+def link_status(scraper):
+    return dict((link[0], link[2]) for link in scraper.read_links())[SHOP_URL]
+
+
+def shop_health(db):
+    db.connect()
+    row = db.cursor.execute("SELECT state, consecutive_failures, last_error FROM shop_health WHERE url = ?",
+                            (SHOP_URL,)).fetchone()
+    db.close()
+    return row
+
+
+def test_shop_that_works_is_saved_swept_and_marked_from_the_writer_thread(crawler, monkeypatch):
+    db = crawler.scraper.db
+    threads = []
+    insert_coupons = db.insert_coupons
+    monkeypatch.setattr(db, 'insert_coupons',
+                        lambda coupons: threads.append(threading.current_thread().name) or insert_coupons(coupons))
+
+    async def extract_coupons(pages, url, company_name, shop_run):
+        return [Coupon(title='B', description='B description', company_name=company_name)]
+
+    context = crawl_shop(crawler, extract_coupons)
+    assert threads and threads[0].startswith('db-writer')
+    assert live_titles(db) == ['B']
+    assert link_status(crawler.scraper) == 'True'
+    assert shop_health(db) == ('closed', 0, None)
+    assert all(page.closed for page in context.pages)
+    assert crawler.shops_done == 1
+
+
+def test_throttled_shop_is_not_swept_marked_or_counted_by_the_breaker(crawler):
+    async def extract_coupons(pages, url, company_name, shop_run):
+        raise PageBlocked('rate_limited')
+
+    crawl_shop(crawler, extract_coupons)
+    assert live_titles(crawler.scraper.db) == ['A']
+    assert link_status(crawler.scraper) == 'False'
+    assert shop_health(crawler.scraper.db) is None
+
+
+def test_shop_with_failed_stages_and_no_coupons_is_a_failed_visit(crawler):
+    async def extract_coupons(pages, url, company_name, shop_run):
+        shop_run['failures'] += 1
+        return []
+
+    crawl_shop(crawler, extract_coupons)
+    assert live_titles(crawler.scraper.db) == ['A']
+    assert shop_health(crawler.scraper.db) == ('closed', 1, '1 failed stages and no coupons')
+
+
+def test_shop_that_raises_is_a_failed_visit(crawler):
+    async def extract_coupons(pages, url, company_name, shop_run):
+        raise TimeoutError('page.goto: Timeout 30000ms exceeded')
+
+    crawl_shop(crawler, extract_coupons)
+    assert live_titles(crawler.scraper.db) == ['A']
+    assert link_status(crawler.scraper) == 'True'
+    assert shop_health(crawler.scraper.db) == ('closed', 1, 'TimeoutError: page.goto: Timeout 30000ms exceeded')
+
+
+def test_shop_that_keeps_returning_500_is_quarantined(crawler):
+    async def extract_coupons(pages, url, company_name, shop_run):
+        raise PageBlocked('server_error')
+
+    for visit in range(1, 4):
+        crawl_shop(crawler, extract_coupons)
+        # Done for this cycle, the other shops are not held back by it
+        assert link_status(crawler.scraper) == 'True'
+        crawler.scraper.update_url_status(SHOP_URL, 'False')
+    assert live_titles(crawler.scraper.db) == ['A']
+    assert shop_health(crawler.scraper.db) == ('open', 3, 'The site refused the page: server_error')
+    assert crawler.scraper.skip_quarantined([SHOP_URL]) == []
+
+
+def test_check_blocked_adapts_the_rate_limiter(crawler, tmp_path):
+    crawler.scraper.rate_limiter = RateLimiter(str(tmp_path / 'rate_limit.db'), rate=2.0, backoff_seconds=30)
+    domain = crawler.scraper.site_domain
+
+    assert asyncio.run(crawler.check_blocked(FakePage(), FakeResponse(200))) is None
+    assert crawler.scraper.rate_limiter.get_state()[0]['blocks'] == 0
+
+    assert asyncio.run(crawler.check_blocked(FakePage(captcha=True), FakeResponse(200))) == 'captcha'
+    assert asyncio.run(crawler.check_blocked(FakePage(), FakeResponse(429))) == 'rate_limited'
+    state = crawler.scraper.rate_limiter.get_state()[0]
+    # The 429 came during the backoff of the captcha, it is not a new block
+    assert (state['domain'], state['blocks'], state['rate']) == (domain, 1, pytest.approx(1.025))
+
+
+def test_similar_vouchers_are_opened_once_per_run(crawler):
+    assert not crawler.seen_before(None)
+    assert not crawler.seen_before('fingerprint')
+    crawler.seen_vouchers.add('fingerprint')
+    assert crawler.seen_before('fingerprint')
+    assert (crawler.similar_lookups, crawler.similar_hits) == (2, 1)
+
+
+def test_throttle_reserves_off_the_event_loop(crawler, tmp_path, monkeypatch):
+    crawler.scraper.rate_limiter = RateLimiter(str(tmp_path / 'rate_limit.db'), rate=100.0, burst=1)
+    threads = []
+    reserve = crawler.scraper.rate_limiter.reserve
+    monkeypatch.setattr(crawler.scraper.rate_limiter, 'reserve',
+                        lambda domain: threads.append(threading.current_thread()) or reserve(domain))
+
+    async def throttle_twice():
+        await crawler.throttle()
+        await crawler.throttle()
+
+    asyncio.run(throttle_twice())
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
@@ -0,0 +1,70 @@
+import json
+import time
+
+import pytest
+
+from conftest import SHOP_URL
+from rate_limiter import RateLimiter
+
+BROKEN_URL = 'https://www.cuponation.com.au/broken'
+
+
+class FakeDriver:
+    # Answers the broken shop with a 500, every other page loads
+    def __init__(self):
+        self.current_url = None
+        self.visits = []
+
+    def get(self, url):
+        self.current_url = url
+        self.visits.append(url)
+
+    def maximize_window(self):
+        pass
+
+    def get_log(self, name):
+        status = 500 if self.current_url == BROKEN_URL else 200
+        message = {'method': 'Network.responseReceived',
+                   'params': {'type': 'Document', 'response': {'status': status}}}
+        return [{'message': json.dumps({'message': message})}]
+
+    def execute_script(self, script):
+        return False
+
+
+@pytest.fixture
+def scraper(scraper, tmp_path, monkeypatch):
+    with open(scraper.file_path, 'a') as file:
+        file.write(f"{BROKEN_URL}, Broken, False\n")
+    scraper.chrome = FakeDriver()
+    scraper.rate_limiter = RateLimiter(str(tmp_path / 'rate_limit.db'), rate=10.0)
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(scraper, 'alphabet_section', lambda: None)
+
+    def scrape_all_shop_links():
+        scraper.shop_run['company_name'] = 'Acme'
+    monkeypatch.setattr(scraper, 'scrape_all_shop_links', scrape_all_shop_links)
+    return scraper
+
+
+def run_cycle(scraper):
+    # One pass of the crawl command: every link is reset once all of them were crawled
+    links = scraper.read_links()
+    if all(status == 'True' for _, _, status in links):
+        for url, _, _ in links:
+            scraper.update_url_status(url, 'False', notify=False)
+    scraper.start_webdriver()
+    return {url: status for url, _, status in scraper.read_links()}
+
+
+def test_shop_that_keeps_returning_500_does_not_hold_back_the_crawl(scraper):
+    for _ in range(4):
+        assert run_cycle(scraper) == {SHOP_URL: 'True', BROKEN_URL: 'True'}
+
+    visits = scraper.chrome.visits
+    assert visits.count(SHOP_URL) == 4
+    # Three failed visits quarantine the broken shop, the fourth cycle skips it
+    assert visits.count(BROKEN_URL) == 3
+    shop = scraper.db.get_quarantined_shops()[BROKEN_URL]
+    assert (shop['consecutive_failures'], shop['last_error']) == (3, 'The site refused the page: server_error')
+    assert SHOP_URL not in scraper.db.get_quarantined_shops(include_due=True)
@@ -0,0 +1,63 @@
+from coupon_model import Coupon
+
+
+def save(db, title, **fields):
+    return db.insert_coupons([Coupon(title=title, description=f'{title} description', company_name='Acme', **fields)])
+
+
+def test_compaction_forces_a_resync_for_a_lagging_target(db):
+    save(db, 'X', code='X1')  # seq 1
+    save(db, 'X', code='X2')  # seq 2
+    save(db, 'Y', code='Y1')  # seq 3
+    save(db, 'Y', code='Y2')  # seq 4
+    assert db.get_change_seq_range() == (1, 4)
+
+    # Only the latest change of every coupon is kept, the insert of Y is gone
+    assert db.compact_change_log(retention_days=-1) == 2
+    assert [change['seq'] for change in db.get_changes_since(0)] == [2, 4]
+
+    first_seq, last_seq = db.get_change_seq_range()
+    assert last_seq == 4
+    # A target that only saw seq 1 would get the partial update of Y without its insert, it has to resync
+    assert first_seq > 1 + 1
+    assert first_seq > 2 + 1
+    # A target that already saw everything up to the last deleted entry can keep reading the log
+    assert not first_seq > 3 + 1
+    assert not first_seq > 4 + 1
+
+
+def test_compaction_watermark_never_moves_back(db):
+    save(db, 'X', code='X1')
+    save(db, 'X', code='X2')
+    db.compact_change_log(retention_days=-1)
+    assert db.get_change_seq_range() == (2, 2)
+
+    # Nothing old enough to delete, the earlier watermark stays
+    save(db, 'Y', code='Y1')
+    assert db.compact_change_log() == 0
+    assert db.get_change_seq_range() == (2, 3)
+
+
+def test_uncompacted_log_keeps_its_range(db):
+    assert db.get_change_seq_range() == (0, 0)
+    save(db, 'X', code='X1')
+    assert db.get_change_seq_range() == (1, 1)
+
+
+def test_backfill_records_the_coupons_it_changes(db):
+    save(db, 'X', offer='20% off')
+    save(db, 'Y', offer='$10 off orders over $50')
+    db.connect()
+    # X was saved before the discount columns existed
+    db.cursor.execute("UPDATE coupons SET discount_percent = NULL, free_shipping = 0 WHERE title = 'X'")
+    db.conn.commit()
+    db.close()
+
+    assert db.backfill_discount_columns() == 1
+    changes = db.get_changes_since(2)
+    assert [(change['coupon_id'], change['operation']) for change in changes] == [(1, 'updated')]
+    assert changes[0]['changed_fields'] == {'discount_percent': 20.0}
+
+    # Nothing left to change, nothing recorded
+    assert db.backfill_discount_columns(only_missing=False) == 0
+    assert db.get_change_seq_range() == (1, 3)
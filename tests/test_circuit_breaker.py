@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+URL = 'https://www.cuponation.com.au/acme'
+
+
+def hours_until(timestamp):
+    return (datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S') - datetime.now()).total_seconds() / 3600
+
+
+def fail(db, times=1, error='TimeoutException: page load'):
+    for _ in range(times):
+        health = db.record_shop_visit(URL, 'Acme', error, failure_limit=3, quarantine_hours=6,
+                                      max_quarantine_hours=20)
+    return health
+
+
+def test_failures_below_the_limit_keep_the_circuit_closed(db):
+    health = fail(db, 2)
+    assert (health['state'], health['consecutive_failures'], health['opened']) == ('closed', 2, False)
+    assert db.get_quarantined_shops() == {}
+
+
+def test_failure_limit_opens_the_circuit(db):
+    fail(db, 2)
+    health = fail(db)
+    assert (health['state'], health['consecutive_failures'], health['opened']) == ('open', 3, True)
+    assert hours_until(health['next_probe_at']) == pytest.approx(6, abs=0.01)
+
+    shop = db.get_quarantined_shops()[URL]
+    assert (shop['company_name'], shop['quarantines'], shop['last_error']) == ('Acme', 1,
+                                                                               'TimeoutException: page load')
+    assert shop['quarantined_at'] is not None
+
+
+def test_success_resets_the_failures(db):
+    fail(db, 2)
+    health = db.record_shop_visit(URL, 'Acme')
+    assert health == {'state': 'closed', 'consecutive_failures': 0, 'next_probe_at': None, 'opened': False,
+                      'recovered': False}
+    # The count starts again, two more failures don't open the circuit
+    assert fail(db, 2)['state'] == 'closed'
+
+
+def test_failed_probes_double_the_quarantine_up_to_the_maximum(db):
+    fail(db, 3)
+    probe = fail(db)
+    assert (probe['state'], probe['opened']) == ('open', False)
+    assert hours_until(probe['next_probe_at']) == pytest.approx(12, abs=0.01)
+    assert hours_until(fail(db)['next_probe_at']) == pytest.approx(20, abs=0.01)
+    assert db.get_quarantined_shops()[URL]['quarantines'] == 3
+
+
+def test_probe_that_works_closes_the_circuit(db):
+    fail(db, 3)
+    health = db.record_shop_visit(URL)
+    assert (health['state'], health['recovered']) == ('closed', True)
+    assert db.get_quarantined_shops(include_due=True) == {}
+
+    db.connect()
+    row = db.cursor.execute("SELECT company_name, quarantines, quarantined_at, next_probe_at FROM shop_health "
+                            "WHERE url = ?", (URL,)).fetchone()
+    db.close()
+    # The name of an earlier visit is kept when the probe doesn't know it
+    assert row == ('Acme', 0, None, None)
+
+
+def test_due_probes(db):
+    fail(db, 3)
+    db.connect()
+    db.cursor.execute("UPDATE shop_health SET next_probe_at = '2024-01-01 00:00:00'")
+    db.conn.commit()
+    db.close()
+    assert db.get_quarantined_shops() == {}
+    assert list(db.get_quarantined_shops(include_due=True)) == [URL]
@@ -0,0 +1,13 @@
+from coupon_model import Coupon
+
+
+def test_coupons_are_hashable_on_their_key():
+    first = Coupon(title='20% off', description='Sitewide', code='ACME20', company_name='Acme')
+    same = Coupon.from_dict(first.to_dict())
+    new_code = Coupon(title='20% off', description='Sitewide', code='ACME21', company_name='Acme')
+
+    assert first == same
+    assert first != new_code
+    assert {first, same, new_code} == {first, new_code}
+    assert len({first, same}) == 1
+    assert {first: 1}[same] == 1
@@ -0,0 +1,21 @@
+from CouponExtraFeatures.ManageDatabase import DatabaseDetails
+
+
+def test_stale_companies(tmp_path):
+    db = DatabaseDetails(str(tmp_path / 'coupons_detail.db'))
+    db.create_table()
+    db.upsert_details([('Acme', 'acme.png', 'About Acme'), ('Beta', 'beta.png', 'About Beta'),
+                       ('Cola', 'cola.png', 'About Cola')])
+    db.connect()
+    db.cursor.execute("UPDATE coupons_details SET last_refreshed = '2024-01-01 00:00:00' WHERE company_name = 'Beta'")
+    db.cursor.execute("UPDATE coupons_details SET last_refreshed = NULL WHERE company_name = 'Cola'")
+    db.conn.commit()
+    db.close()
+
+    assert db.get_stale_companies() == {'Beta', 'Cola'}
+    assert db.get_stale_companies(ttl_days=100000) == {'Cola'}
+    assert db.get_company_names() == {'Acme', 'Beta', 'Cola'}
+
+    # A refresh makes the company fresh again
+    db.upsert_details([('Beta', 'beta.png', 'About Beta')])
+    assert db.get_stale_companies() == {'Cola'}
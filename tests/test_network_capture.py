@@ -0,0 +1,66 @@
+from network_capture import coupon_from_dict, find_vouchers
+
+# Trimmed __NEXT_DATA__ of a shop page: the vouchers of the shop next to teasers of other shops
+SHOP_PAGE_PAYLOAD = {
+    'props': {
+        'pageProps': {
+            'shop': {'id': 17, 'title': 'Acme', 'url': '/acme', 'logo': '/acme.png'},
+            'vouchers': [
+                {
+                    'id': 'v-1',
+                    'type': 'CODE',
+                    'title': '20% off sitewide',
+                    'discount': '20%',
+                    'code': 'ACME20',
+                    'termsAndConditions': '<p><b>Minimum order:</b> $50</p><p>New customers only</p>',
+                    'clickoutUrl': 'https://acme.example/?ref=1',
+                },
+                {
+                    'id': 'v-2',
+                    'type': 'DEAL',
+                    'title': 'Free shipping',
+                    'discount': 'Free shipping',
+                    'terms': 'Orders over $30',
+                    'clickoutUrl': 'https://acme.example/?ref=2',
+                },
+            ],
+            'similarShops': [
+                {'title': 'Nike', 'url': '/nike', 'discount': 'Up to 50%'},
+                {'title': 'Adidas', 'link': '/adidas', 'discount': 'Up to 30%', 'description': 'Sportswear'},
+                {'id': 42, 'title': 'Puma', 'url': '/puma', 'discount': 'Up to 40%', 'description': 'Running shoes'},
+            ],
+        },
+    },
+}
+
+
+def test_shop_teasers_are_not_vouchers():
+    assert find_vouchers({'shops': [{'title': 'Nike', 'url': '/nike', 'discount': 'Up to 50%'}]}, 'Acme') == []
+    assert coupon_from_dict({'title': 'Adidas', 'link': '/adidas', 'discount': 'Up to 30%',
+                             'description': 'Sportswear'}) is None
+    assert coupon_from_dict({'id': 42, 'title': 'Puma', 'url': '/puma', 'discount': 'Up to 40%',
+                             'description': 'Running shoes'}) is None
+    # An id next to a key that only vouchers have is still a voucher
+    assert coupon_from_dict({'id': 42, 'type': 'DEAL', 'title': 'Puma sale', 'discount': 'Up to 40%',
+                             'description': 'Running shoes'}) is not None
+
+
+def test_vouchers_of_a_shop_page_payload():
+    coupons = find_vouchers(SHOP_PAGE_PAYLOAD, 'Acme')
+    assert [coupon.title for coupon in coupons] == ['20% off sitewide', 'Free shipping']
+
+    code, deal = coupons
+    assert code.code == 'ACME20'
+    assert code.offer == '20%'
+    assert code.order_ammount == '$50'
+    assert code.description == 'New customers only'
+    assert code.url == 'https://acme.example/?ref=1'
+    assert code.button_name == 'SEE CODE'
+    assert code.company_name == 'Acme'
+    assert deal.description == 'Orders over $30'
+    assert deal.button_name == 'SEE DEAL'
+
+
+def test_voucher_with_a_code_needs_no_voucher_keys():
+    coupon = coupon_from_dict({'headline': '10% off', 'couponCode': 'TEN', 'savings': '10%'})
+    assert coupon.code == 'TEN'
@@ -0,0 +1,53 @@
+import pytest
+
+from offer_parser import parse_offer
+
+
+def parsed(discount_percent=None, discount_amount=None, currency=None, min_spend=None, free_shipping=0):
+    return {'discount_percent': discount_percent, 'discount_amount': discount_amount, 'currency': currency,
+            'min_spend': min_spend, 'free_shipping': free_shipping}
+
+
+@pytest.mark.parametrize('offer, expected', [
+    ('20% off', parsed(discount_percent=20.0)),
+    ('Up to 70% off sale items', parsed(discount_percent=70.0)),
+    ('12.5% off', parsed(discount_percent=12.5)),
+    ('$10 off', parsed(discount_amount=10.0, currency='AUD')),
+    ('$10', parsed(discount_amount=10.0, currency='AUD')),
+    ('US$15.99 off', parsed(discount_amount=15.99, currency='USD')),
+    ('€1,000 discount', parsed(discount_amount=1000.0, currency='EUR')),
+    ('Free shipping', parsed(free_shipping=1)),
+    ('Free express delivery', parsed(free_shipping=1)),
+    ('Exclusive deal', parsed()),
+    ('150% off', parsed()),
+])
+def test_offer(offer, expected):
+    assert parse_offer(offer) == expected
+
+
+def test_empty_coupon():
+    assert parse_offer() == parsed()
+
+
+def test_min_spend_from_the_order_amount_field():
+    assert parse_offer('$20 off', '$100') == parsed(discount_amount=20.0, currency='AUD', min_spend=100.0)
+    assert parse_offer('15% off', 'NZ$80') == parsed(discount_percent=15.0, currency='NZD', min_spend=80.0)
+
+
+def test_min_spend_from_the_text():
+    assert parse_offer('10% off orders over $50')['min_spend'] == 50.0
+    assert parse_offer('$5 off', description='Minimum spend of $40 applies')['min_spend'] == 40.0
+    # The discount itself is not a minimum spend
+    assert parse_offer('$5 off')['min_spend'] is None
+
+
+def test_offer_is_trusted_before_title_and_description():
+    result = parse_offer('25% off', title='Save 10% today', description='Get $15 off')
+    assert result['discount_percent'] == 25.0
+    # The amount off only comes from the title or description when the offer has none
+    assert result['discount_amount'] == 15.0
+
+
+def test_title_and_description_fill_an_empty_offer():
+    assert parse_offer(None, title='30% off everything')['discount_percent'] == 30.0
+    assert parse_offer('', description='Enjoy free delivery')['free_shipping'] == 1
@@ -0,0 +1,19 @@
+import os
+import tracemalloc
+
+from profiling import ShopProfiler
+
+
+def test_memory_tracing_only_runs_during_a_profiled_shop(tmp_path):
+    profiler = ShopProfiler(str(tmp_path), shops=['acme'], memory=True)
+    kept = []
+    for shop in ('acme-1', 'other', 'acme-2'):
+        with profiler.profile(f'https://www.cuponation.com.au/{shop}') as profile:
+            assert tracemalloc.is_tracing() == (profile is not None)
+            kept.append([str(number) for number in range(1000)])
+        assert not tracemalloc.is_tracing()
+
+    summaries = sorted(name for name in os.listdir(tmp_path) if name.endswith('.txt'))
+    assert len(summaries) == 2
+    with open(tmp_path / summaries[-1]) as file:
+        assert 'Growth since the previous profiled shop' in file.read()
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import live_titles
+
+
+class FakeDriver:
+    # No widget is ever found, WebDriverWait is not loaded without selenium and its checks return False
+    current_url = 'https://www.cuponation.com.au/acme'
+
+
+@pytest.fixture
+def scraper(scraper, monkeypatch):
+    scraper.chrome = FakeDriver()
+    monkeypatch.setattr(scraper, 'get_company_name', lambda: 'Acme')
+    return scraper
+
+
+def test_visit_that_works_sweeps_the_shop(scraper):
+    scraper.scrape_all_shop_links()
+    assert live_titles(scraper.db) == []
+    assert scraper.visit_error is None
+
+
+def test_visit_stopped_by_failed_cards_keeps_the_coupons(scraper):
+    scraper.visit_error = '3 cards in a row failed'
+    scraper.scrape_all_shop_links()
+    assert live_titles(scraper.db) == ['A']
+
+
+def test_visit_where_every_card_failed_keeps_the_coupons(scraper):
+    scraper.card_attempts = scraper.card_failures = 2
+    scraper.scrape_all_shop_links()
+    assert live_titles(scraper.db) == ['A']
+    assert scraper.visit_error == 'All 2 cards failed'
+
+
+def test_light_visit_never_sweeps(scraper, monkeypatch):
+    scraper.tier = 'light'
+    monkeypatch.setattr(scraper, 'refresh_listing', lambda crawl_started_at: 4)
+    scraper.scrape_all_shop_links()
+    assert live_titles(scraper.db) == ['A']
+    assert scraper.visit_error is None
+    assert scraper.shop_coupons == 4
+
+
+def test_light_visit_with_an_unreadable_listing_fails(scraper, monkeypatch):
+    scraper.tier = 'light'
+    monkeypatch.setattr(scraper, 'check_for_see_more_btn', lambda: None)
+    # The fake driver can't run the listing script
+    assert scraper.refresh_listing('2024-01-01 00:00:00') is None
+    scraper.scrape_all_shop_links()
+    assert scraper.visit_error == 'The listing could not be read'
+    assert live_titles(scraper.db) == ['A']
+
+
+class FoundWait:
+    # Every widget is there, without cards
+    def __init__(self, driver, timeout):
+        pass
+
+    def until(self, condition):
+        return []
+
+
+def test_deep_visit_expands_the_listing_once_per_widget(scraper, monkeypatch):
+    import cuponation
+
+    monkeypatch.setattr(cuponation, 'WebDriverWait', FoundWait)
+    monkeypatch.setattr(cuponation, 'EC', SimpleNamespace(presence_of_element_located=lambda locator: None,
+                                                          presence_of_all_elements_located=lambda locator: None))
+    monkeypatch.setattr(cuponation, 'By', SimpleNamespace(XPATH='xpath'))
+    clicks = []
+    monkeypatch.setattr(scraper, 'check_for_see_more_btn', lambda: clicks.append(1))
+    scraper.tier = 'deep'
+    scraper.scrape_all_shop_links()
+    # refresh_listing expands the active widget and collect_vouchers reuses it
+    assert len(clicks) == 2
+    assert scraper.listing_expanded is False
@@ -0,0 +1,34 @@
+from coupon_model import Coupon
+
+
+def test_linking_coupons_to_shops_is_recorded_in_the_change_log(db, tmp_path):
+    db.insert_coupons([Coupon(title='A', description='A', company_name='Acme'),
+                       Coupon(title='B', description='B', company_name='Beta'),
+                       Coupon(title='C', description='C')])
+    links_file = tmp_path / 'all_shop_links.txt'
+    links_file.write_text("https://www.cuponation.com.au/acme, Acme, True\n\n")
+    assert db.import_shop_links(str(links_file)) == 1
+    _, last_seq = db.get_change_seq_range()
+
+    # Beta only exists in the coupons table, it gets a shop of its own
+    assert db.link_coupons_to_shops() == 2
+    changes = db.get_changes_since(last_seq)
+    shop_ids = {name: shop_id for shop_id, name, _, _, _ in db.get_shops_with_coupon_count()}
+    assert [(change['coupon_id'], change['operation'], change['changed_fields']) for change in changes] == [
+        (1, 'updated', {'shop_id': shop_ids['Acme']}),
+        (2, 'updated', {'shop_id': shop_ids['Beta']}),
+    ]
+
+    # Nothing left to link, nothing recorded
+    assert db.link_coupons_to_shops() == 0
+    assert db.get_changes_since(last_seq) == changes
+
+
+def test_import_of_a_broken_links_file_is_rolled_back(db, tmp_path):
+    links_file = tmp_path / 'all_shop_links.txt'
+    links_file.write_text("https://www.cuponation.com.au/acme, Acme, True\n")
+    db.connect()
+    db.cursor.execute("DROP TABLE shops")
+    db.conn.commit()
+    db.close()
+    assert db.import_shop_links(str(links_file)) == 0
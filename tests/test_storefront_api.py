@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from ManageDB import Database
+from coupon_model import Coupon
+from storefront_api import StorefrontAPI
+
+
+@pytest.fixture
+def api(db):
+    db.insert_coupons([Coupon(title='A', description='A description', offer='20% off', company_name='Acme')])
+    api = StorefrontAPI(db.db_name, pool_size=1)
+    yield api
+    while not api.pool.empty():
+        api.pool.get().close()
+
+
+def test_public_fields_are_tracked_by_the_change_log(api):
+    assert not set(StorefrontAPI.COUPON_FIELDS) & set(Database.UNTRACKED_COLUMNS)
+
+
+def test_rescrape_without_changes_keeps_the_cached_response(api, db):
+    status, etag, body = api.handle('/coupons?company=Acme')
+    assert status == 200
+    assert [coupon['title'] for coupon in json.loads(body)['coupons']] == ['A']
+
+    # The next crawl sees the coupon again, only last_scrapped moves
+    db.insert_coupons([Coupon(title='A', description='A description', offer='20% off', company_name='Acme')])
+    assert api.handle('/coupons?company=Acme') == (status, etag, body)
+
+
+def test_change_invalidates_the_cached_response(api, db):
+    _, etag, _ = api.handle('/coupons?company=Acme')
+    db.insert_coupons([Coupon(title='A', description='A description', offer='30% off', company_name='Acme')])
+    _, new_etag, body = api.handle('/coupons?company=Acme')
+    assert new_etag != etag
+    assert json.loads(body)['coupons'][0]['discount_percent'] == 30.0
@@ -0,0 +1,56 @@
+from terms_parser import parse_terms_html
+
+
+def rich_text(body):
+    return f'<div data-testid="voucherPopup-termsAndConditions-root"><div data-testid="rich-text-root">{body}</div></div>'
+
+
+def test_labelled_paragraphs():
+    html = rich_text('<p>Save on everything.</p>'
+                     '<p><b>Order amount:</b> $50</p>'
+                     '<p><b>Limitation for users:</b> New customers</p>')
+    assert parse_terms_html(html) == [
+        (None, 'Save on everything.'),
+        ('Order amount', '$50'),
+        ('Limitation for users', 'New customers'),
+    ]
+
+
+def test_several_labels_in_one_paragraph_and_br():
+    html = rich_text('<p><b>Order amount:</b> $50<br><b>Code:</b> SAVE10</p>'
+                     '<p>Valid online<br/>and in store</p>')
+    assert parse_terms_html(html) == [
+        ('Order amount', '$50'),
+        ('Code', 'SAVE10'),
+        (None, 'Valid online\nand in store'),
+    ]
+
+
+def test_nested_divs_stay_inside_the_rich_text():
+    html = rich_text('<div><div><p><b>Limitations on brands:</b> Excludes Apple</p></div></div>'
+                     '<p>After the nested divs</p>') + '<p>Outside of the rich text</p>'
+    assert parse_terms_html(html) == [
+        ('Limitations on brands', 'Excludes Apple'),
+        (None, 'After the nested divs'),
+    ]
+
+
+def test_empty_paragraphs_are_skipped():
+    html = rich_text('<p></p><p>  \n </p><p><br></p><p>Only this one</p>')
+    assert parse_terms_html(html) == [(None, 'Only this one')]
+
+
+def test_labels_without_a_colon():
+    html = rich_text('<p><b>Order amount</b> $30</p><p><b>Code</b>: SAVE10</p>')
+    assert parse_terms_html(html) == [('Order amount', '$30'), ('Code', 'SAVE10')]
+
+
+def test_whitespace_and_entities_are_normalized():
+    html = rich_text('<p>\n   <b>Button name:</b>\n   Get&nbsp;deal &amp; save\n</p>')
+    assert parse_terms_html(html) == [('Button name', 'Get deal & save')]
+
+
+def test_empty_html():
+    assert parse_terms_html('') == []
+    assert parse_terms_html(None) == []
+    assert parse_terms_html('<p>No rich text block</p>') == []
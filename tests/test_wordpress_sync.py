@@ -0,0 +1,121 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ManageDB import Database
+from coupon_model import Coupon
+from wordpress_sync import CouponSync
+
+
+class RecordingWordPress(BaseHTTPRequestHandler):
+    # Applies the batches like the plugin would and keeps every request it received
+    requests = []
+    coupons = {}
+    seen_keys = set()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        key = self.headers['Idempotency-Key']
+        self.requests.append((key, payload))
+        if key not in self.seen_keys:
+            self.seen_keys.add(key)
+            for item in payload['items']:
+                if item['operation'] == 'upsert':
+                    self.coupons[item['id']] = item['coupon']
+                else:
+                    self.coupons.pop(item['id'], None)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    RecordingWordPress.requests = []
+    RecordingWordPress.coupons = {}
+    RecordingWordPress.seen_keys = set()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecordingWordPress)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/wp-json/coupons/v1/sync"
+    server.shutdown()
+    server.server_close()
+
+
+def save(db, title, company_name, code):
+    db.insert_coupons([Coupon(title=title, description=f'{title} description', code=code, company_name=company_name)])
+
+
+def remove(db, company_name):
+    # Expires every coupon of the shop, purges it and compacts the log so its changes are gone
+    db.connect()
+    db.cursor.execute("UPDATE coupons SET last_scrapped = '2024-01-01 00:00:00' WHERE company_name = ?",
+                      (company_name,))
+    db.conn.commit()
+    db.close()
+    db.update_last_scrapped_column(company_name)
+    db.purge_deleted_coupons(retention_hours=-1)
+    db.compact_change_log(retention_days=-1)
+
+
+def live_codes(db):
+    db.connect()
+    codes = dict(db.cursor.execute("SELECT id, code FROM coupons WHERE deleted_at IS NULL").fetchall())
+    db.close()
+    return codes
+
+
+def resync_requests():
+    return [(key, payload) for key, payload in RecordingWordPress.requests if 'resync_seq' in payload]
+
+
+def test_sync_resyncs_compacted_changes_with_deletions(tmp_path, endpoint):
+    db = Database(str(tmp_path / 'coupons.db'), missed_limit=1, grace_hours=0)
+    db.create_table()
+    save(db, 'A', 'Acme', 'A1')
+    save(db, 'B', 'Beta', 'B1')
+    save(db, 'C', 'Cola', 'C1')
+    coupon_sync = CouponSync('site', endpoint, db_name=db.db_name, batch_size=2, max_workers=1,
+                             backoff_seconds=0)
+    coupon_sync.sync()
+    assert RecordingWordPress.coupons.keys() == {1, 2, 3}
+    assert not resync_requests()
+
+    # The removal of C is compacted away before the next sync, only a resync can delete it
+    remove(db, 'Cola')
+    coupon_sync.sync()
+    first_resync = resync_requests()
+    assert [key for key, _ in first_resync] == ['site-resync-4--1--2', 'site-resync-4--3--3']
+    assert {'id': 3, 'operation': 'delete'} in first_resync[1][1]['items']
+    assert {coupon_id: coupon['code'] for coupon_id, coupon in RecordingWordPress.coupons.items()} == live_codes(db)
+
+    # A second resync covers the same ids, it must not be ignored as a repeat of the first one
+    save(db, 'A', 'Acme', 'A2')
+    remove(db, 'Beta')
+    coupon_sync.sync()
+    second_resync = resync_requests()[len(first_resync):]
+    assert [key for key, _ in second_resync] == ['site-resync-6--1--2', 'site-resync-6--3--3']
+    assert {'id': 2, 'operation': 'delete'} in second_resync[0][1]['items']
+    assert {coupon_id: coupon['code'] for coupon_id, coupon in RecordingWordPress.coupons.items()} == {1: 'A2'}
+    assert coupon_sync.get_high_water_mark() == 6
+
+
+def test_sync_sends_only_the_delta(tmp_path, endpoint):
+    db = Database(str(tmp_path / 'coupons.db'))
+    db.create_table()
+    save(db, 'A', 'Acme', 'A1')
+    save(db, 'B', 'Beta', 'B1')
+    coupon_sync = CouponSync('site', endpoint, db_name=db.db_name, batch_size=10, max_workers=1,
+                             backoff_seconds=0)
+    coupon_sync.sync()
+    save(db, 'B', 'Beta', 'B2')
+    coupon_sync.sync()
+
+    keys = [key for key, _ in RecordingWordPress.requests]
+    assert keys == ['site-1-2', 'site-3-3']
+    assert RecordingWordPress.requests[1][1]['items'] == [
+        {'id': 2, 'operation': 'upsert', 'coupon': RecordingWordPress.coupons[2]}]
+    assert RecordingWordPress.coupons[2]['code'] == 'B2'
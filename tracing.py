@@ -0,0 +1,104 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Tracer:
+    def __init__(self, directory='Traces', sample_rate=0.01, slow_seconds=120, max_files=200):
+        """
+            Span based tracing of shop crawls, saved in the Chrome trace event format that Perfetto
+            (ui.perfetto.dev) and chrome://tracing open.
+
+            A trace covers one shop. It is saved when the shop was sampled, with probability sample_rate,
+            or when the shop took longer than slow_seconds, so the slow shops are always kept while the
+            normal ones cost a few list appends. With sample_rate 0 and no slow_seconds the spans do nothing.
+
+            Args:
+                directory (str): Where the trace files are written.
+                max_files (int): The oldest trace files above this number are removed.
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.max_files = max_files
+        self.enabled = sample_rate > 0 or slow_seconds is not None
+        self.events = None
+        self.trace_name = None
+        self.sampled = False
+        self.started = None
+        self.pid = os.getpid()
+
+    def now(self):
+        # Trace event timestamps are in microseconds
+        return time.perf_counter_ns() / 1000
+
+    def start_trace(self, name, **args):
+        if not self.enabled:
+            return
+        self.trace_name = name
+        self.sampled = random.random() < self.sample_rate
+        self.started = self.now()
+        self.events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': threading.get_ident(),
+            'args': {'name': f"cuponation {name}"},
+        }]
+        self.events.append({'name': 'trace', 'cat': 'shop', 'ph': 'i', 's': 'p', 'ts': self.started,
+                            'pid': self.pid, 'tid': threading.get_ident(),
+                            'args': {'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **args}})
+
+    @contextmanager
+    def span(self, name, category='scraper', **args):
+        """
+            Records the block as a complete event. The args dict is yielded so the block can add what it
+            learns, e.g. the text of a button. An exception is added to the args and goes on to the caller.
+        """
+        if self.events is None:
+            yield args
+            return
+        start = self.now()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+            raise
+        finally:
+            if self.events is not None:
+                self.events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': start,
+                                    'dur': self.now() - start, 'pid': self.pid, 'tid': threading.get_ident(),
+                                    'args': args})
+
+    def end_trace(self):
+        """
+            Ends the trace of the current shop and saves it when it was sampled or slow.
+
+            Returns:
+                str: The path of the trace file, None when the trace was dropped.
+        """
+        if self.events is None:
+            return None
+        events, self.events = self.events, None
+        seconds = (self.now() - self.started) / 1000000
+        slow = self.slow_seconds is not None and seconds >= self.slow_seconds
+        if not (self.sampled or slow):
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = re.sub(r'[^\w.-]+', '_', self.trace_name)[:80]
+        path = os.path.join(self.directory, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{safe_name}.json")
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'shop': self.trace_name, 'seconds': round(seconds, 3),
+                                     'reason': 'slow' if slow else 'sampled'}}, file)
+        self.remove_old_traces()
+        return path
+
+    def remove_old_traces(self):
+        files = sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                        if name.endswith('.json')), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.max_files)]:
+            os.remove(path)
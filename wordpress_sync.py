@@ -0,0 +1,258 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from dotenv import load_dotenv
+from ManageDB import Database
+
+# Load environment variables from .env file
+load_dotenv()
+
+
+class CouponSync:
+    # Columns of the coupons table that are published to the targets
+    COUPON_FIELDS = ('id', 'title', 'description', 'offer', 'order_ammount', 'limitations_for_users',
+                     'limitations_on_brands', 'button_name', 'code', 'url', 'company_name', 'shop_id',
+                     'discount_percent', 'discount_amount', 'currency', 'min_spend', 'free_shipping')
+    # Status codes that are worth retrying, everything else is a permanent failure
+    RETRY_STATUS_CODES = (408, 409, 425, 429, 500, 502, 503, 504)
+
+    def __init__(self, target, endpoint, db_name='coupons.db', batch_size=100, max_workers=4, max_retries=5,
+                 backoff_seconds=1.0, timeout=30, auth=None):
+        """
+            Pushes the coupon changes recorded in the change log of coupons.db to a REST endpoint,
+            such as a WordPress plugin route. Every target keeps its own high-water mark, the last
+            change sequence it has received, so a sync only sends what changed since the previous one.
+
+            Args:
+                target (str): Name of the target, used as key of its high-water mark.
+                endpoint (str): URL that receives the batches as a POST with a JSON body.
+                batch_size (int): Number of changes sent per request.
+                max_workers (int): Maximum number of requests in flight at the same time.
+                max_retries (int): Attempts per batch before the sync stops.
+                backoff_seconds (float): First retry delay, doubled after every failed attempt.
+                auth (tuple): Optional (user, password) for basic auth, e.g. a WordPress application password.
+        """
+        self.target = target
+        self.endpoint = endpoint
+        self.db = Database(db_name)
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.auth = auth
+        self.session = requests.Session()
+        self.db.create_table()
+        self.create_table()
+
+    def create_table(self):
+        self.db.connect()
+        self.db.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                target TEXT PRIMARY KEY,
+                last_seq INTEGER DEFAULT 0,  -- High-water mark, the last change seq the target received
+                last_synced TEXT
+            )
+        ''')
+        self.db.conn.commit()
+        self.db.close()
+
+    def get_high_water_mark(self):
+        self.db.connect()
+        row = self.db.cursor.execute("SELECT last_seq FROM sync_state WHERE target = ?", (self.target,)).fetchone()
+        self.db.close()
+        return row[0] if row else 0
+
+    def set_high_water_mark(self, seq):
+        current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.db.connect()
+        self.db.cursor.execute('''
+            INSERT INTO sync_state (target, last_seq, last_synced) VALUES (?, ?, ?)
+            ON CONFLICT(target) DO UPDATE SET last_seq = excluded.last_seq, last_synced = excluded.last_synced
+        ''', (self.target, seq, current_timestamp))
+        self.db.conn.commit()
+        self.db.close()
+
+    def build_items(self, coupon_ids):
+        """
+            Reads the current state of the coupons and turns it into the items sent to the target.
+            A coupon that is live becomes an upsert, an expired or purged one becomes a delete, so a
+            coupon changed many times in a window is sent once with its latest state.
+        """
+        self.db.connect()
+        self.db.cursor.execute(f'''
+            SELECT {', '.join(self.COUPON_FIELDS)} FROM coupons
+            WHERE id IN ({', '.join('?' * len(coupon_ids))}) AND deleted_at IS NULL
+        ''', list(coupon_ids))
+        live_coupons = {row[0]: dict(zip(self.COUPON_FIELDS, row)) for row in self.db.cursor.fetchall()}
+        self.db.close()
+
+        items = []
+        for coupon_id in coupon_ids:
+            if coupon_id in live_coupons:
+                items.append({'id': coupon_id, 'operation': 'upsert', 'coupon': live_coupons[coupon_id]})
+            else:
+                items.append({'id': coupon_id, 'operation': 'delete'})
+        return items
+
+    def build_batches(self, changes):
+        """
+            Splits the changes into batches of batch_size changes, in sequence order.
+
+            Returns:
+                list: A list of (first_seq, last_seq, items) tuples.
+        """
+        batches = []
+        for start in range(0, len(changes), self.batch_size):
+            chunk = changes[start:start + self.batch_size]
+            # dict.fromkeys keeps the order of the first appearance and drops repeated coupons
+            coupon_ids = list(dict.fromkeys(change['coupon_id'] for change in chunk))
+            batches.append((chunk[0]['seq'], chunk[-1]['seq'], self.build_items(coupon_ids)))
+        return batches
+
+    def push_batch(self, first_seq, last_seq, items, resync_seq=None):
+        """
+            Sends one batch to the target, retrying with exponential backoff on connection errors,
+            throttling and server errors. The idempotency key only depends on the target and the
+            covered change range, so a batch that is retried or sent again after a restart can be
+            recognized and ignored by the target.
+
+            Args:
+                resync_seq (int): Last change seq when the full resync that sends the batch started,
+                    part of the key so a later resync is not ignored as a repeat of an earlier one.
+
+            Returns:
+                bool: True if the target accepted the batch.
+        """
+        key = f"{self.target}-{first_seq}-{last_seq}"
+        payload = {'target': self.target, 'first_seq': first_seq, 'last_seq': last_seq, 'items': items}
+        if resync_seq is not None:
+            key = f"{self.target}-resync-{resync_seq}-{first_seq}-{last_seq}"
+            payload['resync_seq'] = resync_seq
+        headers = {'Idempotency-Key': key}
+        delay = self.backoff_seconds
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                response = self.session.post(self.endpoint, json=payload, headers=headers, auth=self.auth,
+                                             timeout=self.timeout)
+                if response.status_code < 300:
+                    return True
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    print(f"Batch {first_seq}-{last_seq} rejected: {response.status_code} {response.text[:200]}")
+                    return False
+                print(f"Batch {first_seq}-{last_seq} failed with {response.status_code}, attempt {attempt}")
+                retry_after = response.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            except requests.RequestException as e:
+                print(f"Batch {first_seq}-{last_seq} failed: {e}, attempt {attempt}")
+
+            if attempt < self.max_retries:
+                time.sleep(delay)
+                delay *= 2
+        return False
+
+    def sync(self, max_changes=None):
+        """
+            Pushes every change after the high-water mark of the target. Batches are sent concurrently,
+            max_workers at a time, and the high-water mark only moves past batches whose predecessors
+            were all accepted, so a failed batch is sent again by the next sync.
+
+            Returns:
+                dict: The number of pushed changes and coupons, the duration and the coupons per second.
+        """
+        start = time.perf_counter()
+        stats = {'changes': 0, 'coupons': 0, 'batches': 0, 'failed_batches': 0}
+        high_water_mark = self.get_high_water_mark()
+
+        first_seq, last_seq = self.db.get_change_seq_range()
+        if first_seq > high_water_mark + 1:
+            print(f"Change log was compacted past {high_water_mark} for {self.target}, sending every coupon")
+            sent = self.full_resync(last_seq)
+            if sent is None:
+                stats['failed_batches'] += 1
+                stats['seconds'] = time.perf_counter() - start
+                stats['coupons_per_second'] = 0.0
+                return stats
+            stats['coupons'] += sent
+            high_water_mark = last_seq
+            self.set_high_water_mark(high_water_mark)
+
+        window = self.batch_size * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while max_changes is None or stats['changes'] < max_changes:
+                changes = self.db.get_changes_since(high_water_mark, window)
+                if not changes:
+                    break
+
+                batches = self.build_batches(changes)
+                results = list(executor.map(lambda batch: self.push_batch(*batch), batches))
+
+                for (batch_first_seq, batch_last_seq, items), accepted in zip(batches, results):
+                    if not accepted:
+                        stats['failed_batches'] += 1
+                        break
+                    high_water_mark = batch_last_seq
+                    stats['batches'] += 1
+                    stats['coupons'] += len(items)
+                    stats['changes'] += sum(1 for change in changes
+                                            if batch_first_seq <= change['seq'] <= batch_last_seq)
+
+                self.set_high_water_mark(high_water_mark)
+                if stats['failed_batches']:
+                    break
+
+        stats['seconds'] = time.perf_counter() - start
+        stats['coupons_per_second'] = stats['coupons'] / stats['seconds'] if stats['seconds'] else 0.0
+        print(f"Synced {stats['coupons']} coupons to {self.target} in {stats['seconds']:.2f} s "
+              f"({stats['coupons_per_second']:.0f} coupons/s)")
+        return stats
+
+    def full_resync(self, resync_seq):
+        """
+            Sends every coupon id ever used to the target, used when its high-water mark is older than the
+            change log. Live coupons become upserts and every other id a delete, the removals of expired and
+            purged coupons may be gone from the compacted log. The batches use the negative coupon id range
+            as change range so they never clash with changes.
+
+            Args:
+                resync_seq (int): Last change seq when the resync started, see push_batch.
+
+            Returns:
+                int: The number of sent coupons, or None if a batch failed.
+        """
+        self.db.connect()
+        # AUTOINCREMENT ids are never reused, sqlite_sequence has the highest one even after a purge
+        row = self.db.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'coupons'").fetchone()
+        self.db.close()
+        max_id = row[0] if row else 0
+
+        sent = 0
+        for start in range(1, max_id + 1, self.batch_size):
+            chunk = list(range(start, min(start + self.batch_size, max_id + 1)))
+            if not self.push_batch(-chunk[0], -chunk[-1], self.build_items(chunk), resync_seq=resync_seq):
+                print(f"Full resync of {self.target} failed at coupon {chunk[0]}")
+                return None
+            sent += len(chunk)
+        return sent
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Push coupon changes to WordPress or an affiliate platform.')
+    parser.add_argument('--target', default='wordpress', help='Name of the target, each one has its own high-water mark')
+    parser.add_argument('--endpoint', default=os.getenv('WP_SYNC_URL'), help='URL that receives the batches')
+    parser.add_argument('--db', default='coupons.db')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    user = os.getenv('WP_SYNC_USER')
+    password = os.getenv('WP_SYNC_APP_PASSWORD')
+    coupon_sync = CouponSync(args.target, args.endpoint, db_name=args.db, batch_size=args.batch_size,
+                             max_workers=args.workers, auth=(user, password) if user else None)
+    coupon_sync.sync()